@@ -0,0 +1,119 @@
+'''
+Compare the per-datagram cost of receiving and sending on a plain UDP port, on
+a L{BatchPort} and, for sending, on a L{ScatterPort} with the segmentation
+offload.
+
+For the receive side, a burst of small datagrams, like the requests of many
+clients, is queued on the socket and the port is told, that it's readable,
+until it has read them all. For the send side, windows of DATA datagrams are
+sent one by one, with L{writeBatch<BatchPort.writeBatch>} and with the
+segmentation offload (GSO). Everything goes over the loopback interface, the
+reactor is not run.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.batching [datagrams]
+'''
+from tftp.datagram import DATADatagram, RRQDatagram
+from tftp.udp import BatchPort, ScatterPort, _recvmmsg, listenUDP
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+import socket
+import sys
+import time
+
+
+BATCH_SIZE = 32
+WINDOW_SIZE = 16
+# The best of this many runs is reported
+REPEAT = 3
+
+
+class Counter(DatagramProtocol):
+
+    received = 0
+
+    def datagramReceived(self, datagram, addr):
+        self.received += 1
+
+
+def bench_receive(port, peer, datagrams):
+    request = RRQDatagram(b'pxelinux.0', b'octet', {}).to_wire()
+    addr = ('127.0.0.1', port.getHost().port)
+    elapsed = 0
+    received = 0
+    # Don't overflow the receive buffer of the socket
+    while received < datagrams:
+        burst = min(256, datagrams - received)
+        for i in range(burst):
+            peer.sendto(request, addr)
+        port.protocol.received = 0
+        start = time.perf_counter()
+        while port.protocol.received < burst:
+            port.doRead()
+        elapsed += time.perf_counter() - start
+        received += burst
+    return elapsed
+
+
+def bench_send(port, peer, datagrams, batch, block_size):
+    window = [DATADatagram(n, b'x' * block_size).to_wire()
+              for n in range(WINDOW_SIZE)]
+    buf = bytearray(block_size + 4)
+    elapsed = 0
+    for i in range(datagrams // WINDOW_SIZE):
+        start = time.perf_counter()
+        if batch:
+            port.writeBatch(window)
+        else:
+            for datagram in window:
+                port.write(datagram)
+        elapsed += time.perf_counter() - start
+        for datagram in window:
+            peer.recv_into(buf)
+    return elapsed
+
+
+def main(datagrams=100000):
+    if _recvmmsg is None:
+        sys.exit("recvmmsg is not available on this platform")
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.bind(('127.0.0.1', 0))
+    peer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    plain = reactor.listenUDP(0, Counter(), '127.0.0.1')
+    batched = listenUDP(0, Counter(), '127.0.0.1', batch_size=BATCH_SIZE)
+    offloaded = listenUDP(0, Counter(), '127.0.0.1', offload=True)
+    assert isinstance(batched, BatchPort)
+    batched.send_batches = True
+    ports = [('send', plain, False), ('sendmmsg', batched, True)]
+    if isinstance(offloaded, ScatterPort) and offloaded.offload:
+        ports.append(('gso', offloaded, True))
+    try:
+        results = []
+        for label, port in (('recvfrom', plain), ('recvmmsg', batched)):
+            elapsed = min(bench_receive(port, peer, datagrams)
+                          for i in range(REPEAT))
+            results.append(elapsed)
+            print("receive %-9s %8.3f s  %6.2f us/datagram" % (
+                label, elapsed, elapsed / datagrams * 1e6))
+        print("receive speedup: %.1fx" % (results[0] / results[1]))
+        for label, port, batch in ports:
+            port.connect(*peer.getsockname())
+        for block_size in (512, 1428, 8192):
+            results = []
+            for label, port, batch in ports:
+                elapsed = min(bench_send(port, peer, datagrams, batch, block_size)
+                              for i in range(REPEAT))
+                results.append(elapsed)
+                print("send    %-9s %5d %8.3f s  %6.2f us/datagram  %.1fx" % (
+                    label, block_size, elapsed, elapsed / datagrams * 1e6,
+                    results[0] / elapsed))
+    finally:
+        plain.stopListening()
+        batched.stopListening()
+        offloaded.stopListening()
+        peer.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
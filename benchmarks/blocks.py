@@ -0,0 +1,124 @@
+'''
+Compare the per-block cost of the sessions for synchronous and asynchronous
+backends.
+
+A L{ReadSession} is fed an ACK for every block it sends and a L{WriteSession}
+is fed a DATA datagram for every block it expects. The backends are the
+filesystem ones, which return their results right away, and the same ones
+wrapped to return an already fired L{Deferred}, which takes the path, that
+every block used to take before the sessions learned to continue inline.
+The unwrapped filesystem reader also reads the blocks straight into the send
+buffers (C{readinto}), which the wrapped one doesn't offer. The timers run on a
+L{Clock}, so that the reactor doesn't add to the cost.
+
+Usage, from the root of the repository: python -m benchmarks.blocks [blocks]
+'''
+from tftp.backend import FilesystemReader, FilesystemWriter
+from tftp.datagram import ACK_WIRE, DATADatagram
+from tftp.session import ReadSession, WriteSession
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+import sys
+import tempfile
+import time
+
+
+BLOCK_SIZE = 512
+# The best of this many runs is reported
+REPEAT = 3
+
+
+class NullTransport(object):
+
+    def write(self, data, addr=None):
+        pass
+
+    def stopListening(self):
+        pass
+
+
+class DeferredReader(object):
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def read(self, size):
+        return succeed(self.reader.read(size))
+
+    def finish(self):
+        self.reader.finish()
+
+
+class DeferredWriter(object):
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, data):
+        return succeed(self.writer.write(data))
+
+    def finish(self):
+        self.writer.finish()
+
+    def cancel(self):
+        self.writer.cancel()
+
+
+def unwrapped(backend):
+    return backend
+
+
+def bench_read(path, blocks, wrap):
+    clock = Clock()
+    session = ReadSession(wrap(FilesystemReader(path)), _clock=clock)
+    session.transport = NullTransport()
+    session.startProtocol()
+    session.nextBlock()
+    start = time.perf_counter()
+    for blocknum in range(1, blocks + 1):
+        session.blockReceived(blocknum % 65536, ACK_WIRE[blocknum % 65536])
+        clock.advance(0)
+    elapsed = time.perf_counter() - start
+    session.cancel()
+    return elapsed
+
+
+def bench_write(path, blocks, wrap):
+    clock = Clock()
+    session = WriteSession(wrap(FilesystemWriter(path)), _clock=clock)
+    session.transport = NullTransport()
+    session.startProtocol()
+    datagrams = [DATADatagram(blocknum % 65536, b'x' * BLOCK_SIZE).to_wire()
+                 for blocknum in range(1, blocks + 1)]
+    start = time.perf_counter()
+    for blocknum, datagram in enumerate(datagrams, 1):
+        session.blockReceived(blocknum % 65536, datagram)
+        clock.advance(0)
+    elapsed = time.perf_counter() - start
+    session.cancel()
+    return elapsed
+
+
+def main(blocks=100000):
+    temp_dir = FilePath(tempfile.mkdtemp())
+    try:
+        source = temp_dir.child('source')
+        source.setContent(b'x' * BLOCK_SIZE * (blocks + 1))
+        target = temp_dir.child('target')
+        for name, bench, path, wrapper in (
+                ('read', bench_read, source, DeferredReader),
+                ('write', bench_write, target, DeferredWriter)):
+            results = []
+            for label, wrap in (('deferred', wrapper), ('sync', unwrapped)):
+                elapsed = min(bench(path, blocks, wrap) for i in range(REPEAT))
+                results.append(elapsed)
+                print("%-5s %-9s %8.3f s  %6.2f us/block" % (
+                    name, label, elapsed, elapsed / blocks * 1e6))
+            print("%-5s speedup: %.1fx" % (name, results[0] / results[1]))
+    finally:
+        temp_dir.remove()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,100 @@
+'''
+Show, what the access hints of L{FilesystemReader} do to the page cache.
+
+A large file is streamed through a reader in blocks, like a transfer does,
+once without hints, once with C{advise} and once with C{drop_behind}. Before
+each run the file is dropped from the page cache, so that it's read from the
+disk. The time it took and how much of the file is left in the page cache
+afterwards (C{mincore}) are reported. Whatever is left, is what pushes the
+other files out of the cache, when there is not enough memory for all of
+them.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.pagecache [megabytes]
+'''
+from tftp.backend import FilesystemReader
+from twisted.python.filepath import FilePath
+import ctypes
+import ctypes.util
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+
+BLOCK_SIZE = 8192
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+_libc.mmap.restype = ctypes.c_void_p
+_libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                       ctypes.c_int, ctypes.c_int, ctypes.c_long)
+_libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+_libc.mincore.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p)
+
+
+def resident(path):
+    """The share of the pages of the file, that are in the page cache"""
+    size = os.path.getsize(path)
+    pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        addr = _libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if addr in (None, ctypes.c_void_p(-1).value):
+            raise OSError(ctypes.get_errno(), "mmap failed")
+        try:
+            vec = ctypes.create_string_buffer(pages)
+            if _libc.mincore(addr, size, vec):
+                raise OSError(ctypes.get_errno(), "mincore failed")
+            return sum(byte & 1 for byte in vec.raw) / float(pages)
+        finally:
+            _libc.munmap(addr, size)
+    finally:
+        os.close(fd)
+
+
+def evict(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def stream(path, **hints):
+    reader = FilesystemReader(FilePath(path), **hints)
+    buf = bytearray(BLOCK_SIZE)
+    start = time.perf_counter()
+    while reader.readinto(buf) == BLOCK_SIZE:
+        pass
+    reader.finish()
+    return time.perf_counter() - start
+
+
+def main(megabytes=256):
+    if getattr(os, 'posix_fadvise', None) is None:
+        sys.exit("posix_fadvise is not available on this platform")
+    size = megabytes << 20
+    fd, path = tempfile.mkstemp(dir=os.environ.get('BENCH_DIR'))
+    try:
+        chunk = os.urandom(1 << 20)
+        with os.fdopen(fd, 'wb') as f:
+            for i in range(megabytes):
+                f.write(chunk)
+        for label, hints in (('plain', {}),
+                             ('advise', {'advise': True}),
+                             ('drop-behind', {'drop_behind': size // 2})):
+            evict(path)
+            before = resident(path)
+            elapsed = stream(path, **hints)
+            print("%-11s %8.3f s  %7.1f MB/s  cached before %5.1f%%, "
+                  "after %5.1f%%" % (label, elapsed, megabytes / elapsed,
+                                     before * 100, resident(path) * 100))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
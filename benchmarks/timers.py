@@ -0,0 +1,62 @@
+'''
+Compare the per-block cost of the retransmission timers.
+
+Every block of a transfer stops the timer of the previous block and starts a
+new one, that sends the datagram right away and then waits for the ACK. This
+runs that cycle against the real reactor (without running it, the due calls
+are processed with C{runUntilCurrent}) for L{timedCaller} and for
+L{SessionTimer}.
+
+Usage, from the root of the repository: python -m benchmarks.timers [blocks]
+'''
+from functools import partial
+from tftp.util import SessionTimer, timedCaller
+from twisted.internet import reactor
+import sys
+import time
+
+
+TIMEOUT = (1, 3, 7)
+
+
+def noop(*args):
+    pass
+
+
+def bench_timedCaller(blocks):
+    watchdog = timedCaller((0,) + TIMEOUT, noop, noop, clock=reactor)
+    start = time.perf_counter()
+    for blocknum in range(blocks):
+        watchdog.cancel()
+        watchdog = timedCaller(
+            (0,) + TIMEOUT, partial(noop, blocknum), noop, clock=reactor)
+        reactor.runUntilCurrent()
+    elapsed = time.perf_counter() - start
+    watchdog.cancel()
+    return elapsed
+
+
+def bench_SessionTimer(blocks):
+    timer = SessionTimer(noop, noop, clock=reactor)
+    start = time.perf_counter()
+    for blocknum in range(blocks):
+        timer.stop()
+        timer.start(TIMEOUT, 0)
+        reactor.runUntilCurrent()
+    elapsed = time.perf_counter() - start
+    timer.cancel()
+    return elapsed
+
+
+def main(blocks=100000):
+    results = []
+    for bench in (bench_timedCaller, bench_SessionTimer):
+        elapsed = bench(blocks)
+        results.append(elapsed)
+        print("%-20s %8.3f s  %6.2f us/block" % (
+            bench.__name__[len('bench_'):], elapsed, elapsed / blocks * 1e6))
+    print("speedup: %.1fx" % (results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
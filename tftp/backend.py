@@ -1,14 +1,34 @@
 '''
 @author: shylent
 '''
+from collections import deque
 from os import fstat
+import os
+import stat
 from tftp.errors import Unsupported, FileExists, AccessViolation, FileNotFound
 from tftp.util import deferred
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python import log
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath, InsecurePath
+from twisted.python.threadpool import ThreadPool
+import mmap
 import shutil
 import tempfile
 from zope import interface
 
+
+_pread = getattr(os, 'pread', None)
+_preadv = getattr(os, 'preadv', None)
+_fadvise = getattr(os, 'posix_fadvise', None)
+
+# How much of the beginning of a file is asked for right away (WILLNEED)
+_WILLNEED_SIZE = 1 << 21
+# How often the pages behind the cursor are dropped from the page cache
+_DROP_INTERVAL = 1 << 21
+
 class IBackend(interface.Interface):
     """An object, that manages interaction between the TFTP network protocol and
     anything, where you can get files from or put files to (a filesystem).
@@ -62,7 +82,15 @@ class IBackend(interface.Interface):
         """
 
 class IReader(interface.Interface):
-    """An object, that performs reads on request of the TFTP protocol"""
+    """An object, that performs reads on request of the TFTP protocol
+
+    A reader may also provide C{readinto(buffer)}, that reads up to
+    C{len(buffer)} bytes into the given writable buffer and returns their
+    number (or a L{Deferred}, that will be fired with it), following the same
+    rules as L{read} otherwise. The sessions then read the blocks straight into
+    the buffers, that they are sent from, instead of allocating them.
+
+    """
 
     size = interface.Attribute(
         "The size of the file to be read, or C{None} if it's not known.")
@@ -79,8 +107,9 @@ class IReader(interface.Interface):
         @type size: C{int}
 
         @return: data, that was read or a L{Deferred}, that will be fired with
-        the data, that was read.
-        @rtype: C{bytes} or L{Deferred}
+        the data, that was read. Besides C{bytes}, the data may be a
+        C{memoryview}, so that it doesn't have to be copied.
+        @rtype: C{bytes}, C{memoryview} or L{Deferred}
 
         """
 
@@ -97,6 +126,9 @@ class IWriter(interface.Interface):
     def write(data):
         """Attempt to write the data
 
+        @param data: data to be written
+        @type data: C{bytes}
+
         @return: C{None} or a L{Deferred}, that will fire with C{None} (any errors,
         that occured during the write will be available in an errback)
         @rtype: C{NoneType} or L{Deferred}
@@ -122,17 +154,83 @@ class FilesystemReader(object):
     @param file_path: a path to file, that we will read from
     @type file_path: L{FilePath<twisted.python.filepath.FilePath>}
 
+    @param advise: whether to tell the kernel, that the file will be read
+    sequentially (C{POSIX_FADV_SEQUENTIAL}), so that it reads ahead more, and
+    to start reading its beginning right away (C{POSIX_FADV_WILLNEED})
+    @type advise: C{bool}
+
+    @param drop_behind: if the file is larger, than this many bytes, its pages
+    are dropped from the page cache (C{POSIX_FADV_DONTNEED}) once they have
+    been read, so that streaming a large file doesn't evict the files, that
+    are read often. 0 keeps them.
+    @type drop_behind: C{int}
+
     @raise FileNotFound: if the file does not exist
 
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, advise=False, drop_behind=0):
         self.file_path = file_path
         try:
             self.file_obj = self.file_path.open('r')
         except IOError:
             raise FileNotFound(self.file_path)
         self.state = 'active'
+        self._identity = None
+        # The pages before this offset have been dropped, None, if they are
+        # kept
+        self._dropped = None
+        self._undropped = 0
+        if type(self).read is not FilesystemReader.read:
+            # A subclass, that changes how the data is read, must not be
+            # bypassed
+            self.readinto = None
+        if _fadvise is not None and (advise or drop_behind):
+            self._advise(advise, drop_behind)
+
+    def _advise(self, advise, drop_behind):
+        fd = self.file_obj.fileno()
+        if advise:
+            _fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            _fadvise(fd, 0, _WILLNEED_SIZE, os.POSIX_FADV_WILLNEED)
+        if drop_behind and fstat(fd).st_size > drop_behind:
+            self._dropped = 0
+
+    def _dropBehind(self, size):
+        """C{size} more bytes have been read, drop the pages behind the cursor,
+        if enough of them have been read since the last time.
+
+        """
+        self._undropped += size
+        if self._undropped < _DROP_INTERVAL:
+            return
+        self._undropped = 0
+        offset = self.file_obj.tell()
+        if offset > self._dropped:
+            _fadvise(self.file_obj.fileno(), self._dropped,
+                     offset - self._dropped, os.POSIX_FADV_DONTNEED)
+            self._dropped = offset
+
+    def _close(self):
+        if self._dropped is not None:
+            # The rest of the file, that might have been read ahead
+            _fadvise(self.file_obj.fileno(), self._dropped, 0,
+                     os.POSIX_FADV_DONTNEED)
+        self.file_obj.close()
+
+    @property
+    def identity(self):
+        """Identifies this version of the file (see L{BlockCache<tftp.cache.BlockCache>})"""
+        if self._identity is None and not self.file_obj.closed:
+            stat = fstat(self.file_obj.fileno())
+            self._identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns,
+                              stat.st_size)
+        return self._identity
+
+    def seek(self, offset):
+        """Continue reading at C{offset}"""
+        if self.state == 'active':
+            self.file_obj.seek(offset)
 
     @property
     def size(self):
@@ -158,19 +256,355 @@ class FilesystemReader(object):
         data = self.file_obj.read(size)
         if not data:
             self.state = 'eof'
-            self.file_obj.close()
+            self._close()
+        elif self._dropped is not None:
+            self._dropBehind(len(data))
         return data
 
+    def readinto(self, buffer):
+        """Read up to C{len(buffer)} bytes into C{buffer}.
+
+        @see: L{IReader}
+
+        @return: number of bytes, that were read
+        @rtype: C{int}
+
+        """
+        if self.state in ('eof', 'finished'):
+            return 0
+        size = self.file_obj.readinto(buffer)
+        if not size:
+            self.state = 'eof'
+            self._close()
+        elif self._dropped is not None:
+            self._dropBehind(size)
+        return size
+
     def finish(self):
         """
         @see: L{IReader.finish}
 
         """
         if self.state not in ('eof', 'finished'):
-            self.file_obj.close()
+            self._close()
         self.state = 'finished'
 
 
+class FileMappings(object):
+    """Memory mappings of files, that are shared by the readers of the same
+    version of a file and unmapped, when the last of them is done.
+
+    @ivar mappings: maps the identity of the file (see
+    L{FilesystemReader.identity}) to C{[mapping, view, users]}
+    @type mappings: C{dict}
+
+    """
+
+    def __init__(self):
+        self.mappings = {}
+
+    def acquire(self, file_obj, identity):
+        """Map the file, unless it's mapped already, and get a view of it.
+
+        @param file_obj: the open file
+        @type file_obj: C{file}
+
+        @param identity: identity of the file
+        @type identity: any hashable
+
+        @return: a view of the whole file
+        @rtype: C{memoryview}
+
+        """
+        entry = self.mappings.get(identity)
+        if entry is None:
+            if identity[-1]:
+                mapping = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mapping)
+            else:
+                # Empty files can not be mapped
+                mapping, view = None, memoryview(b'')
+            entry = self.mappings[identity] = [mapping, view, 0]
+        entry[2] += 1
+        return entry[1]
+
+    def release(self, identity):
+        """The reader of the file is done with the view, that it acquired."""
+        entry = self.mappings[identity]
+        entry[2] -= 1
+        if entry[2]:
+            return
+        del self.mappings[identity]
+        mapping, view, users = entry
+        view.release()
+        if mapping is not None:
+            try:
+                mapping.close()
+            except BufferError:
+                # Some slices are still referenced, the file is unmapped, once
+                # they are collected
+                pass
+
+
+class FileDescriptors(object):
+    """Descriptors of open files, that are shared by the readers of the same
+    file (the same path and inode), so that a file, which is being read by
+    many transfers at once, is only open once.
+
+    A descriptor is closed after it has not been used for C{idle_timeout}
+    seconds. If the file has been replaced since it was opened, the new file
+    is opened for the new readers and the old descriptor is closed, when the
+    last of its readers is done.
+
+    @ivar files: maps the paths of the files to C{[fd, (dev, inode), users,
+    idle]}, where C{idle} is the delayed call, that closes an unused
+    descriptor
+    @type files: C{dict}
+
+    @ivar idle_timeout: how long an unused descriptor is kept open, in seconds
+    @type idle_timeout: C{int} or C{float}
+
+    """
+
+    def __init__(self, idle_timeout=10, _clock=None):
+        self.files = {}
+        self.idle_timeout = idle_timeout
+        if _clock is None:
+            self._clock = reactor
+        else:
+            self._clock = _clock
+
+    def acquire(self, file_path):
+        """Get a descriptor of the file, opening it, unless it's open already.
+
+        @param file_path: a path to the file
+        @type file_path: L{FilePath<twisted.python.filepath.FilePath>}
+
+        @raise FileNotFound: if the file does not exist
+
+        @return: the entry of the file, that has to be passed to L{release},
+        once it's not needed anymore
+        @rtype: C{list}
+
+        """
+        path = file_path.path
+        entry = self.files.get(path)
+        if entry is not None:
+            try:
+                current = os.stat(path)
+            except OSError:
+                raise FileNotFound(file_path)
+            if entry[1] != (current.st_dev, current.st_ino):
+                # Replaced, the old file is closed, when its readers are done
+                self._retire(path, entry)
+                entry = None
+        if entry is None:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                raise FileNotFound(file_path)
+            opened = os.fstat(fd)
+            if stat.S_ISDIR(opened.st_mode):
+                os.close(fd)
+                raise FileNotFound(file_path)
+            entry = self.files[path] = [
+                fd, (opened.st_dev, opened.st_ino), 0, None]
+        if entry[3] is not None:
+            entry[3].cancel()
+            entry[3] = None
+        entry[2] += 1
+        return entry
+
+    def release(self, file_path, entry):
+        """A reader of the file is done with the descriptor, that it acquired."""
+        entry[2] -= 1
+        if entry[2]:
+            return
+        if self.files.get(file_path.path) is entry:
+            entry[3] = self._clock.callLater(
+                self.idle_timeout, self._retire, file_path.path, entry)
+        else:
+            os.close(entry[0])
+
+    def _retire(self, path, entry):
+        """Forget the descriptor and close it, unless it's still used"""
+        if self.files.get(path) is entry:
+            del self.files[path]
+        if entry[3] is not None and entry[3].active():
+            entry[3].cancel()
+        entry[3] = None
+        if not entry[2]:
+            os.close(entry[0])
+
+    def closeAll(self):
+        """Close the descriptors, that are not used. The others are closed,
+        when their readers are done.
+
+        """
+        for path, entry in list(self.files.items()):
+            self._retire(path, entry)
+
+
+class SharedReader(FilesystemReader):
+    """A reader, that reads the file at its own offset (with C{pread}) through
+    a descriptor, that it shares with the other readers of the same file.
+
+    @see: L{IReader}
+
+    @param file_path: a path to file, that we will read from
+    @type file_path: L{FilePath<twisted.python.filepath.FilePath>}
+
+    @param descriptors: the descriptors, that are shared with the other readers
+    @type descriptors: L{FileDescriptors}
+
+    @raise FileNotFound: if the file does not exist
+
+    """
+
+    def __init__(self, file_path, descriptors):
+        self.file_path = file_path
+        self.descriptors = descriptors
+        self.entry = descriptors.acquire(file_path)
+        self.fd = self.entry[0]
+        self.offset = 0
+        self.state = 'active'
+        self._identity = None
+        if type(self).read is not SharedReader.read or _preadv is None:
+            self.readinto = None
+
+    @property
+    def identity(self):
+        """Identifies this version of the file (see L{BlockCache<tftp.cache.BlockCache>})"""
+        if self._identity is None and self.state == 'active':
+            stat = fstat(self.fd)
+            self._identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns,
+                              stat.st_size)
+        return self._identity
+
+    def seek(self, offset):
+        """Continue reading at C{offset}"""
+        if self.state == 'active':
+            self.offset = offset
+
+    @property
+    def size(self):
+        """
+        @see: L{IReader.size}
+
+        """
+        if self.state != 'active':
+            return None
+        return fstat(self.fd).st_size
+
+    def read(self, size):
+        """
+        @see: L{IReader.read}
+
+        @return: data, that was read
+        @rtype: C{bytes}
+
+        """
+        if self.state in ('eof', 'finished'):
+            return b''
+        data = _pread(self.fd, size, self.offset)
+        self.offset += len(data)
+        if not data:
+            self._release('eof')
+        return data
+
+    def readinto(self, buffer):
+        """Read up to C{len(buffer)} bytes into C{buffer}.
+
+        @see: L{IReader}
+
+        @return: number of bytes, that were read
+        @rtype: C{int}
+
+        """
+        if self.state in ('eof', 'finished'):
+            return 0
+        size = _preadv(self.fd, [buffer], self.offset)
+        self.offset += size
+        if not size:
+            self._release('eof')
+        return size
+
+    def finish(self):
+        """
+        @see: L{IReader.finish}
+
+        """
+        if self.state == 'active':
+            self._release('finished')
+        self.state = 'finished'
+
+    def _release(self, state):
+        self.state = state
+        self.descriptors.release(self.file_path, self.entry)
+        self.entry = None
+
+
+class MappedReader(FilesystemReader):
+    """A reader, that maps the file into memory and returns C{memoryview}
+    slices of the mapping instead of copying the data out of the file. All of
+    the readers of the same version of a file share one mapping.
+
+    The file must not be modified in place while it's mapped (replace it
+    instead), since reading a truncated mapping crashes the process.
+
+    @see: L{IReader}
+
+    @param file_path: a path to file, that we will read from
+    @type file_path: L{FilePath<twisted.python.filepath.FilePath>}
+
+    @param mappings: the mappings, that are shared with the other readers
+    @type mappings: L{FileMappings}
+
+    @raise FileNotFound: if the file does not exist
+
+    """
+
+    def __init__(self, file_path, mappings):
+        FilesystemReader.__init__(self, file_path)
+        self.mappings = mappings
+        self._mapped = self.identity
+        try:
+            self.view = mappings.acquire(self.file_obj, self._mapped)
+        except:
+            self.file_obj.close()
+            raise
+        self.offset = 0
+
+    def seek(self, offset):
+        """Continue reading at C{offset}"""
+        self.offset = offset
+
+    def read(self, size):
+        """
+        @see: L{IReader.read}
+
+        @return: data, that was read
+        @rtype: C{memoryview}
+
+        """
+        if self.state == 'finished':
+            return b''
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def finish(self):
+        """
+        @see: L{IReader.finish}
+
+        """
+        if self.state != 'finished':
+            self.view = None
+            self.mappings.release(self._mapped)
+            self.file_obj.close()
+            self.state = 'finished'
+
+
 @interface.implementer(IWriter)
 class FilesystemWriter(object):
     """A writer to go with L{FilesystemSynchronousBackend}.
@@ -231,6 +665,108 @@ class FilesystemWriter(object):
             self.state = 'cancelled'
 
 
+@interface.implementer(IWriter)
+class AtomicWriter(object):
+    """A writer, that writes to a temporary file next to the target file and
+    gives it the name of the target file, once the transfer is completed
+    successfully. The data is only written once and the target file appears
+    all at once, with all of its contents. If L{cancel} is called, the
+    temporary file is removed.
+
+    The name is given with a hard link, not with a rename (C{os.replace}):
+    unlike L{FilesystemWriter}, this writer doesn't reserve the name of the
+    target file and a rename would silently replace a file, that appeared in
+    the meantime, e.g. because another upload of the same file finished
+    first. The link fails instead, the upload is discarded and that is
+    logged; the remote end has been told about the success already. Where the
+    filesystem has no hard links, the name is checked and the file is renamed,
+    which leaves a short race.
+
+    @see: L{IWriter}
+
+    @param file_path: a path to file, that will be created and written to
+    @type file_path: L{FilePath<twisted.python.filepath.FilePath>}
+
+    @param sync: whether the data is flushed to the disk (C{fsync}) before the
+    file is given its name, so that a crash can't leave a complete looking,
+    but empty file behind. This blocks until the disk is done, so it's only
+    done by the backends, that finish the files in a thread.
+    @type sync: C{bool}
+
+    @raise FileExists: if the file already exists
+
+    @ivar temp_path: the temporary file, that is written to
+    @type temp_path: L{FilePath<twisted.python.filepath.FilePath>}
+
+    """
+
+    def __init__(self, file_path, sync=False):
+        if file_path.exists():
+            raise FileExists(file_path)
+        file_dir = file_path.parent()
+        if not file_dir.exists():
+            file_dir.makedirs()
+        self.file_path = file_path
+        self.sync = sync
+        self.temp_path = file_path.temporarySibling()
+        self.temp_destination = self.temp_path.open('w')
+        self.state = 'active'
+
+    def write(self, data):
+        """
+        @see: L{IWriter.write}
+
+        """
+        self.temp_destination.write(data)
+
+    def finish(self):
+        """
+        @see: L{IWriter.finish}
+
+        """
+        if self.state not in ('finished', 'cancelled'):
+            try:
+                if self.sync:
+                    self.temp_destination.flush()
+                    os.fsync(self.temp_destination.fileno())
+                self.temp_destination.close()
+                published = self._publish()
+            except EnvironmentError:
+                log.err(None, "Failed to save the upload to %s" %
+                        (self.file_path.path,))
+                return self.cancel()
+            if not published:
+                log.msg("%s was created during the upload, the upload is "
+                        "discarded" % (self.file_path.path,))
+                return self.cancel()
+            self.state = 'finished'
+
+    def _publish(self):
+        try:
+            os.link(self.temp_path.path, self.file_path.path)
+        except FileExistsError:
+            return False
+        except EnvironmentError:
+            # No hard links on this filesystem
+            if os.path.lexists(self.file_path.path):
+                return False
+            os.replace(self.temp_path.path, self.file_path.path)
+            return True
+        self.temp_path.remove()
+        return True
+
+    def cancel(self):
+        """
+        @see: L{IWriter.cancel}
+
+        """
+        if self.state not in ('finished', 'cancelled'):
+            self.temp_destination.close()
+            if self.temp_path.exists():
+                self.temp_path.remove()
+            self.state = 'cancelled'
+
+
 @interface.implementer(IBackend)
 class FilesystemSynchronousBackend(object):
     """A synchronous filesystem backend.
@@ -247,43 +783,340 @@ class FilesystemSynchronousBackend(object):
     @param can_write: whether or not this backend should support writes
     @type can_write: C{bool}
 
+    @param use_mmap: whether the files should be mapped into memory (see
+    L{MappedReader}) instead of being read
+    @type use_mmap: C{bool}
+
+    @param share_descriptors: whether the readers of the same file should
+    share its descriptor (see L{SharedReader}). Ignored, if C{use_mmap} is
+    set.
+    @type share_descriptors: C{bool}
+
+    @param advise: see L{FilesystemReader}. Ignored, if C{use_mmap} or
+    C{share_descriptors} is set, as is C{drop_behind}.
+    @type advise: C{bool}
+
+    @param drop_behind: see L{FilesystemReader}
+    @type drop_behind: C{int}
+
+    @param atomic_writes: whether the files should be written with an
+    L{AtomicWriter} instead of a L{FilesystemWriter}
+    @type atomic_writes: C{bool}
+
+    @ivar mappings: the mappings, that the L{MappedReader}s share
+    @type mappings: L{FileMappings}
+
+    @ivar descriptors: the descriptors, that the L{SharedReader}s share
+    @type descriptors: L{FileDescriptors}
+
+    @cvar sync_writes: whether the L{AtomicWriter}s flush the files to the disk
+    before they give them their names. Not done here, where that would block
+    the reactor.
+    @type sync_writes: C{bool}
+
     """
+    sync_writes = False
 
-    def __init__(self, base_path, can_read=True, can_write=True):
+    def __init__(self, base_path, can_read=True, can_write=True, use_mmap=False,
+                 share_descriptors=False, advise=False, drop_behind=0,
+                 atomic_writes=False):
+        if share_descriptors and _pread is None:
+            raise NotImplementedError("pread is not available on this platform")
         try:
             self.base = FilePath(base_path.path)
         except AttributeError:
             self.base = FilePath(base_path)
         self.can_read, self.can_write = can_read, can_write
+        self.use_mmap = use_mmap
+        self.share_descriptors = share_descriptors
+        self.advise = advise
+        self.drop_behind = drop_behind
+        self.atomic_writes = atomic_writes
+        self.mappings = FileMappings()
+        self.descriptors = FileDescriptors()
 
     @deferred
     def get_reader(self, file_name):
         """
         @see: L{IBackend.get_reader}
 
-        @rtype: L{Deferred}, yielding a L{FilesystemReader}
+        @rtype: L{Deferred}, yielding a L{FilesystemReader} or, if C{use_mmap}
+        or C{share_descriptors} is set, a L{MappedReader} or a L{SharedReader}
 
         """
-        if not self.can_read:
-            raise Unsupported("Reading not supported")
-        try:
-            target_path = self.base.descendant(file_name.split(b"/"))
-        except InsecurePath as e:
-            raise AccessViolation("Insecure path: %s" % e)
-        return FilesystemReader(target_path)
+        return self._reader(file_name)
 
     @deferred
     def get_writer(self, file_name):
         """
         @see: L{IBackend.get_writer}
 
-        @rtype: L{Deferred}, yielding a L{FilesystemWriter}
+        @rtype: L{Deferred}, yielding a L{FilesystemWriter} or, if
+        C{atomic_writes} is set, an L{AtomicWriter}
 
         """
+        return self._writer(file_name)
+
+    def _reader(self, file_name):
+        if not self.can_read:
+            raise Unsupported("Reading not supported")
+        try:
+            target_path = self.base.descendant(file_name.split(b"/"))
+        except InsecurePath as e:
+            raise AccessViolation("Insecure path: %s" % e)
+        if self.use_mmap:
+            return MappedReader(target_path, self.mappings)
+        if self.share_descriptors:
+            return SharedReader(target_path, self.descriptors)
+        return FilesystemReader(target_path, self.advise, self.drop_behind)
+
+    def _writer(self, file_name):
         if not self.can_write:
             raise Unsupported("Writing not supported")
         try:
             target_path = self.base.descendant(file_name.split(b"/"))
         except InsecurePath as e:
             raise AccessViolation("Insecure path: %s" % e)
+        if self.atomic_writes:
+            return AtomicWriter(target_path, self.sync_writes)
         return FilesystemWriter(target_path)
+
+
+class SerialCalls(object):
+    """Runs the blocking calls of one reader or writer in a thread pool, one at
+    a time and in the order, that they were made.
+
+    Since a reader or a writer never has more than one call in the pool, the
+    pool serves the sessions in turns: a session, that has many calls queued,
+    gets its next call into the pool only after the calls, that the other
+    sessions have queued meanwhile.
+
+    @param threadpool: the pool to run the calls in
+    @type threadpool: L{ThreadPool<twisted.python.threadpool.ThreadPool>}
+
+    @ivar pending: the calls, that are waiting for the current one to finish,
+    as C{(deferred, f, args)}
+    @type pending: C{deque}
+
+    """
+
+    def __init__(self, threadpool, _reactor=reactor):
+        self.threadpool = threadpool
+        self.pending = deque()
+        self.running = False
+        self._reactor = _reactor
+
+    def call(self, f, *args):
+        """Run C{f(*args)} in the pool, after the calls, that were made before.
+
+        @return: a L{Deferred}, that will fire with the result of the call
+        @rtype: L{Deferred}
+
+        """
+        d = Deferred()
+        self.pending.append((d, f, args))
+        if not self.running:
+            self._next()
+        return d
+
+    def _next(self):
+        if not self.pending:
+            self.running = False
+            return
+        self.running = True
+        d, f, args = self.pending.popleft()
+        deferToThreadPool(self._reactor, self.threadpool, f, *args).addBoth(
+            self._done, d)
+
+    def _done(self, result, d):
+        if isinstance(result, Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+        self._next()
+
+
+@interface.implementer(IReader)
+class ThreadedReader(object):
+    """A reader to go with L{FilesystemAsynchronousBackend}. Reads the file
+    with a L{FilesystemReader} in the thread pool of the backend, where it's
+    created as well.
+
+    @see: L{IReader}
+
+    @param reader: the reader, that does the blocking reads
+    @type reader: L{FilesystemReader}
+
+    @param calls: runs the reads in the thread pool
+    @type calls: L{SerialCalls}
+
+    """
+
+    def __init__(self, reader, calls):
+        self.reader = reader
+        self.calls = calls
+        # Looked up while the file is being opened, since the reader may
+        # close it in another thread later
+        self.size = reader.size
+        self.identity = reader.identity
+
+    def seek(self, offset):
+        """Continue reading at C{offset}"""
+        self.calls.call(self.reader.seek, offset).addErrback(
+            log.err, "Failed to seek in the file")
+
+    def read(self, size):
+        """
+        @see: L{IReader.read}
+
+        @return: a L{Deferred}, that will fire with the data, that was read
+        @rtype: L{Deferred}
+
+        """
+        return self.calls.call(self.reader.read, size)
+
+    def finish(self):
+        """
+        @see: L{IReader.finish}
+
+        """
+        self.calls.call(self.reader.finish).addErrback(
+            log.err, "Failed to close the file")
+
+
+@interface.implementer(IWriter)
+class ThreadedWriter(object):
+    """A writer to go with L{FilesystemAsynchronousBackend}. Writes the file
+    with a L{FilesystemWriter} in the thread pool of the backend.
+
+    @see: L{IWriter}
+
+    @param writer: the writer, that does the blocking writes
+    @type writer: L{FilesystemWriter} or L{AtomicWriter}
+
+    @param calls: runs the writes in the thread pool
+    @type calls: L{SerialCalls}
+
+    """
+
+    def __init__(self, writer, calls):
+        self.writer = writer
+        self.calls = calls
+
+    def write(self, data):
+        """
+        @see: L{IWriter.write}
+
+        @return: a L{Deferred}, that will fire, when the data is written
+        @rtype: L{Deferred}
+
+        """
+        return self.calls.call(self.writer.write, data)
+
+    def finish(self):
+        """
+        @see: L{IWriter.finish}
+
+        """
+        self.calls.call(self.writer.finish).addErrback(
+            log.err, "Failed to finish the upload")
+
+    def cancel(self):
+        """
+        @see: L{IWriter.cancel}
+
+        """
+        self.calls.call(self.writer.cancel).addErrback(
+            log.err, "Failed to cancel the upload")
+
+
+class FilesystemAsynchronousBackend(FilesystemSynchronousBackend):
+    """A filesystem backend, that opens, reads, writes and finishes the files in
+    a bounded pool of threads, so that a slow filesystem doesn't hold up the
+    transfers of the other files.
+
+    The calls of every reader and writer are run one at a time (see
+    L{SerialCalls}), which keeps them in order and shares the threads fairly
+    between the sessions.
+
+    @see: L{IBackend}
+
+    @param threads: the largest number of threads to use
+    @type threads: C{int}
+
+    @param advise: see L{FilesystemReader}
+    @type advise: C{bool}
+
+    @param drop_behind: see L{FilesystemReader}
+    @type drop_behind: C{int}
+
+    @param atomic_writes: see L{FilesystemSynchronousBackend}
+    @type atomic_writes: C{bool}
+
+    @ivar threadpool: the pool, that runs the blocking calls. It's started,
+    when the first file is opened, and stopped, when the reactor shuts down or
+    when L{stop} is called.
+    @type threadpool: L{ThreadPool<twisted.python.threadpool.ThreadPool>}
+
+    """
+    sync_writes = True
+
+    def __init__(self, base_path, can_read=True, can_write=True, threads=4,
+                 advise=False, drop_behind=0, atomic_writes=False,
+                 _reactor=reactor):
+        FilesystemSynchronousBackend.__init__(self, base_path, can_read,
+                                              can_write, advise=advise,
+                                              drop_behind=drop_behind,
+                                              atomic_writes=atomic_writes)
+        self.threadpool = ThreadPool(0, threads, 'tftp-backend')
+        self._reactor = _reactor
+        self._shutdown = None
+
+    def get_reader(self, file_name):
+        """
+        @see: L{IBackend.get_reader}
+
+        @rtype: L{Deferred}, yielding a L{ThreadedReader}
+
+        """
+        self.start()
+        return deferToThreadPool(self._reactor, self.threadpool,
+                                 self._threadedReader, file_name)
+
+    def get_writer(self, file_name):
+        """
+        @see: L{IBackend.get_writer}
+
+        @rtype: L{Deferred}, yielding a L{ThreadedWriter}
+
+        """
+        self.start()
+        return deferToThreadPool(self._reactor, self.threadpool,
+                                 self._threadedWriter, file_name)
+
+    def _threadedReader(self, file_name):
+        return ThreadedReader(self._reader(file_name),
+                              SerialCalls(self.threadpool, self._reactor))
+
+    def _threadedWriter(self, file_name):
+        return ThreadedWriter(self._writer(file_name),
+                              SerialCalls(self.threadpool, self._reactor))
+
+    def start(self):
+        """Start the thread pool, unless it has been started or stopped
+        already. There is no need to call this, the pool is started, when it's
+        needed.
+
+        """
+        if not self.threadpool.started and not self.threadpool.joined:
+            self.threadpool.start()
+            self._shutdown = self._reactor.addSystemEventTrigger(
+                'during', 'shutdown', self.threadpool.stop)
+
+    def stop(self):
+        """Stop the thread pool, waiting for the calls, that are running"""
+        if self._shutdown is not None:
+            self._reactor.removeSystemEventTrigger(self._shutdown)
+            self._shutdown = None
+        if not self.threadpool.joined:
+            self.threadpool.stop()
@@ -5,8 +5,10 @@ from functools import partial
 from itertools import chain
 from tftp.datagram import (ACKDatagram, ERRORDatagram, ERR_TID_UNKNOWN,
     TFTPDatagramFactory, split_opcode, OP_OACK, OP_ERROR, OACKDatagram, OP_ACK,
-    OP_DATA)
-from tftp.session import WriteSession, MAX_BLOCK_SIZE, ReadSession
+    OP_DATA, HEADER)
+from tftp.session import (WriteSession, MAX_BLOCK_SIZE, ReadSession,
+    MAX_WINDOW_SIZE)
+from tftp.udp import maxPayload
 from tftp.util import timedCaller
 from twisted.internet import reactor
 from twisted.internet.defer import succeed
@@ -26,6 +28,21 @@ class TFTPBootstrap(DatagramProtocol):
 
     @cvar supported_options: lists options, that we know how to handle
 
+    @cvar max_window_size: the largest window size, that we are willing to
+    negotiate. Requests for larger windows are clamped to this value.
+    Default: L{MAX_WINDOW_SIZE}
+    @type max_window_size: C{int}
+
+    @cvar max_block_size: the largest block size, that we are willing to
+    negotiate, up to 65464. Requests for larger blocks are clamped to this value.
+    Default: L{MAX_BLOCK_SIZE}
+    @type max_block_size: C{int}
+
+    @cvar path_mtu: if set, the block size is also clamped to what fits into the
+    MTU of the path to the remote peer (see L{maxPayload<tftp.udp.maxPayload>}),
+    so that the DATA datagrams are not fragmented
+    @type path_mtu: C{bool}
+
     @ivar session: A L{WriteSession} or L{ReadSession} object, that will handle
     the actual tranfer, after the initial handshake and option negotiation is
     complete
@@ -51,7 +68,10 @@ class TFTPBootstrap(DatagramProtocol):
     @type backend: L{IReader} or L{IWriter} provider
 
     """
-    supported_options = (b'blksize', b'timeout', b'tsize')
+    supported_options = (b'blksize', b'timeout', b'tsize', b'windowsize')
+    max_window_size = MAX_WINDOW_SIZE
+    max_block_size = MAX_BLOCK_SIZE
+    path_mtu = False
 
     def __init__(self, remote, backend, options=None, _clock=None):
         if options is None:
@@ -91,8 +111,9 @@ class TFTPBootstrap(DatagramProtocol):
 
     def option_blksize(self, val):
         """Process the block size option. Valid range is between 8 and 65464,
-        inclusive. If the value is more, than L{MAX_BLOCK_SIZE}, L{MAX_BLOCK_SIZE}
-        is returned instead.
+        inclusive. If the value is more, than L{max_block_size}, L{max_block_size}
+        is returned instead. With L{path_mtu}, the value is also reduced to fit
+        into the MTU of the path, if it's known.
 
         @param val: value of the option
         @type val: C{bytes}
@@ -107,7 +128,12 @@ class TFTPBootstrap(DatagramProtocol):
             return None
         if int_blksize < 8 or int_blksize > 65464:
             return None
-        int_blksize = min((int_blksize, MAX_BLOCK_SIZE))
+        int_blksize = min((int_blksize, self.max_block_size))
+        if self.path_mtu:
+            payload = maxPayload(self.remote, self.transport)
+            if payload is not None:
+                # Less the DATA header
+                int_blksize = max(8, min((int_blksize, payload - 4)))
         return intToBytes(int_blksize)
 
     def option_timeout(self, val):
@@ -149,6 +175,28 @@ class TFTPBootstrap(DatagramProtocol):
             return None
         return intToBytes(int_tsize)
 
+    def option_windowsize(self, val):
+        """Process the window size option
+        (U{RFC7440<http://tools.ietf.org/html/rfc7440>}). Valid range is between 1
+        and 65535, inclusive. If the value is more, than L{max_window_size},
+        L{max_window_size} is returned instead.
+
+        @param val: value of the option
+        @type val: C{bytes}
+
+        @return: accepted option value or C{None}, if it is invalid
+        @rtype: C{bytes} or C{None}
+
+        """
+        try:
+            int_windowsize = int(val)
+        except ValueError:
+            return None
+        if int_windowsize < 1 or int_windowsize > 65535:
+            return None
+        int_windowsize = min((int_windowsize, self.max_window_size))
+        return intToBytes(int_windowsize)
+
     def applyOptions(self, session, options):
         """Apply given options mapping to the given L{WriteSession} or
         L{ReadSession} object.
@@ -169,11 +217,19 @@ class TFTPBootstrap(DatagramProtocol):
             elif opt_name == b'tsize':
                 tsize = int(opt_val)
                 session.tsize = tsize
+            elif opt_name == b'windowsize':
+                session.window_size = int(opt_val)
 
     def datagramReceived(self, datagram, addr):
         if self.remote[1] != addr[1]:
             self.transport.write(ERRORDatagram.from_code(ERR_TID_UNKNOWN).to_wire())
             return# Does not belong to this transfer
+        if self.session.started and len(datagram) >= 4:
+            # Fast path: once the transfer is running, its DATA or ACK datagrams
+            # go straight to the session, without building datagram objects
+            opcode, blocknum = HEADER.unpack_from(datagram)
+            if opcode == self.session.block_opcode:
+                return self.session.blockReceived(blocknum, datagram)
         datagram = TFTPDatagramFactory(*split_opcode(datagram))
         # TODO: Disabled for the time being. Performance degradation
         # and log file swamping was reported.
@@ -376,6 +432,10 @@ class RemoteOriginReadSession(TFTPBootstrap):
             self.timeout_watchdog = timedCaller(
                 chain((0,), self.timeout), partial(self.transport.write, bytes),
                 self.timedOut, clock=self._clock)
+            # The block size is settled now, so the first blocks can be read
+            # while we wait for the client to acknowledge the OACK.
+            self.applyOptions(self.session, self.resultant_options)
+            self.session.prefetch()
         else:
             self.session.transport = self.transport
             self.session.startProtocol()
@@ -0,0 +1,115 @@
+'''
+@author: shylent
+'''
+from tftp.backend import IWriter
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.python import log
+from zope import interface
+
+
+__all__ = ['BufferedWriterProxy']
+
+
+@interface.implementer(IWriter)
+class BufferedWriterProxy(object):
+    """Proxies an object, that provides L{IWriter}. The blocks, that are
+    written, are gathered in a buffer and passed on in writes of C{size}
+    bytes, so that an upload of small blocks doesn't turn into as many small
+    writes. Since every write but the last one is C{size} bytes long, the
+    writes are aligned to C{size} in the file. The rest of the buffer is
+    written by L{finish}.
+
+    The wrapped writer is given a copy of the buffer, so that the buffer can
+    be reused right away. No more, than C{size} bytes are held per session,
+    apart from the writes, that the session is waiting for.
+
+    A write, that fills the buffer, returns whatever the wrapped writer
+    returns for it, so that its failure reaches the session. If a block is
+    larger, than the buffer, and fills it several times, a L{Deferred} for all
+    of the writes is returned. The other writes return C{None} right away.
+
+    @param writer: an L{IWriter} object, that will be used to perform the
+    actual writes
+    @type writer: L{IWriter} provider
+
+    @param size: size of the buffer and of the writes, preferably a multiple
+    of the block size of the filesystem
+    @type size: C{int}
+
+    @ivar used: number of bytes in the buffer
+    @type used: C{int}
+
+    """
+
+    def __init__(self, writer, size=1 << 16):
+        self.writer = writer
+        self.size = size
+        self.buffer = bytearray(size)
+        self.used = 0
+
+    def write(self, data):
+        """Add C{data} to the buffer, writing the buffer, whenever it's full.
+
+        @see: L{IWriter.write}
+
+        """
+        data = memoryview(data)
+        pending = []
+        while data:
+            length = min(len(data), self.size - self.used)
+            self.buffer[self.used:self.used + length] = data[:length]
+            self.used += length
+            data = data[length:]
+            if self.used == self.size:
+                result = self._flush()
+                if isinstance(result, Deferred):
+                    pending.append(result)
+        if not pending:
+            return None
+        if len(pending) == 1:
+            return pending[0]
+        d = DeferredList(pending, fireOnOneErrback=True, consumeErrors=True)
+        d.addCallbacks(lambda ign: None,
+                       lambda failure: failure.value.subFailure)
+        return d
+
+    def _flush(self):
+        data = bytes(memoryview(self.buffer)[:self.used])
+        self.used = 0
+        return self.writer.write(data)
+
+    def finish(self):
+        """Write the rest of the buffer and finish the wrapped writer, once
+        that's done.
+
+        @see: L{IWriter.finish}
+
+        """
+        if not self.used:
+            return self.writer.finish()
+        try:
+            result = self._flush()
+        except Exception:
+            log.err(None, "Failed to write the end of the file")
+            return self.writer.cancel()
+        if isinstance(result, Deferred):
+            result.addCallbacks(lambda ign: self.writer.finish(),
+                                self._failed)
+        else:
+            self.writer.finish()
+
+    def _failed(self, failure):
+        log.err(failure, "Failed to write the end of the file")
+        self.writer.cancel()
+
+    def cancel(self):
+        """Discard the buffer and cancel the wrapped writer.
+
+        @see: L{IWriter.cancel}
+
+        """
+        self.used = 0
+        self.writer.cancel()
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
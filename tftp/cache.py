@@ -0,0 +1,246 @@
+'''
+@author: shylent
+'''
+from collections import OrderedDict
+from os import fstat
+from tftp.backend import IBackend, IReader
+from zope import interface
+
+
+__all__ = ['BlockCache', 'CachingBackend', 'CachedReader']
+
+
+@interface.implementer(IReader)
+class CachedReader(object):
+    """Reads a file, that is kept in memory. The data is returned as
+    C{memoryview} slices of the cached buffer, not copied.
+
+    @see: L{IReader}
+
+    @param data: contents of the file
+    @type data: C{bytes}
+
+    @param identity: identifies this version of the file for L{BlockCache}
+    @type identity: any hashable
+
+    """
+
+    def __init__(self, data, identity=None):
+        self.view = memoryview(data)
+        self.size = len(data)
+        self.identity = identity
+        self.offset = 0
+        self.state = 'active'
+
+    def seek(self, offset):
+        """Continue reading at C{offset}"""
+        self.offset = offset
+
+    def read(self, size):
+        """
+        @see: L{IReader.read}
+
+        @return: data, that was read
+        @rtype: C{memoryview}
+
+        """
+        if self.state == 'finished':
+            return b''
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def finish(self):
+        """
+        @see: L{IReader.finish}
+
+        """
+        self.state = 'finished'
+
+
+@interface.implementer(IBackend)
+class CachingBackend(object):
+    """Keeps the files, that are read through the wrapped backend, in memory,
+    so that the frequently requested ones are not read from the disk again
+    for each transfer.
+
+    The cache holds whole files up to C{budget} bytes in total and evicts the
+    least recently used ones to make room. The wrapped backend is still asked
+    for a reader on every request, so that its access checks apply, but only
+    to look up the modification time and the size of the file: if either has
+    changed, the cached copy is discarded.
+
+    Only the readers, that expose an open C{file_obj}, as
+    L{FilesystemReader<tftp.backend.FilesystemReader>} does, can be cached;
+    the others are passed through as they are, as are the writers.
+
+    @param backend: the backend to cache the files of
+    @type backend: L{IBackend} provider
+
+    @param budget: total size of the cached files, in bytes
+    @type budget: C{int}
+
+    @ivar entries: cached files, from the least to the most recently used.
+    Maps file names to C{((mtime, size), data)}.
+    @type entries: C{OrderedDict}
+
+    @ivar used: total size of the cached files
+    @type used: C{int}
+
+    @ivar hits: number of reads, that were served from the cache
+    @type hits: C{int}
+
+    @ivar misses: number of reads, that were not
+    @type misses: C{int}
+
+    @ivar evictions: number of files, that were evicted to make room for others
+    @type evictions: C{int}
+
+    """
+
+    def __init__(self, backend, budget):
+        self.backend = backend
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_reader(self, file_name):
+        """
+        @see: L{IBackend.get_reader}
+
+        @rtype: L{Deferred}, yielding a L{CachedReader} or whatever the wrapped
+        backend returns, if the file can not be cached
+
+        """
+        d = self.backend.get_reader(file_name)
+        d.addCallback(self._cached, file_name)
+        return d
+
+    def get_writer(self, file_name):
+        """
+        @see: L{IBackend.get_writer}
+
+        """
+        return self.backend.get_writer(file_name)
+
+    def _cached(self, reader, file_name):
+        file_obj = getattr(reader, 'file_obj', None)
+        if file_obj is None or file_obj.closed:
+            return reader
+        stat = fstat(file_obj.fileno())
+        version = stat.st_mtime_ns, stat.st_size
+        entry = self.entries.get(file_name)
+        if entry is not None:
+            if entry[0] == version:
+                self.entries.move_to_end(file_name)
+                self.hits += 1
+                reader.finish()
+                return CachedReader(entry[1], (file_name,) + version)
+            self._discard(file_name)
+        self.misses += 1
+        if stat.st_size > self.budget:
+            return reader
+        data = file_obj.read()
+        reader.finish()
+        if len(data) != stat.st_size:
+            return CachedReader(data)
+        self._store(file_name, version, data)
+        return CachedReader(data, (file_name,) + version)
+
+    def _store(self, file_name, version, data):
+        while self.entries and self.used + len(data) > self.budget:
+            self._discard(next(iter(self.entries)))
+            self.evictions += 1
+        self.entries[file_name] = version, data
+        self.used += len(data)
+
+    def _discard(self, file_name):
+        version, data = self.entries.pop(file_name)
+        self.used -= len(data)
+
+    def stats(self):
+        """Get the cache statistics.
+
+        @return: a mapping with the C{'hits'}, C{'misses'}, C{'evictions'},
+        C{'entries'} and C{'bytes'} keys
+        @rtype: C{dict}
+
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.used}
+
+
+class BlockCache(object):
+    """Wire representations of DATA datagrams, shared by the sessions, that
+    send the same file with the same block size.
+
+    The datagrams are keyed by C{(identity, block_size, offset)}, where the
+    identity of the file is provided by the reader. The number of a block
+    follows from its offset, so the whole datagram can be reused. The least
+    recently used datagrams are evicted to keep their total size within
+    C{budget}.
+
+    Only the readers, that have an C{identity} other, than C{None}, and a
+    C{seek(offset)} method, can be used with the cache. Readers, that
+    transform the data, like L{NetasciiSenderProxy<tftp.netascii.NetasciiSenderProxy>},
+    must not provide an identity.
+
+    @param budget: total size of the cached datagrams, in bytes
+    @type budget: C{int}
+
+    @ivar hits: number of blocks, that were served from the cache
+    @type hits: C{int}
+
+    @ivar misses: number of blocks, that had to be read and encoded
+    @type misses: C{int}
+
+    @ivar evictions: number of datagrams, that were evicted to make room for
+    others
+    @type evictions: C{int}
+
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.blocks = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Get the datagram for C{key} or C{None}, if it's not cached"""
+        wire = self.blocks.get(key)
+        if wire is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+        return wire
+
+    def put(self, key, wire):
+        """Cache the datagram C{wire} for C{key}"""
+        if key in self.blocks or len(wire) > self.budget:
+            return
+        while self.used + len(wire) > self.budget:
+            key_, evicted = self.blocks.popitem(last=False)
+            self.used -= len(evicted)
+            self.evictions += 1
+        self.blocks[key] = wire
+        self.used += len(wire)
+
+    def stats(self):
+        """Get the cache statistics.
+
+        @return: a mapping with the C{'hits'}, C{'misses'}, C{'evictions'},
+        C{'entries'} and C{'bytes'} keys
+        @rtype: C{dict}
+
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.blocks),
+                'bytes': self.used}
@@ -36,21 +36,28 @@ errors = {
     ERR_TERM_OPTION :       b"Terminate transfer due to option negotiation",
 }
 
+# Opcode, block number or error code
+_SHORT = struct.Struct(b"!H")
+# Opcode followed by block number or error code, the first four bytes of
+# DATA, ACK and ERROR datagrams
+HEADER = struct.Struct(b"!HH")
+
 def split_opcode(datagram):
-    """Split the raw datagram into opcode and payload.
+    """Split the raw datagram into opcode and payload. The payload is a
+    C{memoryview} of the datagram, so it's not copied.
 
     @param datagram: raw datagram
     @type datagram: C{bytes}
 
     @return: a 2-tuple, the first item is the opcode and the second item is the payload
-    @rtype: (C{int}, C{bytes})
+    @rtype: (C{int}, C{memoryview})
 
     @raise WireProtocolError: if the opcode cannot be extracted
 
     """
-
+    view = memoryview(datagram)
     try:
-        return struct.unpack(b"!H", datagram[:2])[0], datagram[2:]
+        return _SHORT.unpack_from(view)[0], view[2:]
     except struct.error:
         raise WireProtocolError("Failed to extract the opcode")
 
@@ -75,6 +82,7 @@ class TFTPDatagram(object):
     @type opcode: C{int}
 
     """
+    __slots__ = ()
 
     opcode = None
 
@@ -83,7 +91,7 @@ class TFTPDatagram(object):
         """Parse the payload and return a datagram object
 
         @param payload: Binary representation of the payload (without the opcode)
-        @type payload: C{bytes}
+        @type payload: C{bytes} or C{memoryview}
 
         """
         raise NotImplementedError("Subclasses must override this")
@@ -96,6 +104,24 @@ class TFTPDatagram(object):
         """
         raise NotImplementedError("Subclasses must override this")
 
+    def pack_into(self, buffer, offset=0):
+        """Write the wire representation of the datagram into C{buffer}, that
+        can be reused for the next datagram.
+
+        @param buffer: a writable buffer, large enough for the datagram
+        @type buffer: C{bytearray}
+
+        @param offset: position in C{buffer}, where the datagram starts
+        @type offset: C{int}
+
+        @return: size of the datagram
+        @rtype: C{int}
+
+        """
+        wire = self.to_wire()
+        buffer[offset:offset + len(wire)] = wire
+        return len(wire)
+
 
 class RQDatagram(TFTPDatagram):
     """Base class for "RQ" (request) datagrams.
@@ -112,6 +138,8 @@ class RQDatagram(TFTPDatagram):
     @type options: C{dict}
 
     """
+    # No __slots__ here: requests are parsed once per transfer, and the opcode
+    # of a bare RQDatagram can be set on the instance
 
     @classmethod
     def from_wire(cls, payload):
@@ -126,7 +154,7 @@ class RQDatagram(TFTPDatagram):
         Fields are terminated by NUL.
 
         """
-        parts = payload.split(b'\x00')
+        parts = bytes(payload).split(b'\x00')
         try:
             filename, mode = parts.pop(0), parts.pop(0)
         except IndexError:
@@ -160,7 +188,7 @@ class RQDatagram(TFTPDatagram):
                                                self.filename, self.mode)
 
     def to_wire(self):
-        opcode = struct.pack(b"!H", self.opcode)
+        opcode = _SHORT.pack(self.opcode)
         if self.options:
             options = b'\x00'.join(chain.from_iterable(self.options.items()))
             return b''.join((opcode, self.filename, b'\x00', self.mode, b'\x00',
@@ -182,6 +210,8 @@ class OACKDatagram(TFTPDatagram):
     @type options: C{dict}
 
     """
+    __slots__ = ('options',)
+
     opcode = OP_OACK
 
     @classmethod
@@ -194,7 +224,7 @@ class OACKDatagram(TFTPDatagram):
         @raise OptionsDecodeError: if we failed to decode the options
 
         """
-        parts = payload.split(b'\x00')
+        parts = bytes(payload).split(b'\x00')
         #FIXME: Boo, code duplication
         if parts and not parts[-1]:
             parts.pop(-1)
@@ -215,7 +245,7 @@ class OACKDatagram(TFTPDatagram):
         return ("<%s(options=%s)>" % (self.__class__.__name__, self.options))
 
     def to_wire(self):
-        opcode = struct.pack(b"!H", self.opcode)
+        opcode = _SHORT.pack(self.opcode)
         if self.options:
             options = b'\x00'.join(chain.from_iterable(self.options.items()))
             return b''.join((opcode, options, b'\x00'))
@@ -229,17 +259,20 @@ class DATADatagram(TFTPDatagram):
     @type blocknum: C{int}
 
     @ivar data: binary data
-    @type data: C{bytes}
+    @type data: C{bytes} or C{memoryview}
 
     """
+    __slots__ = ('blocknum', 'data')
+
     opcode = OP_DATA
 
     @classmethod
     def from_wire(cls, payload):
-        """Parse the payload and return a L{DATADatagram} object.
+        """Parse the payload and return a L{DATADatagram} object. The data is
+        a C{memoryview} of the payload, not a copy.
 
         @param payload: Binary representation of the payload (without the opcode)
-        @type payload: C{bytes}
+        @type payload: C{bytes} or C{memoryview}
 
         @return: A L{DATADatagram} object
         @rtype: L{DATADatagram}
@@ -247,14 +280,15 @@ class DATADatagram(TFTPDatagram):
         @raise PayloadDecodeError: if the format of payload is incorrect
 
         """
+        view = memoryview(payload)
         try:
-            blocknum, data = struct.unpack(b'!H', payload[:2])[0], payload[2:]
+            blocknum = _SHORT.unpack_from(view)[0]
         except struct.error:
             raise PayloadDecodeError()
-        return cls(blocknum, data)
+        return cls(blocknum, view[2:])
 
     def __init__(self, blocknum, data):
-        assert isinstance(data, bytes)
+        assert isinstance(data, (bytes, memoryview))
         self.blocknum = blocknum
         self.data = data
 
@@ -263,7 +297,17 @@ class DATADatagram(TFTPDatagram):
                                                         self.blocknum, len(self.data))
 
     def to_wire(self):
-        return b''.join((struct.pack(b'!HH', self.opcode, self.blocknum), self.data))
+        return HEADER.pack(self.opcode, self.blocknum) + self.data
+
+    def pack_into(self, buffer, offset=0):
+        """
+        @see: L{TFTPDatagram.pack_into}
+
+        """
+        size = len(self.data)
+        HEADER.pack_into(buffer, offset, self.opcode, self.blocknum)
+        buffer[offset + 4:offset + 4 + size] = self.data
+        return size + 4
 
 class ACKDatagram(TFTPDatagram):
     """An ACK datagram.
@@ -272,6 +316,8 @@ class ACKDatagram(TFTPDatagram):
     @type blocknum: C{int}
 
     """
+    __slots__ = ('blocknum',)
+
     opcode = OP_ACK
 
     @classmethod
@@ -279,7 +325,7 @@ class ACKDatagram(TFTPDatagram):
         """Parse the payload and return a L{ACKDatagram} object.
 
         @param payload: Binary representation of the payload (without the opcode)
-        @type payload: C{bytes}
+        @type payload: C{bytes} or C{memoryview}
 
         @return: An L{ACKDatagram} object
         @rtype: L{ACKDatagram}
@@ -288,7 +334,7 @@ class ACKDatagram(TFTPDatagram):
 
         """
         try:
-            blocknum = struct.unpack(b'!H', payload)[0]
+            blocknum = _SHORT.unpack(payload)[0]
         except struct.error:
             raise PayloadDecodeError("Unable to extract the block number")
         return cls(blocknum)
@@ -300,7 +346,7 @@ class ACKDatagram(TFTPDatagram):
         return "<%s(blocknum=%s)>" % (self.__class__.__name__, self.blocknum)
 
     def to_wire(self):
-        return struct.pack(b'!HH', self.opcode, self.blocknum)
+        return ACK_WIRE[self.blocknum]
 
 class ERRORDatagram(TFTPDatagram):
     """An ERROR datagram.
@@ -313,6 +359,8 @@ class ERRORDatagram(TFTPDatagram):
     @type errmsg: C{bytes}
 
     """
+    __slots__ = ('errorcode', 'errmsg')
+
     opcode = OP_ERROR
 
     @classmethod
@@ -323,7 +371,7 @@ class ERRORDatagram(TFTPDatagram):
         extracted, a default error string is generated, based on the error code.
 
         @param payload: Binary representation of the payload (without the opcode)
-        @type payload: C{bytes}
+        @type payload: C{bytes} or C{memoryview}
 
         @return: An L{ERRORDatagram} object
         @rtype: L{ERRORDatagram}
@@ -335,12 +383,12 @@ class ERRORDatagram(TFTPDatagram):
 
         """
         try:
-            errorcode = struct.unpack(b'!H', payload[:2])[0]
+            errorcode = _SHORT.unpack_from(payload)[0]
         except struct.error:
             raise PayloadDecodeError("Unable to extract the error code")
         if not errorcode in errors:
             raise InvalidErrorcodeError(errorcode)
-        errmsg = payload[2:].split(b'\x00')[0]
+        errmsg = bytes(payload[2:]).split(b'\x00')[0]
         if not errmsg:
             errmsg = errors[errorcode]
         return cls(errorcode, errmsg)
@@ -377,9 +425,18 @@ class ERRORDatagram(TFTPDatagram):
         self.errmsg = errmsg
 
     def to_wire(self):
-        return b''.join((struct.pack(b'!HH', self.opcode, self.errorcode),
+        if self.errmsg is errors.get(self.errorcode):
+            return ERROR_WIRE[self.errorcode]
+        return b''.join((HEADER.pack(self.opcode, self.errorcode),
                         self.errmsg, b'\x00'))
 
+# Wire representations of the ACK datagrams for every block number and of the
+# ERROR datagrams with the default messages, encoded ahead of time
+ACK_WIRE = tuple([HEADER.pack(OP_ACK, blocknum) for blocknum in range(65536)])
+ERROR_WIRE = dict((errorcode, b''.join((HEADER.pack(OP_ERROR, errorcode),
+                                        errmsg, b'\x00')))
+                  for errorcode, errmsg in errors.items())
+
 class _TFTPDatagramFactory(object):
     """Encapsulates the creation of datagrams based on the opcode"""
     _dgram_classes = {
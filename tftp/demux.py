@@ -0,0 +1,233 @@
+'''
+@author: shylent
+'''
+from tftp.datagram import ERROR_WIRE, ERR_TID_UNKNOWN
+from tftp.udp import listenUDP
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults, maybeDeferred, succeed
+from twisted.internet.protocol import DatagramProtocol
+from twisted.python import log
+
+
+__all__ = ['SessionDemultiplexer', 'SharedPort', 'SessionTransport']
+
+
+class SessionTransport(object):
+    """A transport for a single session, that shares the socket with other
+    sessions. Provides the part of L{IUDPTransport<twisted.internet.interfaces.IUDPTransport>},
+    that the sessions and bootstrap protocols use.
+
+    @ivar shared: the shared socket, that carries the datagrams of this session
+    @type shared: L{SharedPort}
+
+    @ivar remote: address of the remote peer
+    @type remote: C{(str, int)}
+
+    @ivar protocol: the session or bootstrap protocol, that uses this transport
+
+    """
+    disconnecting = False
+
+    def __init__(self, shared, remote, protocol):
+        self.shared = shared
+        self.remote = remote
+        self.protocol = protocol
+
+    def write(self, datagram, addr=None):
+        """Send a datagram to the remote peer (or to C{addr}, if it is given)"""
+        if addr is None:
+            addr = self.remote
+        return self.shared.transport.write(datagram, addr)
+
+    def writeBuffers(self, buffers, addr=None):
+        """Send a datagram, that consists of C{buffers}, to the remote peer
+        (or to C{addr}, if it is given). The buffers are gathered by the kernel,
+        if the shared socket is a L{ScatterPort<tftp.udp.ScatterPort>}, and
+        joined otherwise.
+
+        """
+        if addr is None:
+            addr = self.remote
+        port = self.shared.transport
+        writeBuffers = getattr(port, 'writeBuffers', None)
+        if writeBuffers is None:
+            return port.write(b''.join(buffers), addr)
+        return writeBuffers(buffers, addr)
+
+    def writeBatch(self, datagrams, addr=None):
+        """Send C{datagrams} to the remote peer (or to C{addr}, if it is given)
+        with as few system calls, as the shared socket allows (see
+        L{BatchPort<tftp.udp.BatchPort>}).
+
+        @param datagrams: the datagrams, each one a bytes-like object or a
+        C{tuple} of them
+        @type datagrams: C{list}
+
+        """
+        if addr is None:
+            addr = self.remote
+        port = self.shared.transport
+        writeBatch = getattr(port, 'writeBatch', None)
+        if writeBatch is not None:
+            return writeBatch(datagrams, addr)
+        for datagram in datagrams:
+            if type(datagram) is tuple:
+                self.writeBuffers(datagram, addr)
+            else:
+                port.write(datagram, addr)
+
+    def connect(self, host, port):
+        """Nothing to do here, the shared socket already routes the datagrams
+        from the remote peer to this transport. Only the address of the peer,
+        that this transport was created for, is accepted.
+
+        """
+        if (host, port) != self.remote:
+            raise ValueError("Cannot connect to %s:%s, this transport belongs to "
+                             "%s:%s" % ((host, port) + tuple(self.remote)))
+
+    def getHost(self):
+        return self.shared.transport.getHost()
+
+    def stopListening(self):
+        """Stop receiving the datagrams from the remote peer and stop the
+        protocol. The shared socket stays open.
+
+        """
+        if not self.disconnecting:
+            self.disconnecting = True
+            self.shared.detach(self.remote)
+            self.protocol.doStop()
+        return succeed(None)
+
+    loseConnection = stopListening
+
+
+class SharedPort(DatagramProtocol):
+    """Receives the datagrams for all of the sessions, that share a socket, and
+    passes each one to the session, that its source address belongs to.
+
+    Per U{RFC1350<http://tools.ietf.org/html/rfc1350>}, datagrams from unknown
+    addresses get an ERROR datagram with the "Unknown transfer ID" code in
+    response and are otherwise discarded.
+
+    @ivar sessions: maps remote addresses to the session transports
+    @type sessions: C{dict}
+
+    """
+
+    def __init__(self):
+        self.sessions = {}
+
+    def attach(self, remote, protocol):
+        """Start routing the datagrams from C{remote} to C{protocol}.
+
+        @return: the transport for C{protocol} to use
+        @rtype: L{SessionTransport}
+
+        """
+        transport = SessionTransport(self, remote, protocol)
+        self.sessions[remote] = transport
+        protocol.makeConnection(transport)
+        return transport
+
+    def detach(self, remote):
+        del self.sessions[remote]
+
+    def datagramReceived(self, datagram, addr):
+        session = self.sessions.get(addr)
+        if session is None:
+            self.transport.write(ERROR_WIRE[ERR_TID_UNKNOWN], addr)
+            return
+        session.protocol.datagramReceived(datagram, addr)
+
+    def stopProtocol(self):
+        # The transfers can not continue without the socket
+        for session in list(self.sessions.values()):
+            session.protocol.cancel()
+
+
+class SessionDemultiplexer(object):
+    """Carries many sessions over a small fixed set of sockets instead of
+    binding a new socket for each one.
+
+    The transfer ID (TID) of our end of a session is the port of the socket,
+    that it was attached to. Different peers may share the same TID, since the
+    datagrams are routed by the (remote address, local port) pair, but a peer
+    never gets the same TID twice at the same time: a repeated request from the
+    same address is attached to another socket.
+
+    The sockets are bound lazily, when the first session is attached.
+
+    @ivar size: number of shared sockets
+    @type size: C{int}
+
+    @ivar interface: the local address to bind the shared sockets to
+    @type interface: C{str}
+
+    @ivar ports: the listening ports of the shared sockets
+    @type ports: C{list} of L{IListeningPort}
+
+    @ivar batch_size: the number of datagrams, that the shared sockets receive
+    at once (see L{listenUDP<tftp.udp.listenUDP>})
+    @type batch_size: C{int}
+
+    @ivar offload: whether the shared sockets use the UDP segmentation and
+    receive offloads (see L{ScatterPort<tftp.udp.ScatterPort>})
+    @type offload: C{bool}
+
+    @ivar max_packet_size: the largest datagram, that the shared sockets receive
+    @type max_packet_size: C{int}
+
+    """
+
+    def __init__(self, size, interface='', _reactor=reactor, batch_size=0,
+                 offload=False, max_packet_size=8192):
+        self.size = size
+        self.interface = interface
+        self.batch_size = batch_size
+        self.offload = offload
+        self.max_packet_size = max_packet_size
+        self.ports = []
+        self._reactor = _reactor
+        self._next = 0
+
+    def attach(self, remote, protocol):
+        """Attach C{protocol} to one of the shared sockets and start it.
+
+        @param remote: the address of the remote peer
+        @type remote: C{(str, int)}
+
+        @param protocol: a session or bootstrap protocol
+
+        @return: the transport, that the protocol was connected to, or C{None},
+        if each of the shared sockets already has a session with C{remote}
+        @rtype: L{SessionTransport} or C{NoneType}
+
+        """
+        if not self.ports:
+            self.start()
+        for i in range(len(self.ports)):
+            shared = self.ports[(self._next + i) % len(self.ports)].protocol
+            if remote not in shared.sessions:
+                self._next = (self._next + i + 1) % len(self.ports)
+                return shared.attach(remote, protocol)
+        log.msg("All of the shared sockets have a session with %s:%s" % remote)
+        return None
+
+    def start(self):
+        """Bind the shared sockets"""
+        self.ports = [listenUDP(0, SharedPort(), self.interface, self._reactor,
+                                self.batch_size, self.offload,
+                                self.max_packet_size)
+                      for i in range(self.size)]
+
+    def stop(self):
+        """Close the shared sockets, stopping all of the sessions, that use them.
+
+        @return: a L{Deferred}, that fires when all of the sockets are closed
+        @rtype: L{Deferred}
+
+        """
+        ports, self.ports = self.ports, []
+        return gatherResults([maybeDeferred(port.stopListening) for port in ports])
@@ -108,6 +108,10 @@ class NetasciiSenderProxy(object):
     @type reader: L{IReader} provider
 
     """
+    # The transformed data must not be mixed up with the original in a
+    # BlockCache, nor read past the transformation
+    identity = None
+    readinto = None
 
     def __init__(self, reader):
         self.reader = reader
@@ -0,0 +1,157 @@
+'''
+@author: shylent
+'''
+from tftp.demux import SharedPort
+from tftp.udp import listenUDP
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults, maybeDeferred
+
+
+__all__ = ['PortPool', 'PooledPort']
+
+
+class PooledPort(SharedPort):
+    """A socket, that carries one session at a time and goes back to its
+    L{PortPool} when the session is over.
+
+    @ivar closing: C{True} once the socket is being closed for good
+    @type closing: C{bool}
+
+    """
+
+    def __init__(self, pool):
+        SharedPort.__init__(self)
+        self.pool = pool
+        self.closing = False
+
+    def detach(self, remote):
+        SharedPort.detach(self, remote)
+        if not self.closing:
+            self.pool.release(self)
+
+    def stopProtocol(self):
+        self.closing = True
+        SharedPort.stopProtocol(self)
+
+
+class PortPool(object):
+    """A pool of UDP sockets, that were bound ahead of time, so that starting
+    a session does not have to wait for a new socket.
+
+    A session gets an idle socket from the pool (a hit) or, if there are none
+    left, a freshly bound one (a miss). Either way, the socket is returned to
+    the pool, when the session stops listening, unless the pool is already
+    full. The pool is refilled in the background, after the sockets were taken
+    from it.
+
+    Since a pooled socket is not connected to the remote peer, it filters the
+    datagrams by their source address itself (see L{SharedPort}).
+
+    @ivar size: the number of idle sockets to keep
+    @type size: C{int}
+
+    @ivar interface: the local address to bind the sockets to
+    @type interface: C{str}
+
+    @ivar idle: the sockets, that are ready to be used
+    @type idle: C{list} of L{PooledPort}
+
+    @ivar hits: the number of sessions, that got a socket from the pool
+    @type hits: C{int}
+
+    @ivar misses: the number of sessions, that had to wait for a socket to be
+    bound
+    @type misses: C{int}
+
+    @ivar batch_size: the number of datagrams, that the sockets receive at
+    once (see L{listenUDP<tftp.udp.listenUDP>})
+    @type batch_size: C{int}
+
+    @ivar offload: whether the sockets use the UDP segmentation and receive
+    offloads (see L{ScatterPort<tftp.udp.ScatterPort>})
+    @type offload: C{bool}
+
+    @ivar max_packet_size: the largest datagram, that the sockets receive
+    @type max_packet_size: C{int}
+
+    """
+
+    def __init__(self, size, interface='', _reactor=reactor, batch_size=0,
+                 offload=False, max_packet_size=8192):
+        self.size = size
+        self.interface = interface
+        self.batch_size = batch_size
+        self.offload = offload
+        self.max_packet_size = max_packet_size
+        self.idle = []
+        self.hits = 0
+        self.misses = 0
+        self._reactor = _reactor
+        self._refill = None
+        self._stopped = False
+
+    def start(self):
+        """Fill the pool"""
+        self._stopped = False
+        self.refill()
+
+    def stop(self):
+        """Close the idle sockets. The sockets, that are in use, are closed,
+        when their sessions are over.
+
+        @return: a L{Deferred}, that fires when the idle sockets are closed
+        @rtype: L{Deferred}
+
+        """
+        self._stopped = True
+        if self._refill is not None and self._refill.active():
+            self._refill.cancel()
+        self._refill = None
+        idle, self.idle = self.idle, []
+        return gatherResults([maybeDeferred(self._close, shared)
+                              for shared in idle])
+
+    def attach(self, remote, protocol):
+        """Attach C{protocol} to a socket from the pool and start it.
+
+        @param remote: the address of the remote peer
+        @type remote: C{(str, int)}
+
+        @param protocol: a session or bootstrap protocol
+
+        @return: the transport, that the protocol was connected to
+        @rtype: L{SessionTransport<tftp.demux.SessionTransport>}
+
+        """
+        if self.idle:
+            self.hits += 1
+            shared = self.idle.pop()
+        else:
+            self.misses += 1
+            shared = self._bind()
+        if self._refill is None and not self._stopped:
+            self._refill = self._reactor.callLater(0, self.refill)
+        return shared.attach(remote, protocol)
+
+    def release(self, shared):
+        """Take back a socket, that is no longer used by a session"""
+        if self._stopped or len(self.idle) >= self.size:
+            self._close(shared)
+        else:
+            self.idle.append(shared)
+
+    def refill(self):
+        """Bind new sockets, until there are L{size} idle ones"""
+        self._refill = None
+        while len(self.idle) < self.size:
+            self.idle.append(self._bind())
+
+    def _bind(self):
+        shared = PooledPort(self)
+        listenUDP(0, shared, self.interface, self._reactor, self.batch_size,
+                  self.offload, self.max_packet_size)
+        return shared
+
+    def _close(self, shared):
+        shared.closing = True
+        return shared.transport.stopListening()
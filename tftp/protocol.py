@@ -2,12 +2,19 @@
 @author: shylent
 '''
 from tftp.bootstrap import RemoteOriginWriteSession, RemoteOriginReadSession
+from tftp.buffering import BufferedWriterProxy
+from tftp.cache import BlockCache
 from tftp.datagram import (TFTPDatagramFactory, split_opcode, OP_WRQ,
     ERRORDatagram, ERR_NOT_DEFINED, ERR_ACCESS_VIOLATION, ERR_FILE_EXISTS,
     ERR_ILLEGAL_OP, OP_RRQ, ERR_FILE_NOT_FOUND)
+from tftp.demux import SessionDemultiplexer
 from tftp.errors import (FileExists, Unsupported, AccessViolation, BackendError,
     FileNotFound)
 from tftp.netascii import NetasciiReceiverProxy, NetasciiSenderProxy
+from tftp.pool import PortPool
+from tftp.session import MAX_BLOCK_SIZE, MAX_WINDOW_SIZE
+from tftp.udp import listenUDP
+from tftp.wheel import TimingWheel
 from twisted.internet import reactor
 from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.internet.protocol import DatagramProtocol
@@ -23,17 +30,115 @@ class TFTP(DatagramProtocol):
     local resources
     @type backend: L{IBackend} provider
 
+    @ivar max_window_size: the largest RFC7440 window size, that the sessions
+    started by this protocol will accept
+    @type max_window_size: C{int}
+
+    @ivar adaptive_timeout: whether the sessions started by this protocol derive
+    their retransmission timeouts from the measured round trip time
+    @type adaptive_timeout: C{bool}
+
+    @ivar timers: the clock, that the sessions started by this protocol schedule
+    their timeouts with. If C{timer_granularity} was given, this is a
+    L{TimingWheel}, shared by all the sessions, otherwise it's the same clock,
+    that this protocol uses.
+    @type timers: L{IReactorTime} provider
+
+    @ivar demux: if C{shared_sockets} was given, the sessions are carried by
+    this many sockets, shared between them, instead of binding a socket per
+    session
+    @type demux: L{SessionDemultiplexer} or C{NoneType}
+
+    @ivar pool: if C{port_pool} was given, the sessions get their sockets from
+    this pool of sockets, that were bound ahead of time
+    @type pool: L{PortPool} or C{NoneType}
+
+    @ivar block_cache: if C{block_cache} was given, the read sessions share the
+    encoded DATA datagrams through this cache of that many bytes
+    @type block_cache: L{BlockCache} or C{NoneType}
+
+    @ivar batch_size: if not 0, the sockets of the sessions receive this many
+    datagrams at once and send the windows in batches (see
+    L{BatchPort<tftp.udp.BatchPort>})
+    @type batch_size: C{int}
+
+    @ivar offload: whether the sockets of the sessions use the UDP segmentation
+    and receive offloads, where the kernel supports them (see
+    L{ScatterPort<tftp.udp.ScatterPort>})
+    @type offload: C{bool}
+
+    @ivar max_block_size: the largest block size, up to 65464, that the sessions
+    started by this protocol will accept. Their sockets are made to receive
+    datagrams of that size.
+    @type max_block_size: C{int}
+
+    @ivar max_packet_size: the largest datagram, that the sockets of the
+    sessions (and the port, that this protocol listens on) have to receive
+    @type max_packet_size: C{int}
+
+    @ivar path_mtu: whether the sessions started by this protocol also clamp
+    the block size to the MTU of the path to the client, so that the DATA
+    datagrams are not fragmented
+    @type path_mtu: C{bool}
+
+    @ivar write_buffer: if not 0, the write sessions started by this protocol
+    pass the uploads to the backend in writes of this many bytes (see
+    L{BufferedWriterProxy})
+    @type write_buffer: C{int}
+
     """
-    def __init__(self, backend, _clock=None):
+    def __init__(self, backend, _clock=None, max_window_size=MAX_WINDOW_SIZE,
+                 adaptive_timeout=False, timer_granularity=None,
+                 shared_sockets=0, port_pool=0, block_cache=0, batch_size=0,
+                 offload=False, max_block_size=MAX_BLOCK_SIZE, path_mtu=False,
+                 write_buffer=0):
         self.backend = backend
+        self.max_window_size = max_window_size
+        self.max_block_size = max_block_size
+        self.path_mtu = path_mtu
+        self.write_buffer = write_buffer
+        # Large enough for a DATA datagram and no smaller, than usual
+        self.max_packet_size = max(8192, max_block_size + 4)
+        self.adaptive_timeout = adaptive_timeout
+        self.batch_size = batch_size
+        self.offload = offload
         if _clock is None:
             self._clock = reactor
         else:
             self._clock = _clock
+        if timer_granularity:
+            self.timers = TimingWheel(self._clock, timer_granularity)
+        else:
+            self.timers = self._clock
+        if shared_sockets:
+            self.demux = SessionDemultiplexer(shared_sockets,
+                                              batch_size=batch_size,
+                                              offload=offload,
+                                              max_packet_size=self.max_packet_size)
+        else:
+            self.demux = None
+        if port_pool:
+            self.pool = PortPool(port_pool, batch_size=batch_size,
+                                 offload=offload,
+                                 max_packet_size=self.max_packet_size)
+        else:
+            self.pool = None
+        if block_cache:
+            self.block_cache = BlockCache(block_cache)
+        else:
+            self.block_cache = None
 
     def startProtocol(self):
         addr = self.transport.getHost()
         log.msg("TFTP Listener started at %s:%s" % (addr.host, addr.port))
+        if self.pool is not None:
+            self.pool.start()
+
+    def stopProtocol(self):
+        if self.demux is not None:
+            self.demux.stop()
+        if self.pool is not None:
+            self.pool.stop()
 
     def datagramReceived(self, datagram, addr):
         datagram = TFTPDatagramFactory(*split_opcode(datagram))
@@ -87,16 +192,42 @@ class TFTP(DatagramProtocol):
                 u"{}".format(e).encode("ascii", "replace")).to_wire(), addr)
         else:
             if datagram.opcode == OP_WRQ:
+                if self.write_buffer:
+                    fs_interface = BufferedWriterProxy(fs_interface,
+                                                       self.write_buffer)
                 if mode == b'netascii':
                     fs_interface = NetasciiReceiverProxy(fs_interface)
                 session = RemoteOriginWriteSession(addr, fs_interface,
-                                                   datagram.options, _clock=self._clock)
-                reactor.listenUDP(0, session)
+                                                   datagram.options, _clock=self.timers)
+                session.max_window_size = self.max_window_size
+                session.max_block_size = self.max_block_size
+                session.path_mtu = self.path_mtu
+                session.session.adaptive_timeout = self.adaptive_timeout
+                self._listen(addr, session)
                 returnValue(session)
             elif datagram.opcode == OP_RRQ:
                 if mode == b'netascii':
                     fs_interface = NetasciiSenderProxy(fs_interface)
                 session = RemoteOriginReadSession(addr, fs_interface,
-                                                  datagram.options, _clock=self._clock)
-                reactor.listenUDP(0, session)
+                                                  datagram.options, _clock=self.timers)
+                session.max_window_size = self.max_window_size
+                session.max_block_size = self.max_block_size
+                session.path_mtu = self.path_mtu
+                session.session.adaptive_timeout = self.adaptive_timeout
+                session.session.block_cache = self.block_cache
+                self._listen(addr, session)
                 returnValue(session)
+
+    def _listen(self, addr, session):
+        """Give C{session} a transport: attach it to one of the shared sockets,
+        take one from the pool or, if neither is used, bind a new one.
+
+        """
+        if self.demux is not None and self.demux.attach(addr, session) is not None:
+            return
+        if self.pool is not None:
+            self.pool.attach(addr, session)
+        else:
+            listenUDP(0, session, batch_size=self.batch_size,
+                      offload=self.offload,
+                      max_packet_size=self.max_packet_size)
@@ -0,0 +1,112 @@
+'''
+@author: shylent
+'''
+import random
+
+
+__all__ = ['RTTEstimator']
+
+
+class RTTEstimator(object):
+    """Estimates the round trip time to the remote peer and derives the
+    retransmission timeouts from it, as described in
+    U{RFC6298<http://tools.ietf.org/html/rfc6298>}.
+
+    Samples must only be taken for datagrams, that were not retransmitted
+    (Karn's rule), because it is impossible to tell, which of the transmissions
+    the response belongs to.
+
+    @cvar alpha: gain of the smoothed round trip time
+    @type alpha: C{float}
+
+    @cvar beta: gain of the round trip time variation
+    @type beta: C{float}
+
+    @cvar k: weight of the round trip time variation in the timeout
+    @type k: C{int}
+
+    @ivar srtt: smoothed round trip time or C{None}, if there were no samples yet
+    @type srtt: C{float} or C{NoneType}
+
+    @ivar rttvar: round trip time variation or C{None}, if there were no samples
+    yet
+    @type rttvar: C{float} or C{NoneType}
+
+    @ivar rto: current retransmission timeout
+    @type rto: C{float}
+
+    @param initial_rto: retransmission timeout to use before the first sample
+    @type initial_rto: C{float}
+
+    @param min_rto: the timeout never gets shorter, than this
+    @type min_rto: C{float}
+
+    @param max_rto: the timeout never gets longer, than this, no matter how many
+    times it was backed off
+    @type max_rto: C{float}
+
+    @param max_retries: number of retransmissions before giving up
+    @type max_retries: C{int}
+
+    @param jitter: every timeout is randomly changed by up to this fraction, so
+    that the sessions, that lost their datagrams at the same time, don't
+    retransmit in lockstep
+    @type jitter: C{float}
+
+    """
+    alpha = 0.125
+    beta = 0.25
+    k = 4
+
+    def __init__(self, initial_rto=1.0, min_rto=0.2, max_rto=60.0,
+                 max_retries=5, jitter=0.1, _random=random.random):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.max_retries = max_retries
+        self.jitter = jitter
+        self._random = _random
+
+    def sample(self, rtt):
+        """Update the estimate with a new round trip time measurement.
+
+        @param rtt: measured round trip time in seconds
+        @type rtt: C{float}
+
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = ((1 - self.beta) * self.rttvar +
+                           self.beta * abs(self.srtt - rtt))
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.rto = min(max(self.srtt + self.k * self.rttvar, self.min_rto),
+                       self.max_rto)
+
+    def backoff(self):
+        """A retransmission timer has expired. Double the timeout until the
+        next valid sample.
+
+        """
+        self.rto = min(self.rto * 2, self.max_rto)
+
+    def timings(self, upper_bound):
+        """Generate the delays for one transmission: a delay before each of
+        L{max_retries} retransmissions and then the delay before giving up.
+        Every delay is twice as long as the previous one.
+
+        @param upper_bound: none of the delays is longer, than this
+        @type upper_bound: C{float}
+
+        @return: an iterable, suitable for L{tftp.util.timedCaller}
+        @rtype: generator of C{float}
+
+        """
+        rto = self.rto
+        for attempt in range(self.max_retries + 1):
+            spread = self.jitter * (2 * self._random() - 1)
+            yield min(upper_bound, rto * (1 + spread))
+            rto *= 2
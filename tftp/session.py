@@ -1,16 +1,38 @@
 '''
 @author: shylent
 '''
-from functools import partial
-from tftp.datagram import (ACKDatagram, ERRORDatagram, OP_DATA, OP_ERROR, ERR_ILLEGAL_OP,
-    ERR_DISK_FULL, OP_ACK, DATADatagram, ERR_NOT_DEFINED,)
-from tftp.util import timedCaller
+from collections import deque
+from tftp.datagram import (ACK_WIRE, ERROR_WIRE, ERRORDatagram, OP_DATA, OP_ERROR,
+    ERR_ILLEGAL_OP, ERR_DISK_FULL, OP_ACK, DATADatagram, ERR_NOT_DEFINED, HEADER)
+from tftp.errors import PayloadDecodeError
+from tftp.rtt import RTTEstimator
+from tftp.util import SessionTimer
 from twisted.internet import reactor
-from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.defer import Deferred, fail, succeed
 from twisted.internet.protocol import DatagramProtocol
 from twisted.python import log
+from twisted.python.failure import Failure
 
 MAX_BLOCK_SIZE = 8192
+MAX_WINDOW_SIZE = 64
+
+# Block numbers are 16 bit and wrap around, so "behind" and "ahead" are only
+# meaningful within half of the sequence space.
+_HALF_BLOCKNUM_SPACE = 32768
+
+
+def _call(f, *args):
+    """Call C{f} like L{maybeDeferred<twisted.internet.defer.maybeDeferred>}
+    does, but return a synchronous result as it is, instead of wrapping it into
+    a L{Deferred}.
+
+    @return: whatever C{f} returns or a L{Failure}, if it raised an exception
+
+    """
+    try:
+        return f(*args)
+    except Exception:
+        return Failure()
 
 
 class WriteSession(DatagramProtocol):
@@ -28,25 +50,53 @@ class WriteSession(DatagramProtocol):
     When (if) the iterable is exhausted, the transfer is considered failed.
     @type timeout: any iterable
 
+    @cvar window_size: Number of data chunks, that the remote peer sends before
+    waiting for an acknowledgement. We only send an ACKDatagram after this many
+    chunks (or after the last one). Default: 1 (as per
+    U{RFC7440<http://tools.ietf.org/html/rfc7440>})
+    @type window_size: C{int}
+
+    @cvar adaptive_timeout: If set, the timeouts are derived from the measured
+    round trip time (see L{RTTEstimator}) instead of L{timeout}. The longest
+    value of L{timeout} is still an upper bound for every single wait.
+    @type adaptive_timeout: C{bool}
+
+    @cvar block_opcode: opcode of the datagrams, that carry the transfer to
+    this session (see L{blockReceived})
+    @type block_opcode: C{int}
+
     @ivar started: whether or not this protocol has started
     @type started: C{bool}
 
+    @ivar rtt: round trip time estimate for this session
+    @type rtt: L{RTTEstimator}
+
     """
 
     block_size = 512
     timeout = (1, 3, 7)
     tsize = None
+    window_size = 1
+    adaptive_timeout = False
+    block_opcode = OP_DATA
 
     def __init__(self, writer, _clock=None):
         self.writer = writer
         self.blocknum = 0
         self.completed = False
+        self._received_in_window = 0
+        self._reported = False
+        self.rtt = RTTEstimator()
+        self.transmissions = 0
+        self.sent_at = None
+        self.last_ack = None
         self.started = False
-        self.timeout_watchdog = succeed(None)
         if _clock is None:
             self._clock = reactor
         else:
             self._clock = _clock
+        self.timeout_watchdog = SessionTimer(
+            self.transmitACK, self.timedOut, clock=self._clock)
 
     def cancel(self):
         """Cancel this session, discard any data, that was collected
@@ -72,53 +122,123 @@ class WriteSession(DatagramProtocol):
             log.msg("Got error: %s" % datagram)
             self.cancel()
 
+    def blockReceived(self, blocknum, datagram):
+        """Handle a raw DATA datagram without building a L{DATADatagram}. This
+        is the fast path for the bulk of the transfer.
+
+        @param blocknum: block number, that was read from the header
+        @type blocknum: C{int}
+
+        @param datagram: raw datagram, including the header
+        @type datagram: C{bytes}
+
+        """
+        return self.dataReceived(blocknum, memoryview(datagram)[4:])
+
     def tftp_DATA(self, datagram):
         """Handle incoming DATA TFTP datagram
 
         @type datagram: L{DATADatagram}
 
         """
-        next_blocknum = self.blocknum + 1
-        if datagram.blocknum < next_blocknum:
-            self.transport.write(ACKDatagram(datagram.blocknum).to_wire())
-        elif datagram.blocknum == next_blocknum:
+        return self.dataReceived(datagram.blocknum, datagram.data)
+
+    def dataReceived(self, blocknum, data):
+        """Handle a chunk of data, that was received in a DATA datagram.
+
+        @type blocknum: C{int}
+
+        @type data: C{bytes} or C{memoryview}
+
+        """
+        distance = (blocknum - self.blocknum) % 65536
+        if distance == 1:
             if self.completed:
                 self.transport.write(ERRORDatagram.from_code(
                     ERR_ILLEGAL_OP, b"Transfer already finished").to_wire())
             else:
-                return self.nextBlock(datagram)
+                return self.nextBlock(blocknum, data)
+        elif distance == 0 or distance > _HALF_BLOCKNUM_SPACE:
+            # A retransmitted chunk, that we've already written. Within a
+            # window, acknowledge everything we've got so far, so that the
+            # remote end doesn't resend the blocks one at a time, but only
+            # once: every further ACK would look like a gap in the next window.
+            if self.window_size > 1:
+                self.reportPosition()
+            else:
+                self.transport.write(ACK_WIRE[blocknum])
+        elif distance <= self.window_size:
+            # Some chunks of the current window were lost. Let the remote end
+            # know, where to restart from (RFC7440).
+            self.reportPosition()
         else:
             self.transport.write(ERRORDatagram.from_code(
                 ERR_ILLEGAL_OP, b"Block number mismatch").to_wire())
 
-    def nextBlock(self, datagram):
+    def reportPosition(self):
+        """Acknowledge the last block, that was written, because the blocks,
+        that arrived since, were out of order. This is done once until the next
+        block is written, the timeouts take it from there.
+
+        """
+        if self._reported:
+            return
+        self._reported = True
+        self._received_in_window = 0
+        self.sendACK(self.blocknum)
+
+    def nextBlock(self, blocknum, data):
         """Handle fresh data, attempt to write it to backend
 
-        @type datagram: L{DATADatagram}
+        @type blocknum: C{int}
 
-        """
-        self.timeout_watchdog.cancel()
-        self.blocknum += 1
-        d = maybeDeferred(self.writer.write, datagram.data)
-        d.addCallbacks(callback=self.blockWriteSuccess, callbackArgs=[datagram, ],
-                       errback=self.blockWriteFailure)
-        return d
+        @type data: C{bytes} or C{memoryview}
 
-    def blockWriteSuccess(self, ign, datagram):
+        """
+        self.timeout_watchdog.stop()
+        if self.adaptive_timeout and self.transmissions == 1:
+            self.rtt.sample(self._clock.seconds() - self.sent_at)
+        self.transmissions = 0
+        self._reported = False
+        self.blocknum = (self.blocknum + 1) % 65536
+        # The writers are given bytes, that they can keep, not a view of the
+        # datagram
+        result = _call(self.writer.write, bytes(data))
+        if isinstance(result, Deferred):
+            result.addCallbacks(callback=self.blockWriteSuccess,
+                                callbackArgs=[blocknum, len(data)],
+                                errback=self.blockWriteFailure)
+            return result
+        # The writer is done already, no need to wait for a Deferred
+        if isinstance(result, Failure):
+            return self.blockWriteFailure(result)
+        return self.blockWriteSuccess(result, blocknum, len(data))
+
+    def blockWriteSuccess(self, ign, blocknum, size):
         """The write was successful, respond with ACK for current block number
 
         If this is the last chunk (received data length < block size), the protocol
         will keep running until the end of current timeout period, so we can respond
         to any duplicates.
 
-        @type datagram: L{DATADatagram}
+        If the window is not complete yet, the ACK is withheld. It will only be
+        sent if the rest of the window doesn't arrive in time.
+
+        @param blocknum: number of the block, that was written
+        @type blocknum: C{int}
+
+        @param size: size of the block
+        @type size: C{int}
 
         """
-        bytes = ACKDatagram(datagram.blocknum).to_wire()
-        self.timeout_watchdog = timedCaller(
-            (0,) + self.timeout, partial(self.sendData, bytes),
-            self.timedOut, clock=self._clock)
-        if len(datagram.data) < self.block_size:
+        last = size < self.block_size
+        self._received_in_window += 1
+        if last or self._received_in_window >= self.window_size:
+            self._received_in_window = 0
+            self.sendACK(blocknum)
+        else:
+            self.sendACK(blocknum, immediately=False)
+        if last:
             self.completed = True
             self.writer.finish()
             # TODO: If self.tsize is not None, compare it with the actual
@@ -128,7 +248,7 @@ class WriteSession(DatagramProtocol):
     def blockWriteFailure(self, failure):
         """Write failed"""
         log.err(failure)
-        self.transport.write(ERRORDatagram.from_code(ERR_DISK_FULL).to_wire())
+        self.transport.write(ERROR_WIRE[ERR_DISK_FULL])
         self.cancel()
 
     def timedOut(self):
@@ -143,16 +263,154 @@ class WriteSession(DatagramProtocol):
             log.msg("Timed out after a successful transfer")
         self.transport.stopListening()
 
+    def sendACK(self, blocknum, immediately=True):
+        """Start sending ACKs for the given block number. The ACK is resent
+        every time a timeout expires, until the next chunk arrives or the
+        timeouts are exhausted.
+
+        @param blocknum: block number to acknowledge
+        @type blocknum: C{int}
+
+        @param immediately: if not set, the first ACK is only sent after the
+        first timeout
+        @type immediately: C{bool}
+
+        """
+        self.last_ack = ACK_WIRE[blocknum]
+        self.transmissions = 0
+        if immediately:
+            self.timeout_watchdog.start(self.timeouts(), 0)
+        else:
+            self.timeout_watchdog.start(self.timeouts())
+
+    def transmitACK(self):
+        """Send the current ACK (again)"""
+        self.sendData(self.last_ack)
+
+    def timeouts(self):
+        """Get the timeouts for the next transmission.
+
+        @return: L{timeout} or, if L{adaptive_timeout} is set, timeouts derived
+        from the round trip time estimate
+        @rtype: any iterable
+
+        """
+        if self.adaptive_timeout:
+            return self.rtt.timings(max(self.timeout))
+        return self.timeout
+
     def sendData(self, bytes):
-        """Send data to the remote peer
+        """Send data to the remote peer. Every transmission after the first one
+        backs off the round trip time estimate.
 
         @param bytes: bytes to send
         @type bytes: C{bytes}
 
         """
+        if self.transmissions == 0:
+            self.sent_at = self._clock.seconds()
+        elif self.adaptive_timeout:
+            self.rtt.backoff()
+        self.transmissions += 1
         self.transport.write(bytes)
 
 
+class ReadAhead(object):
+    """Reads blocks from an L{IReader} before they are requested, so that the
+    latency of the reader overlaps with the network round trip instead of
+    adding to it.
+
+    Reads are issued one at a time and in order, so the reader never sees
+    concurrent calls. At most C{depth} blocks are kept in memory.
+
+    @param reader: the reader to get the blocks from
+    @type reader: L{IReader} provider
+
+    @param block_size: size of every block. A shorter block is the last one.
+    @type block_size: C{int}
+
+    @param depth: how many blocks to keep ready
+    @type depth: C{int}
+
+    """
+
+    def __init__(self, reader, block_size, depth):
+        self.reader = reader
+        self.block_size = block_size
+        self.depth = depth
+        self.blocks = deque()
+        self.waiting = deque()
+        self.reading = False
+        self.exhausted = False
+        self.fill()
+
+    def fill(self):
+        """Start reading the next block, unless there is a read in progress,
+        the buffer is full or the reader has no more data.
+
+        """
+        if self.reading or self.exhausted:
+            return
+        if len(self.blocks) >= self.depth and not self.waiting:
+            return
+        self.reading = True
+        result = _call(self.reader.read, self.block_size)
+        if isinstance(result, Deferred):
+            result.addBoth(self._gotBlock)
+        else:
+            self._gotBlock(result)
+
+    def _gotBlock(self, result):
+        self.reading = False
+        if isinstance(result, Failure) or len(result) < self.block_size:
+            self.exhausted = True
+        if self.waiting:
+            self.waiting.popleft().callback(result)
+        else:
+            self.blocks.append(result)
+        self.fill()
+
+    def next(self):
+        """Get the next block.
+
+        @return: a L{Deferred}, that will fire with the data of the next block
+        or errback with the failure, that the reader reported
+        @rtype: L{Deferred}
+
+        """
+        result = self.take()
+        if isinstance(result, Deferred):
+            return result
+        if isinstance(result, Failure):
+            return fail(result)
+        return succeed(result)
+
+    def take(self):
+        """Get the next block without wrapping it into a L{Deferred}, if it has
+        been read already.
+
+        @return: the data of the next block, the L{Failure}, that the reader
+        reported, or, if the block is not there yet, a L{Deferred}, that will
+        fire with either
+        @rtype: C{bytes}, L{Failure} or L{Deferred}
+
+        """
+        if self.blocks:
+            result = self.blocks.popleft()
+        elif self.exhausted and not self.reading:
+            return _call(self.reader.read, self.block_size)
+        else:
+            result = Deferred()
+            self.waiting.append(result)
+        self.fill()
+        return result
+
+    def finish(self):
+        """Discard the buffered blocks and stop reading"""
+        self.exhausted = True
+        self.blocks.clear()
+
+
 class ReadSession(DatagramProtocol):
     """Represents a transfer, during which we read from a local file
     (and write to the network). If we are a server, this means, that we've received
@@ -169,29 +427,100 @@ class ReadSession(DatagramProtocol):
     the transfer is considered failed.
     @type timeout: any iterable
 
+    @cvar window_size: Number of DATADatagrams, that are sent before waiting for
+    an acknowledgement. Default: 1 (as per
+    U{RFC7440<http://tools.ietf.org/html/rfc7440>})
+    @type window_size: C{int}
+
+    @cvar read_ahead: Number of blocks, that are read from the reader before
+    they are needed. Default: 4
+    @type read_ahead: C{int}
+
+    @cvar adaptive_timeout: If set, the timeouts are derived from the measured
+    round trip time (see L{RTTEstimator}) instead of L{timeout}. The longest
+    value of L{timeout} is still an upper bound for every single wait.
+    @type adaptive_timeout: C{bool}
+
+    @cvar block_cache: If set and the reader has an identity, the DATA
+    datagrams are taken from this cache, that is shared with other sessions,
+    and the reader is only used for the blocks, that are not there yet.
+    @type block_cache: L{BlockCache<tftp.cache.BlockCache>} or C{NoneType}
+
+    @cvar block_opcode: opcode of the datagrams, that carry the transfer to
+    this session (see L{blockReceived})
+    @type block_opcode: C{int}
+
+    @ivar rtt: round trip time estimate for this session
+    @type rtt: L{RTTEstimator}
+
+    @ivar offset: number of bytes of the file, that were put into the window
+    @type offset: C{int}
+
+    @ivar blocks: the read-ahead buffer. It is created by L{prefetch} or by the
+    first call to L{nextBlock}, once the block size is known. Readers, that
+    provide C{readinto} (see L{IReader}), don't need one: their blocks are read
+    straight into the send buffers.
+    @type blocks: L{ReadAhead} or C{NoneType}
+
+    @ivar buffers: send buffers, that are free to be reused, once the blocks,
+    that were read into them, have been acknowledged
+    @type buffers: C{list} of C{bytearray}
+
     @ivar started: whether or not this protocol has started
     @type started: C{bool}
 
+    @ivar resent_window: whether the current window was sent again in response
+    to a gap ACK (see L{ackReceived})
+    @type resent_window: C{bool}
+
+    @ivar previous_resent: whether the window, that was acknowledged last, was
+    sent more than once
+    @type previous_resent: C{bool}
+
+    @ivar window: wire representations of the DATADatagrams, that were sent, but
+    have not been acknowledged yet, oldest first. The last item corresponds to
+    L{blocknum}. A datagram is either a single buffer or a C{(header, payload)}
+    tuple (see L{addData}).
+    @type window: C{list} of C{bytes}, C{memoryview} or C{tuple}
+
     """
     block_size = 512
     timeout = (1, 3, 7)
+    window_size = 1
+    read_ahead = 4
+    adaptive_timeout = False
+    block_cache = None
+    block_opcode = OP_ACK
 
     def __init__(self, reader, _clock=None):
         self.reader = reader
+        self.blocks = None
         self.blocknum = 0
+        self.offset = 0
+        self.window = []
+        self.buffers = []
+        self.rtt = RTTEstimator()
+        self.transmissions = 0
+        self.sent_at = None
+        self.filling = False
+        self.resent_window = False
+        self.previous_resent = False
         self.started = False
         self.completed = False
-        self.timeout_watchdog = succeed(None)
         if _clock is None:
             self._clock = reactor
         else:
             self._clock = _clock
+        self.timeout_watchdog = SessionTimer(
+            self.sendWindow, self.timedOut, clock=self._clock)
 
     def cancel(self):
         """Tell the reader to give up the resources. Stop the timeout cycle
         and disconnect the transport.
 
         """
+        if self.blocks is not None:
+            self.blocks.finish()
         self.reader.finish()
         self.timeout_watchdog.cancel()
         self.transport.stopListening()
@@ -209,49 +538,261 @@ class ReadSession(DatagramProtocol):
             log.msg("Got error: %s" % datagram)
             self.cancel()
 
+    def blockReceived(self, blocknum, datagram):
+        """Handle a raw ACK datagram without building an L{ACKDatagram}. This
+        is the fast path for the bulk of the transfer.
+
+        @param blocknum: block number, that was read from the header
+        @type blocknum: C{int}
+
+        @param datagram: raw datagram, including the header
+        @type datagram: C{bytes}
+
+        @raise PayloadDecodeError: if there is anything after the block number
+
+        """
+        if len(datagram) != 4:
+            raise PayloadDecodeError("Unable to extract the block number")
+        return self.ackReceived(blocknum)
+
     def tftp_ACK(self, datagram):
         """Handle the incoming ACK TFTP datagram.
 
         @type datagram: L{ACKDatagram}
 
         """
-        if datagram.blocknum < self.blocknum:
-            log.msg("Duplicate ACK for blocknum %s" % datagram.blocknum)
-        elif datagram.blocknum == self.blocknum:
-            self.timeout_watchdog.cancel()
-            if self.completed:
+        return self.ackReceived(datagram.blocknum)
+
+    def ackReceived(self, blocknum):
+        """Handle an acknowledgement of C{blocknum}.
+
+        An ACK for any block in the current window acknowledges that block and
+        every block before it. The rest of the window is sent again, topped up
+        with fresh blocks (U{RFC7440<http://tools.ietf.org/html/rfc7440>}).
+        An ACK for the block right before the window means, that its first
+        block was lost: the window is sent again right away, but only once.
+        Unless the previous window was sent more than once: then it can also be
+        the remote end acknowledging the copies of that window, so the timeout
+        is waited for instead.
+
+        @type blocknum: C{int}
+
+        """
+        if self.filling:
+            log.msg("ACK for blocknum %s received while reading, ignored"
+                    % blocknum)
+            return
+        distance = (self.blocknum - blocknum) % 65536
+        if distance < len(self.window) or (distance == 0 and not self.window):
+            self.timeout_watchdog.stop()
+            # A window, that was resent after a gap ACK, is a retransmission
+            # too: its ACKs are not sampled (Karn's algorithm)
+            if (self.adaptive_timeout and self.transmissions == 1 and
+                    not self.resent_window):
+                self.rtt.sample(self._clock.seconds() - self.sent_at)
+            self.previous_resent = self.transmissions > 1 or self.resent_window
+            self.resent_window = False
+            acknowledged = len(self.window) - distance
+            for wire in self.window[:acknowledged]:
+                if isinstance(wire, memoryview):
+                    self.buffers.append(wire.obj)
+            del self.window[:acknowledged]
+            if self.completed and not self.window:
                 log.msg("Final ACK received, transfer successful")
                 self.cancel()
+            elif self.completed:
+                self.transmitWindow()
             else:
                 return self.nextBlock()
+        elif (distance == len(self.window) and self.window_size > 1 and
+                not self.resent_window and not self.previous_resent):
+            # The first block of the window was lost and the remote end is
+            # telling us, where to restart from. Don't wait for the timeout,
+            # but don't let the duplicates of this ACK resend it again either.
+            log.msg("Gap ACK for blocknum %s, resending the window" % blocknum)
+            self.timeout_watchdog.stop()
+            self.resent_window = True
+            self.transmitWindow()
+        elif distance < _HALF_BLOCKNUM_SPACE:
+            log.msg("Duplicate ACK for blocknum %s" % blocknum)
         else:
             self.transport.write(ERRORDatagram.from_code(
                 ERR_ILLEGAL_OP, b"Block number mismatch").to_wire())
 
+    def prefetch(self):
+        """Start reading ahead. Must not be called before the block size is
+        final, i.e. before the options have been applied.
+
+        Blocks are not read ahead if the L{block_cache} is used or if the
+        reader can read into the send buffers.
+
+        """
+        if (self.blocks is None and self.cacheIdentity() is None and
+                getattr(self.reader, 'readinto', None) is None):
+            self.blocks = ReadAhead(self.reader, self.block_size,
+                                    max(self.read_ahead, 1))
+
     def nextBlock(self):
-        """ACK datagram for the previous block has been received. Attempt to read
-        the next block, that will be sent.
+        """The window has room for another block. Take the blocks, that will be
+        sent, from the L{block_cache} or from the read-ahead buffer, until the
+        window is full.
+
+        The blocks, that are available right away, are added in a loop. Only
+        if the reader has to be waited for, the rest is done in a callback.
+
+        @return: a L{Deferred}, if the reader has to be waited for
 
         """
-        self.blocknum += 1
-        d = maybeDeferred(self.reader.read, self.block_size)
-        d.addCallbacks(callback=self.dataFromReader, errback=self.readFailed)
-        return d
+        self.filling = True
+        while True:
+            self.blocknum += 1
+            identity = self.cacheIdentity()
+            readinto = getattr(self.reader, 'readinto', None)
+            if identity is None and readinto is not None:
+                view = self.sendBuffer()
+                result = _call(readinto, view[4:])
+                if isinstance(result, Deferred):
+                    result.addCallbacks(callback=self.readIntoBuffer,
+                                        callbackArgs=(view,), errback=self.readFailed)
+                    return result
+                if isinstance(result, Failure):
+                    return self.readFailed(result)
+                if not self.addBuffer(view, result):
+                    return
+                continue
+            if identity is None:
+                key = None
+                self.prefetch()
+                result = self.blocks.take()
+            else:
+                key = (identity, self.block_size, self.offset)
+                wire = self.block_cache.get(key)
+                if wire is not None:
+                    # reached maximum number of blocks. Rolling over
+                    if self.blocknum == 65536:
+                        self.blocknum = 0
+                    if not self.addToWindow(wire, len(wire) - 4):
+                        return
+                    continue
+                self.reader.seek(self.offset)
+                result = _call(self.reader.read, self.block_size)
+            if isinstance(result, Deferred):
+                result.addCallbacks(callback=self.dataFromReader,
+                                    callbackArgs=(key,), errback=self.readFailed)
+                return result
+            if isinstance(result, Failure):
+                return self.readFailed(result)
+            if not self.addData(result, key):
+                return
+
+    def cacheIdentity(self):
+        """Get the identity of the file for the L{block_cache} or C{None}, if
+        the cache is not used.
+
+        """
+        if self.block_cache is None:
+            return None
+        return getattr(self.reader, 'identity', None)
+
+    def sendBuffer(self):
+        """Get a free send buffer, that has room for the DATA header and one
+        block.
 
-    def dataFromReader(self, data):
-        """Got data from the reader. Send it to the network and start the timeout
-        cycle.
+        @rtype: C{memoryview}
+
+        """
+        if self.buffers:
+            return memoryview(self.buffers.pop())
+        return memoryview(bytearray(self.block_size + 4))
+
+    def readIntoBuffer(self, size, view):
+        """The reader has read C{size} bytes into the send buffer C{view}. Add
+        it to the window and go on with the next block, if there is room for it.
+
+        """
+        if self.addBuffer(view, size):
+            return self.nextBlock()
+
+    def addBuffer(self, view, size):
+        """Put the header of the current block in front of the C{size} bytes of
+        data, that were read into the send buffer C{view}, and add it to the
+        window.
+
+        @return: whether the window has room for another block
+        @rtype: C{bool}
+
+        """
+        # reached maximum number of blocks. Rolling over
+        if self.blocknum == 65536:
+            self.blocknum = 0
+        HEADER.pack_into(view, 0, OP_DATA, self.blocknum)
+        return self.addToWindow(view[:size + 4], size)
+
+    def dataFromReader(self, data, key=None):
+        """Got data from the reader, that had to be waited for. Add it to the
+        window and go on with the next block, if there is room for it.
+
+        """
+        if self.addData(data, key):
+            return self.nextBlock()
+
+    def addData(self, data, key=None):
+        """Encode C{data} as the current block and add it to the window (and to
+        the L{block_cache}, if C{key} is given). A C{memoryview}, that is not
+        cached, is not copied into the datagram: it is added along with the
+        header, so that the transport can gather them (see L{sendWindow}).
+
+        @return: whether the window has room for another block
+        @rtype: C{bool}
 
         """
         # reached maximum number of blocks. Rolling over
         if self.blocknum == 65536:
             self.blocknum = 0
-        if len(data) < self.block_size:
+        if key is None and type(data) is memoryview:
+            # Zero-copy data is sent as it is, after its own header
+            wire = (HEADER.pack(OP_DATA, self.blocknum), data)
+        else:
+            wire = DATADatagram(self.blocknum, data).to_wire()
+        if key is not None:
+            self.block_cache.put(key, wire)
+        return self.addToWindow(wire, len(data))
+
+    def addToWindow(self, wire, length):
+        """Add a block of C{length} bytes of data, that was encoded as C{wire},
+        to the window. If the window is full or this was the last block, send
+        the window to the network and start the timeout cycle.
+
+        @return: whether the window has room for another block
+        @rtype: C{bool}
+
+        """
+        self.offset += length
+        if length < self.block_size:
             self.completed = True
-        bytes = DATADatagram(self.blocknum, data).to_wire()
-        self.timeout_watchdog = timedCaller(
-            (0,) + self.timeout, partial(self.sendData, bytes),
-            self.timedOut, clock=self._clock)
+        self.window.append(wire)
+        if not self.completed and len(self.window) < self.window_size:
+            return True
+        self.transmitWindow()
+        return False
+
+    def transmitWindow(self):
+        """Send the current window and start the timeout cycle for it"""
+        self.filling = False
+        self.transmissions = 0
+        self.timeout_watchdog.start(self.timeouts(), 0)
+
+    def timeouts(self):
+        """Get the timeouts for the next transmission.
+
+        @return: L{timeout} or, if L{adaptive_timeout} is set, timeouts derived
+        from the round trip time estimate
+        @rtype: any iterable
+
+        """
+        if self.adaptive_timeout:
+            return self.rtt.timings(max(self.timeout))
+        return self.timeout
 
     def readFailed(self, fail):
         """The reader reported an error. Notify the remote end and cancel the transfer"""
@@ -261,7 +802,12 @@ class ReadSession(DatagramProtocol):
 
     def timedOut(self):
         """Timeout iterable has been exhausted. End the transfer"""
-        log.msg("Session timed out, last wait was %s seconds long" % self.timeout[-1])
+        if self.adaptive_timeout:
+            log.msg("Session timed out, retransmission timeout was %s seconds"
+                    % self.rtt.rto)
+        else:
+            log.msg("Session timed out, last wait was %s seconds long"
+                    % self.timeout[-1])
         self.cancel()
 
     def sendData(self, bytes):
@@ -272,3 +818,34 @@ class ReadSession(DatagramProtocol):
 
         """
         self.transport.write(bytes)
+
+    def sendWindow(self):
+        """Send every unacknowledged datagram of the current window. Every
+        transmission after the first one backs off the round trip time estimate.
+
+        The datagrams, that are made of a header and a separate payload, are
+        sent with C{writeBuffers}, if the transport has it (see
+        L{ScatterPort<tftp.udp.ScatterPort>}), or joined otherwise. A window
+        of several datagrams is passed to C{writeBatch}, if the transport has
+        it, which sends it with the segmentation offload or with C{sendmmsg},
+        if these are enabled, or one datagram at a time otherwise.
+
+        """
+        if self.transmissions == 0:
+            self.sent_at = self._clock.seconds()
+        elif self.adaptive_timeout:
+            self.rtt.backoff()
+        self.transmissions += 1
+        writeBatch = getattr(self.transport, 'writeBatch', None)
+        if writeBatch is not None and len(self.window) > 1:
+            writeBatch(self.window)
+            return
+        write = self.transport.write
+        writeBuffers = getattr(self.transport, 'writeBuffers', None)
+        for wire in self.window:
+            if type(wire) is not tuple:
+                write(wire)
+            elif writeBuffers is None:
+                write(b''.join(wire))
+            else:
+                writeBuffers(wire)
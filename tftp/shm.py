@@ -0,0 +1,385 @@
+'''
+@author: shylent
+'''
+from hashlib import sha1
+from os import fstat
+from tftp.backend import IBackend, IReader
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python import log
+from zope import interface
+import errno
+import os
+import struct
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+    from multiprocessing import resource_tracker
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    SharedMemory = None
+
+
+__all__ = ['SharedMemoryCacheBackend', 'SharedMemoryReader']
+
+
+# Before 3.13 every segment, that a process opens, is tracked and unlinked,
+# when that process exits, which defeats sharing it with other processes
+_TRACKED = sys.version_info < (3, 13)
+
+# An entry of the index: segment name, file size, time of the last use,
+# pid of the process, that is filling the segment (0, once it is ready)
+_ENTRY = struct.Struct('=48sQdi4x')
+
+
+def _open_segment(name, create=False, size=0):
+    if not _TRACKED:
+        return SharedMemory(name, create, size, track=False)
+    segment = SharedMemory(name, create, size)
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+def _unlink_segment(name):
+    try:
+        segment = _open_segment(name)
+    except FileNotFoundError:
+        return
+    if _TRACKED:
+        # unlink() stops tracking the segment, so it must be tracked first
+        resource_tracker.register(segment._name, 'shared_memory')
+    segment.close()
+    segment.unlink()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class SharedIndex(object):
+    """A table of the cached files, that lives in a shared memory segment of
+    its own and is guarded by a lock file, so that all of the processes on the
+    host see the same entries.
+
+    @ivar entries: number of entries in the table
+    @type entries: C{int}
+
+    """
+
+    def __init__(self, prefix, entries):
+        self.prefix = prefix
+        self.entries = entries
+        self.lock_path = os.path.join(tempfile.gettempdir(), prefix + '.lock')
+        self._lock_file = None
+        self._segment = None
+
+    def __enter__(self):
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'ab')
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        if self._segment is None:
+            name = self.prefix + '-index'
+            try:
+                self._segment = _open_segment(name)
+            except FileNotFoundError:
+                self._segment = _open_segment(
+                    name, create=True, size=_ENTRY.size * self.entries)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __iter__(self):
+        """Generate C{(slot, name, size, last_used, filler)} for the used slots.
+        Must be called with the lock held.
+
+        """
+        buf = self._segment.buf
+        for slot in range(min(self.entries, len(buf) // _ENTRY.size)):
+            name, size, last_used, filler = _ENTRY.unpack_from(
+                buf, slot * _ENTRY.size)
+            name = name.rstrip(b'\0')
+            if name:
+                yield slot, name.decode('ascii'), size, last_used, filler
+
+    def set(self, slot, name, size, filler):
+        _ENTRY.pack_into(self._segment.buf, slot * _ENTRY.size,
+                         name.encode('ascii'), size, time.time(), filler)
+
+    def clear(self, slot):
+        _ENTRY.pack_into(self._segment.buf, slot * _ENTRY.size, b'', 0, 0, 0)
+
+    def free_slot(self):
+        used = set(slot for slot, name, size, last_used, filler in self)
+        for slot in range(self.entries):
+            if slot not in used:
+                return slot
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+@interface.implementer(IReader)
+class SharedMemoryReader(object):
+    """Reads a file from a shared memory segment. The data is returned as
+    C{memoryview} slices of the segment, not copied.
+
+    @see: L{IReader}
+
+    """
+
+    def __init__(self, backend, name, segment, size):
+        self.backend = backend
+        self.name = name
+        self.size = size
+        self.view = segment.buf[:size]
+        self.identity = name
+        self.offset = 0
+        self.state = 'active'
+
+    def seek(self, offset):
+        """Continue reading at C{offset}"""
+        self.offset = offset
+
+    def read(self, size):
+        """
+        @see: L{IReader.read}
+
+        @return: data, that was read
+        @rtype: C{memoryview}
+
+        """
+        if self.state == 'finished':
+            return b''
+        data = self.view[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+
+    def finish(self):
+        """
+        @see: L{IReader.finish}
+
+        """
+        if self.state != 'finished':
+            self.state = 'finished'
+            self.view.release()
+            self.view = None
+            self.backend._detach(self.name)
+
+
+@interface.implementer(IBackend)
+class SharedMemoryCacheBackend(object):
+    """Serves files from a L{FilesystemSynchronousBackend<tftp.backend.FilesystemSynchronousBackend>}
+    through a cache in shared memory, that all of the processes on the host,
+    which use the same C{prefix}, have in common.
+
+    Each cached file is a shared memory segment, named after the path, inode,
+    modification time and size of the file, so a changed file is cached
+    anew, while the outdated segment is eventually evicted. The segments are
+    listed in a L{SharedIndex}, least recently used ones are evicted to keep
+    their total size within C{budget}. A file is read into the segment by the
+    first process, that needs it, in a thread of the reactor's thread pool;
+    until it's done, the transfers (including the one, that needed it) read
+    the file as usual.
+
+    Writes are passed to the wrapped backend.
+
+    @param backend: the backend, that the files are read from
+    @type backend: L{FilesystemSynchronousBackend<tftp.backend.FilesystemSynchronousBackend>}
+
+    @param budget: total size of the cached files, in bytes
+    @type budget: C{int}
+
+    @param prefix: common prefix of the names of the segments and of the lock
+    file, up to 31 characters long
+    @type prefix: C{str}
+
+    @param entries: the largest number of files to cache
+    @type entries: C{int}
+
+    @ivar hits: number of reads, that were served from the cache
+    @type hits: C{int}
+
+    @ivar misses: number of reads, that were not
+    @type misses: C{int}
+
+    @ivar fills: the segments, that this process is filling, by name. The
+    L{Deferred<twisted.internet.defer.Deferred>} fires, once the segment is
+    ready or has been given up on.
+    @type fills: C{dict}
+
+    """
+
+    def __init__(self, backend, budget, prefix='tftp', entries=256,
+                 _reactor=reactor):
+        if SharedMemory is None:
+            raise NotImplementedError(
+                "Shared memory is not available on this platform")
+        if len(prefix) > 31:
+            raise ValueError("Prefix is too long: %s" % prefix)
+        self.backend = backend
+        self.budget = budget
+        self.prefix = prefix
+        self.index = SharedIndex(prefix, entries)
+        self.hits = 0
+        self.misses = 0
+        self.fills = {}
+        self._segments = {}
+        self._reactor = _reactor
+
+    def get_reader(self, file_name):
+        """
+        @see: L{IBackend.get_reader}
+
+        @rtype: L{Deferred}, yielding a L{SharedMemoryReader} or whatever the
+        wrapped backend returns, if the file is not cached (yet)
+
+        """
+        return self.backend.get_reader(file_name).addCallback(self._cached)
+
+    def get_writer(self, file_name):
+        """
+        @see: L{IBackend.get_writer}
+
+        """
+        return self.backend.get_writer(file_name)
+
+    def _segmentName(self, file_path, stat):
+        key = b'\0'.join([file_path.asBytesMode().path] + [
+            str(value).encode('ascii') for value in
+            (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)])
+        return '%s-%s' % (self.prefix, sha1(key).hexdigest()[:16])
+
+    def _cached(self, reader):
+        stat = fstat(reader.file_obj.fileno())
+        if not 0 < stat.st_size <= self.budget:
+            return reader
+        name = self._segmentName(reader.file_path, stat)
+        with self.index:
+            for slot, entry, size, last_used, filler in self.index:
+                if entry == name:
+                    break
+            else:
+                slot = None
+            if slot is not None:
+                if filler and _is_alive(filler):
+                    self.misses += 1
+                    return reader
+                if not filler:
+                    self.index.set(slot, name, size, 0)
+                    self.hits += 1
+                    reader.finish()
+                    return self._attach(name, size)
+                # The process, that was filling the segment, is gone
+                _unlink_segment(name)
+                self.index.clear(slot)
+            slot = self._reserve(stat.st_size)
+            if slot is None:
+                self.misses += 1
+                return reader
+            self.index.set(slot, name, stat.st_size, os.getpid())
+        self.misses += 1
+        # A large file would hold up every other transfer, if it was copied
+        # here, so this reader reads the file, while the segment is filled
+        d = deferToThreadPool(self._reactor, self._reactor.getThreadPool(),
+                              self._fill, name, reader.file_path, stat.st_size)
+        d.addCallbacks(self._filled, self._fillFailed,
+                       callbackArgs=(name, slot, stat.st_size),
+                       errbackArgs=(name, slot))
+        self.fills[name] = d
+        return reader
+
+    def _fill(self, name, file_path, size):
+        """Copy the file into a new segment. Runs in a thread."""
+        with file_path.open() as file_obj:
+            if self._segmentName(file_path, fstat(file_obj.fileno())) != name:
+                raise IOError("%s has changed" % (file_path.path,))
+            segment = _open_segment(name, create=True, size=size)
+            try:
+                read = file_obj.readinto(segment.buf[:size])
+            finally:
+                segment.close()
+        if read != size:
+            raise IOError("%s is shorter, than expected" % (file_path.path,))
+
+    def _filled(self, ign, name, slot, size):
+        del self.fills[name]
+        with self.index:
+            self.index.set(slot, name, size, 0)
+
+    def _fillFailed(self, failure, name, slot):
+        del self.fills[name]
+        log.err(failure, "Failed to cache %s" % (name,))
+        with self.index:
+            _unlink_segment(name)
+            self.index.clear(slot)
+
+    def _reserve(self, size):
+        """Evict the least recently used files, until C{size} more bytes fit
+        into the budget, and return a free slot. Must be called with the lock
+        held.
+
+        @return: a slot number or C{None}, if there is no room
+        @rtype: C{int} or C{NoneType}
+
+        """
+        entries = list(self.index)
+        used = sum(entry[2] for entry in entries)
+        ready = sorted((entry for entry in entries if not entry[4]),
+                       key=lambda entry: entry[3])
+        free = self.index.free_slot()
+        while ready and (used + size > self.budget or free is None):
+            slot, name, entry_size, last_used, filler = ready.pop(0)
+            _unlink_segment(name)
+            self.index.clear(slot)
+            used -= entry_size
+            free = slot if free is None else free
+        if used + size > self.budget:
+            return None
+        return free
+
+    def _attach(self, name, size):
+        if name in self._segments:
+            segment, users = self._segments[name]
+        else:
+            segment, users = _open_segment(name), 0
+        self._segments[name] = segment, users + 1
+        return SharedMemoryReader(self, name, segment, size)
+
+    def _detach(self, name):
+        segment, users = self._segments[name]
+        if users > 1:
+            self._segments[name] = segment, users - 1
+            return
+        del self._segments[name]
+        try:
+            segment.close()
+        except BufferError:
+            # Some data is still referenced, the memory is unmapped, once
+            # it's collected
+            pass
+
+    def purge(self):
+        """Remove all of the cached files, the index and the lock file"""
+        with self.index:
+            for slot, name, size, last_used, filler in self.index:
+                _unlink_segment(name)
+                self.index.clear(slot)
+        self.index.close()
+        _unlink_segment(self.prefix + '-index')
+        try:
+            os.remove(self.index.lock_path)
+        except OSError:
+            pass
@@ -2,11 +2,21 @@
 @author: shylent
 '''
 from tftp.backend import (FilesystemSynchronousBackend, FilesystemReader,
-    FilesystemWriter, IReader, IWriter)
+    FilesystemWriter, IReader, IWriter, MappedReader,
+    FilesystemAsynchronousBackend, SerialCalls, ThreadedReader, ThreadedWriter,
+    FileDescriptors, SharedReader, AtomicWriter)
+from tftp import backend
+from tftp.datagram import DATADatagram
 from tftp.errors import Unsupported, AccessViolation, FileNotFound, FileExists
+from tftp.session import WriteSession
+from tftp.test.test_sessions import FakeTransport
 from twisted.python.filepath import FilePath
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import gatherResults, inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.python.threadpool import ThreadPool
 from twisted.trial import unittest
+import errno
+import os
 import shutil
 import tempfile
 
@@ -101,6 +111,25 @@ line3
                         b"The file has been exhausted and should be in the closed state")
         self.assertEqual(ostring, self.test_data)
 
+    def test_readinto(self):
+        r = FilesystemReader(self.temp_dir.child(b'foo'))
+        buffer = bytearray(10)
+        self.assertEqual(r.readinto(buffer), 10)
+        self.assertEqual(buffer, self.test_data[:10])
+        self.assertEqual(r.readinto(memoryview(buffer)[2:]), 8)
+        self.assertEqual(buffer[2:], self.test_data[10:18])
+        self.assertEqual(r.readinto(buffer), 0)
+        self.assertTrue(r.file_obj.closed)
+        self.assertEqual(r.readinto(buffer), 0)
+
+    def test_readinto_not_used_by_subclasses(self):
+        class UpperCaseReader(FilesystemReader):
+            def read(self, size):
+                return FilesystemReader.read(self, size).upper()
+        r = UpperCaseReader(self.temp_dir.child(b'foo'))
+        self.assertIdentical(r.readinto, None)
+        r.finish()
+
     def test_size(self):
         r = FilesystemReader(self.temp_dir.child(b'foo'))
         self.assertEqual(len(self.test_data), r.size)
@@ -130,6 +159,257 @@ line3
         self.temp_dir.remove()
 
 
+class AccessHints(unittest.TestCase):
+    test_data = b"abcdefghijklmnopqrstuvwxyz"
+
+    if getattr(os, 'posix_fadvise', None) is None:
+        skip = "posix_fadvise is not available"
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.temp_dir.child(b'foo').setContent(self.test_data)
+        self.hints = []
+        self.patch(backend, '_fadvise', self.fadvise)
+        self.patch(backend, '_DROP_INTERVAL', 10)
+
+    def fadvise(self, fd, offset, length, advice):
+        os.posix_fadvise(fd, offset, length, advice)
+        self.hints.append((advice, offset, length))
+
+    def test_advise(self):
+        r = FilesystemReader(self.temp_dir.child(b'foo'), advise=True)
+        self.assertEqual(self.hints, [
+            (os.POSIX_FADV_SEQUENTIAL, 0, 0),
+            (os.POSIX_FADV_WILLNEED, 0, backend._WILLNEED_SIZE)])
+        self.assertEqual(r.read(100), self.test_data)
+        r.finish()
+        self.assertEqual(len(self.hints), 2)
+
+    def test_drop_behind(self):
+        r = FilesystemReader(self.temp_dir.child(b'foo'), drop_behind=20)
+        self.assertEqual(self.hints, [])
+        for i in range(4):
+            r.read(5)
+        self.assertEqual(self.hints, [(os.POSIX_FADV_DONTNEED, 0, 10),
+                                      (os.POSIX_FADV_DONTNEED, 10, 10)])
+        buffer = bytearray(10)
+        self.assertEqual(r.readinto(buffer), 6)
+        self.assertEqual(r.readinto(buffer), 0)
+        self.assertEqual(self.hints[2:], [(os.POSIX_FADV_DONTNEED, 20, 0)])
+
+    def test_drop_behind_finished(self):
+        r = FilesystemReader(self.temp_dir.child(b'foo'), drop_behind=20)
+        r.read(5)
+        r.finish()
+        self.assertEqual(self.hints, [(os.POSIX_FADV_DONTNEED, 0, 0)])
+
+    def test_small_file_kept(self):
+        r = FilesystemReader(self.temp_dir.child(b'foo'), drop_behind=26)
+        self.assertEqual(r.read(100), self.test_data)
+        self.assertEqual(r.read(100), b'')
+        self.assertEqual(self.hints, [])
+
+    def test_backend(self):
+        b = FilesystemSynchronousBackend(self.temp_dir, advise=True,
+                                         drop_behind=20)
+        r = self.successResultOf(b.get_reader(b'foo'))
+        r.finish()
+        self.assertEqual([hint[0] for hint in self.hints], [
+            os.POSIX_FADV_SEQUENTIAL, os.POSIX_FADV_WILLNEED,
+            os.POSIX_FADV_DONTNEED])
+
+
+class Mapped(unittest.TestCase):
+    test_data = b"abcdefghijklmnopqrstuvwxyz"
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.temp_dir.child(b'foo').setContent(self.test_data)
+        self.backend = FilesystemSynchronousBackend(self.temp_dir, use_mmap=True)
+
+    def getReader(self, file_name=b'foo'):
+        return self.successResultOf(self.backend.get_reader(file_name))
+
+    def test_read(self):
+        r = self.getReader()
+        self.assertIsInstance(r, MappedReader)
+        self.assertEqual(r.size, len(self.test_data))
+        data = r.read(10)
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(data, self.test_data[:10])
+        self.assertEqual(r.read(20), self.test_data[10:])
+        self.assertEqual(r.read(20), b'')
+        r.seek(5)
+        self.assertEqual(r.read(3), b'fgh')
+        self.assertIdentical(r.readinto, None)
+        r.finish()
+        self.assertEqual(r.read(3), b'')
+
+    def test_shared_mapping(self):
+        first, second = self.getReader(), self.getReader()
+        self.assertEqual(len(self.backend.mappings.mappings), 1)
+        self.assertIdentical(first.view, second.view)
+        first.finish()
+        first.finish()
+        self.assertEqual(second.read(3), b'abc')
+        self.assertEqual(len(self.backend.mappings.mappings), 1)
+        second.finish()
+        self.assertEqual(self.backend.mappings.mappings, {})
+
+    def test_released_with_slices_left(self):
+        r = self.getReader()
+        data = r.read(3)
+        r.finish()
+        self.assertEqual(self.backend.mappings.mappings, {})
+        self.assertEqual(data, b'abc')
+
+    def test_changed_file(self):
+        first = self.getReader()
+        self.temp_dir.child(b'foo').setContent(b'changed')
+        self.temp_dir.child(b'foo').touch()
+        second = self.getReader()
+        self.assertEqual(first.read(3), b'abc')
+        self.assertEqual(second.read(7), b'changed')
+        first.finish()
+        second.finish()
+
+    def test_empty_file(self):
+        self.temp_dir.child(b'empty').setContent(b'')
+        r = self.getReader(b'empty')
+        self.assertEqual(r.read(10), b'')
+        r.finish()
+
+    def test_file_not_found(self):
+        self.failureResultOf(self.backend.get_reader(b'bar'), FileNotFound)
+
+    def tearDown(self):
+        self.temp_dir.remove()
+
+
+class SharedDescriptors(unittest.TestCase):
+    test_data = b"abcdefghijklmnopqrstuvwxyz"
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.temp_dir.child(b'foo').setContent(self.test_data)
+        self.backend = FilesystemSynchronousBackend(self.temp_dir,
+                                                    share_descriptors=True)
+        self.backend.descriptors = FileDescriptors(5, _clock=self.clock)
+        self.files = self.backend.descriptors.files
+
+    def getReader(self, file_name=b'foo'):
+        return self.successResultOf(self.backend.get_reader(file_name))
+
+    def test_read(self):
+        r = self.getReader()
+        self.assertIsInstance(r, SharedReader)
+        self.assertEqual(r.size, len(self.test_data))
+        self.assertEqual(r.read(10), self.test_data[:10])
+        r.seek(5)
+        self.assertEqual(r.read(3), b'fgh')
+        buffer = bytearray(30)
+        self.assertEqual(r.readinto(memoryview(buffer)[2:]), 18)
+        self.assertEqual(buffer[2:20], self.test_data[8:])
+        self.assertEqual(r.read(20), b'')
+        self.assertEqual(r.read(20), b'')
+        self.assertIdentical(r.size, None)
+        r.finish()
+
+    def test_shared_descriptor(self):
+        first, second = self.getReader(), self.getReader()
+        self.assertEqual(len(self.files), 1)
+        self.assertEqual(first.fd, second.fd)
+        self.assertEqual(first.identity, second.identity)
+        self.assertEqual(first.read(3), b'abc')
+        self.assertEqual(second.read(5), b'abcde')
+        self.assertEqual(first.read(3), b'def')
+        first.finish()
+        first.finish()
+        self.assertEqual(second.read(3), b'fgh')
+        second.finish()
+        self.assertEqual(self.files[self.temp_dir.child(b'foo').path][2], 0)
+
+    def test_idle_close(self):
+        r = self.getReader()
+        fd = r.fd
+        r.finish()
+        self.clock.advance(4)
+        # Reused before it's closed
+        r = self.getReader()
+        self.assertEqual(r.fd, fd)
+        r.finish()
+        self.clock.advance(4)
+        self.assertEqual(len(self.files), 1)
+        self.clock.advance(1)
+        self.assertEqual(self.files, {})
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def test_replaced_file(self):
+        first = self.getReader()
+        # Written to a temporary file, that replaces the old one
+        self.temp_dir.child(b'foo').setContent(b'changed')
+        second = self.getReader()
+        self.assertNotEqual(first.fd, second.fd)
+        self.assertEqual(first.read(3), b'abc')
+        self.assertEqual(second.read(7), b'changed')
+        fd = first.fd
+        first.finish()
+        self.assertRaises(OSError, os.fstat, fd)
+        second.finish()
+        self.assertEqual(len(self.files), 1)
+
+    def test_replaced_idle_file(self):
+        first = self.getReader()
+        first.finish()
+        self.temp_dir.child(b'foo').setContent(b'changed')
+        second = self.getReader()
+        # The old descriptor was closed right away
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(second.read(7), b'changed')
+        second.finish()
+        self.clock.advance(5)
+        self.assertEqual(self.files, {})
+
+    def test_readinto_not_used_by_subclasses(self):
+        class UpperCaseReader(SharedReader):
+            def read(self, size):
+                return SharedReader.read(self, size).upper()
+        r = UpperCaseReader(self.temp_dir.child(b'foo'),
+                            self.backend.descriptors)
+        self.assertIdentical(r.readinto, None)
+        r.finish()
+
+    def test_file_not_found(self):
+        self.failureResultOf(self.backend.get_reader(b'bar'), FileNotFound)
+        self.temp_dir.child(b'dir').makedirs()
+        self.failureResultOf(self.backend.get_reader(b'dir'), FileNotFound)
+        self.assertEqual(self.files, {})
+
+    def test_removed_file(self):
+        self.getReader().finish()
+        self.temp_dir.child(b'foo').remove()
+        self.failureResultOf(self.backend.get_reader(b'foo'), FileNotFound)
+
+    def test_close_all(self):
+        r = self.getReader()
+        self.getReader(b'foo').finish()
+        self.temp_dir.child(b'bar').setContent(b'bar')
+        self.getReader(b'bar').finish()
+        self.backend.descriptors.closeAll()
+        self.assertEqual(self.files, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(r.read(3), b'abc')
+        fd = r.fd
+        r.finish()
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def tearDown(self):
+        self.backend.descriptors.closeAll()
+        self.temp_dir.remove()
+
+
 class Writer(unittest.TestCase):
     test_data = b"""line1
 line2
@@ -168,3 +448,255 @@ line3
 
     def tearDown(self):
         self.temp_dir.remove()
+
+
+class AtomicWriting(unittest.TestCase):
+    test_data = b"""line1
+line2
+line3
+"""
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.temp_dir.child(b'foo').setContent(self.test_data)
+        self.target = self.temp_dir.child(b'bar')
+
+    def test_write_existing_file(self):
+        self.assertRaises(FileExists, AtomicWriter, self.temp_dir.child(b'foo'))
+
+    def test_write_to_non_existent_directory(self):
+        new_file = self.temp_dir.descendant((b"new", b"baz"))
+        AtomicWriter(new_file).finish()
+        self.assertTrue(new_file.exists())
+
+    def test_finished_write(self):
+        w = AtomicWriter(self.target)
+        self.assertEqual(w.temp_path.parent(), self.temp_dir)
+        w.write(self.test_data[:6])
+        w.write(self.test_data[6:])
+        self.assertFalse(self.target.exists(),
+                         "The file should not appear before it's complete")
+        inode = os.stat(w.temp_path.path).st_ino
+        w.finish()
+        w.finish()
+        self.assertEqual(self.target.getContent(), self.test_data)
+        # Linked, not copied
+        self.assertEqual(os.stat(self.target.path).st_ino, inode)
+        self.assertEqual(sorted(self.temp_dir.listdir()), [b'bar', b'foo'])
+
+    def test_concurrent_writes(self):
+        first, second = AtomicWriter(self.target), AtomicWriter(self.target)
+        first.write(b'first')
+        second.write(b'second')
+        first.finish()
+        # Discarded, not raised: the upload has been acknowledged already
+        second.finish()
+        self.assertEqual(second.state, 'cancelled')
+        self.assertEqual(self.target.getContent(), b'first')
+        self.assertEqual(sorted(self.temp_dir.listdir()), [b'bar', b'foo'])
+
+    def test_created_meanwhile(self):
+        w = AtomicWriter(self.target)
+        w.write(self.test_data)
+        self.target.setContent(b'other')
+        w.finish()
+        self.assertEqual(self.target.getContent(), b'other')
+        self.assertEqual(w.state, 'cancelled')
+        self.assertEqual(sorted(self.temp_dir.listdir()), [b'bar', b'foo'])
+
+    def test_session(self):
+        transport = FakeTransport(hostAddress=('127.0.0.1', 65466))
+        session = WriteSession(AtomicWriter(self.target), _clock=Clock())
+        session.transport = transport
+        session.startProtocol()
+        self.target.setContent(b'other')
+        session.datagramReceived(DATADatagram(1, b'data'))
+        session.cancel()
+        self.assertEqual(self.target.getContent(), b'other')
+        self.assertEqual(sorted(self.temp_dir.listdir()), [b'bar', b'foo'])
+
+    def test_no_hard_links(self):
+        def link(src, dst):
+            raise PermissionError(errno.EPERM, "Operation not permitted")
+        self.patch(os, 'link', link)
+        w = AtomicWriter(self.target)
+        w.write(self.test_data)
+        w.finish()
+        self.assertEqual(w.state, 'finished')
+        self.assertEqual(self.target.getContent(), self.test_data)
+        self.assertEqual(sorted(self.temp_dir.listdir()), [b'bar', b'foo'])
+        w = AtomicWriter(self.temp_dir.child(b'baz'))
+        w.write(b'baz')
+        self.temp_dir.child(b'baz').setContent(b'other')
+        w.finish()
+        self.assertEqual(w.state, 'cancelled')
+        self.assertEqual(self.temp_dir.child(b'baz').getContent(), b'other')
+        self.assertEqual(sorted(self.temp_dir.listdir()),
+                         [b'bar', b'baz', b'foo'])
+
+    def test_failed(self):
+        def link(src, dst):
+            raise OSError(errno.EIO, "Input/output error")
+        self.patch(os, 'link', link)
+        self.patch(os, 'replace', link)
+        w = AtomicWriter(self.target)
+        w.finish()
+        self.assertEqual(len(self.flushLoggedErrors(OSError)), 1)
+        self.assertEqual(w.state, 'cancelled')
+        self.assertEqual(self.temp_dir.listdir(), [b'foo'])
+
+    def test_sync(self):
+        synced = []
+        self.patch(os, 'fsync', synced.append)
+        AtomicWriter(self.target).finish()
+        self.assertEqual(synced, [])
+        w = AtomicWriter(self.temp_dir.child(b'baz'), sync=True)
+        fileno = w.temp_destination.fileno()
+        w.finish()
+        self.assertEqual(synced, [fileno])
+
+    def test_cancelled_write(self):
+        w = AtomicWriter(self.target)
+        w.write(self.test_data)
+        w.cancel()
+        w.cancel()
+        self.assertFalse(self.target.exists())
+        self.assertEqual(self.temp_dir.listdir(), [b'foo'])
+
+    def test_backend(self):
+        b = FilesystemSynchronousBackend(self.temp_dir, atomic_writes=True)
+        w = self.successResultOf(b.get_writer(b'bar'))
+        self.assertIsInstance(w, AtomicWriter)
+        # It would block the reactor
+        self.assertFalse(w.sync)
+        w.cancel()
+
+
+class Threaded(unittest.TestCase):
+    test_data = b"""line1
+line2
+line3
+"""
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.temp_dir.child(b'foo').setContent(self.test_data)
+        self.backend = FilesystemAsynchronousBackend(self.temp_dir, threads=2)
+        self.addCleanup(self.backend.stop)
+
+    @inlineCallbacks
+    def test_read(self):
+        reader = yield self.backend.get_reader(b'foo')
+        self.assertIsInstance(reader, ThreadedReader)
+        self.assertTrue(IReader.providedBy(reader))
+        self.assertEqual(reader.size, len(self.test_data))
+        self.assertEqual(reader.identity, reader.reader.identity)
+        # The reads are queued and done in order
+        blocks = yield gatherResults([reader.read(6) for i in range(4)])
+        self.assertEqual(blocks, [b'line1\n', b'line2\n', b'line3\n', b''])
+        reader.finish()
+
+    @inlineCallbacks
+    def test_seek(self):
+        reader = yield self.backend.get_reader(b'foo')
+        reader.seek(6)
+        data = yield reader.read(5)
+        self.assertEqual(data, b'line2')
+        reader.finish()
+        data = yield reader.read(5)
+        self.assertEqual(data, b'')
+
+    @inlineCallbacks
+    def test_write(self):
+        writer = yield self.backend.get_writer(b'bar')
+        self.assertIsInstance(writer, ThreadedWriter)
+        self.assertTrue(IWriter.providedBy(writer))
+        yield gatherResults([writer.write(self.test_data[:6]),
+                             writer.write(self.test_data[6:])])
+        writer.finish()
+        yield writer.calls.call(lambda: None)
+        self.assertEqual(self.temp_dir.child(b'bar').getContent(),
+                         self.test_data)
+
+    @inlineCallbacks
+    def test_atomic_write(self):
+        backend = FilesystemAsynchronousBackend(self.temp_dir,
+                                                atomic_writes=True)
+        self.addCleanup(backend.stop)
+        writer = yield backend.get_writer(b'bar')
+        # Synced in the pool, where it doesn't block the reactor
+        self.assertIsInstance(writer.writer, AtomicWriter)
+        self.assertTrue(writer.writer.sync)
+        yield writer.write(self.test_data)
+        writer.finish()
+        yield writer.calls.call(lambda: None)
+        self.assertEqual(self.temp_dir.child(b'bar').getContent(),
+                         self.test_data)
+
+    @inlineCallbacks
+    def test_cancelled_write(self):
+        writer = yield self.backend.get_writer(b'bar')
+        writer.write(self.test_data)
+        writer.cancel()
+        yield writer.calls.call(lambda: None)
+        self.assertFalse(self.temp_dir.child(b'bar').exists())
+
+    @inlineCallbacks
+    def test_errors(self):
+        yield self.assertFailure(self.backend.get_reader(b'nothing'),
+                                 FileNotFound)
+        yield self.assertFailure(self.backend.get_writer(b'foo'), FileExists)
+        yield self.assertFailure(self.backend.get_reader(b'../foo'),
+                                 AccessViolation)
+        backend = FilesystemAsynchronousBackend(self.temp_dir, can_read=False)
+        self.addCleanup(backend.stop)
+        yield self.assertFailure(backend.get_reader(b'foo'), Unsupported)
+
+    @inlineCallbacks
+    def test_fair(self):
+        threadpool = ThreadPool(1, 1)
+        threadpool.start()
+        self.addCleanup(threadpool.stop)
+        first, second = SerialCalls(threadpool), SerialCalls(threadpool)
+        calls = []
+        results = [first.call(calls.append, ('first', i)) for i in range(3)]
+        results += [second.call(calls.append, ('second', i)) for i in range(3)]
+        yield gatherResults(results)
+        self.assertEqual(calls, [('first', 0), ('second', 0), ('first', 1),
+                                 ('second', 1), ('first', 2), ('second', 2)])
+
+    @inlineCallbacks
+    def test_started_lazily(self):
+        self.assertFalse(self.backend.threadpool.started)
+        reader = yield self.backend.get_reader(b'foo')
+        self.assertTrue(self.backend.threadpool.started)
+        reader.finish()
+        self.backend.stop()
+        self.assertFalse(self.backend.threadpool.started)
+        # Not started again after it was stopped
+        self.backend.start()
+        self.assertFalse(self.backend.threadpool.started)
+
+    @inlineCallbacks
+    def test_failed_finish(self):
+        writer = yield self.backend.get_writer(b'bar')
+        def finish():
+            raise IOError("disk full")
+        writer.writer.finish = finish
+        writer.finish()
+        yield writer.calls.call(lambda: None)
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        writer.cancel()
+        yield writer.calls.call(lambda: None)
+
+    @inlineCallbacks
+    def test_failed_call(self):
+        self.backend.start()
+        calls = SerialCalls(self.backend.threadpool)
+        failed = calls.call(int, 'foo')
+        after = calls.call(int, '1')
+        yield self.assertFailure(failed, ValueError)
+        result = yield after
+        self.assertEqual(result, 1)
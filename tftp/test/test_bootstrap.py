@@ -5,7 +5,10 @@ from tftp.bootstrap import (LocalOriginWriteSession, LocalOriginReadSession,
     RemoteOriginReadSession, RemoteOriginWriteSession, TFTPBootstrap)
 from tftp.datagram import (ACKDatagram, TFTPDatagramFactory, split_opcode,
     ERR_TID_UNKNOWN, DATADatagram, OACKDatagram, OP_ACK)
+from tftp.errors import PayloadDecodeError
 from tftp.test.test_sessions import DelayedWriter, FakeTransport, DelayedReader
+from tftp.test.test_udp import MTUSocket, MTUTransport
+from tftp.udp import _MTU_OPTIONS
 from tftp.util import timedCaller
 from twisted.internet.defer import inlineCallbacks
 from twisted.internet.task import Clock
@@ -14,7 +17,8 @@ from twisted.python.filepath import FilePath
 from twisted.python.util import OrderedDict
 from twisted.trial import unittest
 import tempfile
-from tftp.session import MAX_BLOCK_SIZE, WriteSession, ReadSession
+from tftp.session import (MAX_BLOCK_SIZE, MAX_WINDOW_SIZE, WriteSession,
+    ReadSession)
 
 ReadSession.timeout = (2, 2, 2)
 WriteSession.timeout = (2, 2, 2)
@@ -25,6 +29,12 @@ class MockSession(object):
     block_size = 512
     timeout = (1, 3, 5)
     tsize = None
+    window_size = 1
+
+class RolloverACKDatagram(DATADatagram):
+    """A DATA datagram, that is passed off as an ACK"""
+    __slots__ = ()
+    opcode = OP_ACK
 
 # Testing implementation here, but if I don't, I'll have a TON of duplicate code
 class TestOptionProcessing(unittest.TestCase):
@@ -122,6 +132,61 @@ class TestOptionProcessing(unittest.TestCase):
         self.assertTrue(self.s.tsize is None)
         self.assertEqual(opts, OrderedDict({}))
 
+    def test_windowsize(self):
+        self.s = MockSession()
+        opts = self.proto.processOptions(OrderedDict({b'windowsize':b'4'}))
+        self.proto.applyOptions(self.s, opts)
+        self.assertEqual(self.s.window_size, 4)
+        self.assertEqual(opts, OrderedDict({b'windowsize':b'4'}))
+
+        self.s = MockSession()
+        opts = self.proto.processOptions(OrderedDict({b'windowsize':b'65535'}))
+        self.proto.applyOptions(self.s, opts)
+        self.assertEqual(self.s.window_size, MAX_WINDOW_SIZE)
+        self.assertEqual(opts, OrderedDict({b'windowsize':intToBytes(MAX_WINDOW_SIZE)}))
+
+        for invalid in (b'0', b'65536', b'foo'):
+            self.s = MockSession()
+            opts = self.proto.processOptions(OrderedDict({b'windowsize':invalid}))
+            self.proto.applyOptions(self.s, opts)
+            self.assertEqual(self.s.window_size, 1)
+            self.assertEqual(opts, OrderedDict())
+
+    def test_windowsize_server_cap(self):
+        self.proto.max_window_size = 8
+        self.s = MockSession()
+        opts = self.proto.processOptions(OrderedDict({b'windowsize':b'16'}))
+        self.proto.applyOptions(self.s, opts)
+        self.assertEqual(self.s.window_size, 8)
+        self.assertEqual(opts, OrderedDict({b'windowsize':b'8'}))
+
+    def test_blksize_server_cap(self):
+        self.proto.max_block_size = 65464
+        opts = self.proto.processOptions(OrderedDict({b'blksize':b'65464'}))
+        self.assertEqual(opts, OrderedDict({b'blksize':b'65464'}))
+
+        self.proto.max_block_size = 1024
+        self.s = MockSession()
+        opts = self.proto.processOptions(OrderedDict({b'blksize':b'1428'}))
+        self.proto.applyOptions(self.s, opts)
+        self.assertEqual(self.s.block_size, 1024)
+        self.assertEqual(opts, OrderedDict({b'blksize':b'1024'}))
+
+    def test_blksize_path_mtu(self):
+        if not _MTU_OPTIONS:
+            raise unittest.SkipTest("The path MTU is not available on this platform")
+        self.proto.max_block_size = 65464
+        self.proto.path_mtu = True
+        self.proto.transport = MTUTransport(MTUSocket(1500))
+        opts = self.proto.processOptions(OrderedDict({b'blksize':b'8192'}))
+        self.assertEqual(opts, OrderedDict({b'blksize':b'1468'}))
+        opts = self.proto.processOptions(OrderedDict({b'blksize':b'1024'}))
+        self.assertEqual(opts, OrderedDict({b'blksize':b'1024'}))
+
+        self.proto.transport = MTUTransport(MTUSocket(68))
+        opts = self.proto.processOptions(OrderedDict({b'blksize':b'512'}))
+        self.assertEqual(opts, OrderedDict({b'blksize':b'36'}))
+
     def test_multiple_options(self):
         got_options = OrderedDict()
         got_options[b'timeout'] = b'123'
@@ -305,6 +370,17 @@ class BootstrapRemoteOriginWrite(unittest.TestCase):
         self.clock.advance(3)
         return d
 
+    def test_fast_path(self):
+        self.ws.session.block_size = 3
+        self.ws.datagramReceived(DATADatagram(1, b'foo').to_wire(), ('127.0.0.1', 65465))
+        self.clock.advance(3)
+        self.ws._datagramReceived = None
+        self.transport.clear()
+        self.ws.datagramReceived(DATADatagram(2, b'bar').to_wire(), ('127.0.0.1', 65465))
+        self.clock.advance(2.5)
+        self.assertEqual(self.transport.value(), ACKDatagram(2).to_wire())
+        self.addCleanup(self.ws.cancel)
+
     def tearDown(self):
         self.temp_dir.remove()
 
@@ -468,7 +544,9 @@ anotherline"""
 
         self.transport.clear()
         self.rs.datagramReceived(ACKDatagram(1).to_wire(), ('127.0.0.1', 65465))
-        self.clock.pump((1,)*3)
+        # The second block has been read ahead of time, so it is sent as soon
+        # as the read, that started with the first DATA, completes
+        self.clock.advance(1)
         self.assertEqual(self.transport.value(), DATADatagram(2, self.test_data[9:18]).to_wire())
 
         self.addCleanup(self.rs.cancel)
@@ -522,7 +600,8 @@ anotherline"""
         # Normal exchange continues
         self.transport.clear()
         self.rs.datagramReceived(ACKDatagram(1).to_wire(), ('127.0.0.1', 65465))
-        self.clock.pump((1,)*3)
+        # The second block has been read ahead of time
+        self.clock.advance(1)
         data_datagram_2 = DATADatagram(2, self.test_data[5:10])
         self.assertEqual(self.transport.value(), data_datagram_2.to_wire())
         self.assertFalse(self.transport.disconnecting)
@@ -533,9 +612,7 @@ anotherline"""
         # session is already started.
         # Here we test the case where rollover has not happened yet
 
-        data_datagram = DATADatagram(1, self.test_data[:5])
-        data_datagram.opcode = OP_ACK
-        data_datagram.blocknum = 0
+        data_datagram = RolloverACKDatagram(0, self.test_data[:5])
         self.rs.session.block_size = 5
         self.clock.pump((1,)*3)
 
@@ -552,9 +629,7 @@ anotherline"""
         # if a rollover is done, we reach blocknum 0 again. But this time
         # session is already started.
         # Here we test the case where rollover has already happened
-        data_datagram = DATADatagram(1, self.test_data[:5])
-        data_datagram.opcode = OP_ACK
-        data_datagram.blocknum = 0
+        data_datagram = RolloverACKDatagram(0, self.test_data[:5])
         self.rs.session.block_size = 5
         self.rs.startProtocol()
         self.clock.pump((1,)*3)
@@ -564,6 +639,20 @@ anotherline"""
             self.rs.session.datagramReceived(data_datagram))
         self.addCleanup(self.rs.cancel)
 
+    def test_fast_path(self):
+        self.rs.session.block_size = 5
+        self.rs.startProtocol()
+        self.clock.pump((1,)*3)
+        self.rs._datagramReceived = None
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(1).to_wire(), ('127.0.0.1', 65465))
+        self.clock.advance(1)
+        self.assertEqual(self.transport.value(),
+                         DATADatagram(2, self.test_data[5:10]).to_wire())
+        self.assertRaises(PayloadDecodeError, self.rs.datagramReceived,
+                          ACKDatagram(2).to_wire() + b'x', ('127.0.0.1', 65465))
+        self.addCleanup(self.rs.cancel)
+
     def tearDown(self):
         self.temp_dir.remove()
 
@@ -599,11 +688,20 @@ anotherline"""
 
         self.transport.clear()
         self.rs.datagramReceived(ACKDatagram(0).to_wire(), ('127.0.0.1', 65465))
-        self.clock.pump((1,)*3)
+        # The first block was read while we were waiting for the ACK
+        self.clock.advance(0.1)
         self.assertEqual(self.transport.value(), DATADatagram(1, self.test_data[:9]).to_wire())
 
         self.addCleanup(self.rs.cancel)
 
+    def test_first_block_prefetched(self):
+        self.rs.startProtocol()
+        self.assertEqual(self.rs.session.block_size, 9)
+        self.clock.advance(2)
+        self.assertEqual(list(self.rs.session.blocks.blocks),
+                         [self.test_data[:9]])
+        self.addCleanup(self.rs.cancel)
+
     def test_option_timeout(self):
         self.rs.startProtocol()
         self.clock.advance(0.1)
@@ -0,0 +1,161 @@
+'''
+@author: shylent
+'''
+from tftp.backend import FilesystemWriter, IWriter
+from tftp.buffering import BufferedWriterProxy
+from tftp.datagram import ACKDatagram, DATADatagram
+from tftp.session import WriteSession
+from tftp.test.test_sessions import FakeTransport
+from twisted.internet.defer import Deferred, fail
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+import tempfile
+
+
+class RecordingWriter(object):
+
+    def __init__(self, deferred=False):
+        self.deferred = deferred
+        self.writes = []
+        self.pending = []
+        self.state = 'active'
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+        if self.deferred:
+            d = Deferred()
+            self.pending.append((data, d))
+            return d
+
+    def finish(self):
+        self.state = 'finished'
+
+    def cancel(self):
+        self.state = 'cancelled'
+
+
+class Buffering(unittest.TestCase):
+
+    def test_coalesced(self):
+        writer = RecordingWriter()
+        proxy = BufferedWriterProxy(writer, 1024)
+        self.assertTrue(IWriter.providedBy(proxy))
+        for i in range(5):
+            self.assertIdentical(proxy.write(bytes([i]) * 512), None)
+        self.assertEqual(writer.writes, [b'\x00' * 512 + b'\x01' * 512,
+                                         b'\x02' * 512 + b'\x03' * 512])
+        self.assertEqual(proxy.used, 512)
+        proxy.finish()
+        self.assertEqual(writer.writes[2:], [b'\x04' * 512])
+        self.assertEqual(writer.state, 'finished')
+
+    def test_split_blocks(self):
+        writer = RecordingWriter()
+        proxy = BufferedWriterProxy(writer, 10)
+        proxy.write(memoryview(b'abcdefg'))
+        proxy.write(b'hijklmn')
+        proxy.write(b'opqrstuvwxyz0123456789')
+        self.assertEqual(writer.writes, [b'abcdefghij', b'klmnopqrst',
+                                         b'uvwxyz0123'])
+        proxy.finish()
+        self.assertEqual(writer.writes[3:], [b'456789'])
+
+    def test_buffer_reused(self):
+        writer = RecordingWriter(deferred=True)
+        proxy = BufferedWriterProxy(writer, 4)
+        buffer = proxy.buffer
+        proxy.write(b'abcdefgh')
+        self.assertIdentical(proxy.buffer, buffer)
+        # The writer has a copy, that it can keep
+        self.assertEqual([data for data, d in writer.pending],
+                         [b'abcd', b'efgh'])
+        self.assertIsInstance(writer.pending[0][0], bytes)
+
+    def test_deferred_writer(self):
+        writer = RecordingWriter(deferred=True)
+        proxy = BufferedWriterProxy(writer, 4)
+        self.assertIdentical(proxy.write(b'ab'), None)
+        d = proxy.write(b'cdef')
+        self.assertIdentical(d, writer.pending[0][1])
+        self.assertEqual(writer.pending[0][0], b'abcd')
+        proxy.finish()
+        self.assertEqual(writer.writes, [b'abcd', b'ef'])
+        self.assertEqual(writer.state, 'active')
+        writer.pending[1][1].callback(None)
+        self.assertEqual(writer.state, 'finished')
+
+    def test_failed_write(self):
+        writer = RecordingWriter()
+        writer.write = lambda data: fail(IOError("disk full"))
+        proxy = BufferedWriterProxy(writer, 4)
+        self.assertIdentical(proxy.write(b'ab'), None)
+        self.failureResultOf(proxy.write(b'cd'), IOError)
+
+    def test_several_writes(self):
+        writer = RecordingWriter(deferred=True)
+        proxy = BufferedWriterProxy(writer, 4)
+        d = proxy.write(b'abcdefghij')
+        self.assertEqual(writer.writes, [b'abcd', b'efgh'])
+        writer.pending[0][1].callback(None)
+        self.assertNoResult(d)
+        writer.pending[1][1].callback(None)
+        self.assertIdentical(self.successResultOf(d), None)
+
+    def test_several_writes_first_failed(self):
+        writer = RecordingWriter(deferred=True)
+        proxy = BufferedWriterProxy(writer, 4)
+        d = proxy.write(b'abcdefghij')
+        writer.pending[0][1].errback(IOError("disk full"))
+        self.failureResultOf(d, IOError)
+        writer.pending[1][1].callback(None)
+
+    def test_failed_finish(self):
+        writer = RecordingWriter(deferred=True)
+        proxy = BufferedWriterProxy(writer, 4)
+        proxy.write(b'ab')
+        proxy.finish()
+        writer.pending[0][1].errback(IOError("disk full"))
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.assertEqual(writer.state, 'cancelled')
+
+    def test_empty(self):
+        writer = RecordingWriter()
+        BufferedWriterProxy(writer, 4).finish()
+        self.assertEqual(writer.writes, [])
+        self.assertEqual(writer.state, 'finished')
+
+    def test_cancel(self):
+        writer = RecordingWriter()
+        proxy = BufferedWriterProxy(writer, 4)
+        proxy.write(b'abcdef')
+        proxy.cancel()
+        self.assertEqual(writer.writes, [b'abcd'])
+        self.assertEqual(writer.state, 'cancelled')
+        self.assertEqual(proxy.used, 0)
+
+
+class BufferedSession(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.target = self.temp_dir.child(b'foo')
+        self.transport = FakeTransport(hostAddress=('127.0.0.1', 65465))
+        self.ws = WriteSession(
+            BufferedWriterProxy(FilesystemWriter(self.target), 16),
+            _clock=self.clock)
+        self.ws.block_size = 6
+        self.ws.transport = self.transport
+        self.ws.startProtocol()
+
+    def test_upload(self):
+        blocks = [b'foobar', b'bazqux', b'spam!!', b'eggs']
+        for blocknum, block in enumerate(blocks, 1):
+            self.ws.datagramReceived(DATADatagram(blocknum, block))
+            self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), b''.join(
+            ACKDatagram(n).to_wire() for n in range(1, 5)))
+        self.assertEqual(self.target.getContent(), b''.join(blocks))
+        self.ws.cancel()
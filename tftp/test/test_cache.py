@@ -0,0 +1,201 @@
+'''
+@author: shylent
+'''
+from tftp.backend import FilesystemReader, FilesystemSynchronousBackend
+from tftp.cache import BlockCache, CachingBackend, CachedReader
+from tftp.datagram import ACKDatagram, DATADatagram
+from tftp.errors import FileNotFound
+from tftp.netascii import NetasciiSenderProxy
+from tftp.session import ReadSession
+from tftp.test.test_sessions import FakeTransport
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+import os
+import tempfile
+
+
+class Caching(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        for name, size in ((b'small', 10), (b'medium', 40), (b'large', 60)):
+            self.temp_dir.child(name).setContent(os.urandom(size))
+        self.backend = CachingBackend(
+            FilesystemSynchronousBackend(self.temp_dir), 100)
+
+    def read(self, file_name):
+        reader = self.successResultOf(self.backend.get_reader(file_name))
+        data = reader.read(1000)
+        reader.finish()
+        return reader, data
+
+    def test_hit(self):
+        reader, data = self.read(b'medium')
+        self.assertIsInstance(reader, CachedReader)
+        self.assertEqual(data, self.temp_dir.child(b'medium').getContent())
+        reader, data = self.read(b'medium')
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(data, self.temp_dir.child(b'medium').getContent())
+        self.assertEqual(self.backend.stats(), {
+            'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1, 'bytes': 40})
+
+    def test_slices(self):
+        self.read(b'medium')
+        reader = self.successResultOf(self.backend.get_reader(b'medium'))
+        content = self.temp_dir.child(b'medium').getContent()
+        self.assertEqual(reader.size, 40)
+        self.assertEqual(reader.read(16), content[:16])
+        self.assertEqual(reader.read(16), content[16:32])
+        self.assertEqual(reader.read(16), content[32:])
+        self.assertEqual(reader.read(16), b'')
+        reader.finish()
+        self.assertEqual(reader.read(16), b'')
+
+    def test_lru_eviction(self):
+        self.read(b'medium')
+        self.read(b'small')
+        self.read(b'medium')
+        self.read(b'large')
+        self.assertEqual(list(self.backend.entries), [b'medium', b'large'])
+        self.assertEqual(self.backend.used, 100)
+        self.assertEqual(self.backend.evictions, 1)
+
+    def test_too_large(self):
+        self.temp_dir.child(b'huge').setContent(b'x' * 101)
+        reader, data = self.read(b'huge')
+        self.assertIsInstance(reader, FilesystemReader)
+        self.assertEqual(len(data), 101)
+        self.assertEqual(self.backend.used, 0)
+
+    def test_invalidated_on_change(self):
+        self.read(b'small')
+        self.temp_dir.child(b'small').setContent(b'changed')
+        reader, data = self.read(b'small')
+        self.assertEqual(data, b'changed')
+        self.assertEqual(self.backend.misses, 2)
+        self.assertEqual(self.backend.used, 7)
+
+    def test_not_found(self):
+        self.failureResultOf(self.backend.get_reader(b'nothing'), FileNotFound)
+
+    def test_netascii(self):
+        self.temp_dir.child(b'text').setContent(b'one\ntwo\n')
+        self.read(b'text')
+        reader = NetasciiSenderProxy(
+            self.successResultOf(self.backend.get_reader(b'text')))
+        self.assertEqual(self.successResultOf(reader.read(100)),
+                         b'one\r\ntwo\r\n')
+
+    def test_writer_passed_through(self):
+        writer = self.successResultOf(self.backend.get_writer(b'new'))
+        writer.write(b'data')
+        writer.finish()
+        self.assertEqual(self.temp_dir.child(b'new').getContent(), b'data')
+
+    def tearDown(self):
+        self.temp_dir.remove()
+
+
+class BlockCaching(unittest.TestCase):
+    test_data = b"abcdefghijklmnopqrstuvwxyz"
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.target = self.temp_dir.child(b'foo')
+        self.target.setContent(self.test_data)
+        self.cache = BlockCache(1000)
+
+    def session(self, reader):
+        transport = FakeTransport(hostAddress=('127.0.0.1', 65466))
+        session = ReadSession(reader, _clock=self.clock)
+        session.block_size = 5
+        session.window_size = 3
+        session.block_cache = self.cache
+        session.transport = transport
+        session.startProtocol()
+        self.addCleanup(session.cancel)
+        return session, transport
+
+    def blocks(self, *blocknums):
+        return b''.join(
+            DATADatagram(n, self.test_data[(n - 1) * 5:n * 5]).to_wire()
+            for n in blocknums)
+
+    def transfer(self, reader):
+        session, transport = self.session(reader)
+        while not transport.disconnecting:
+            session.datagramReceived(ACKDatagram(session.blocknum))
+            self.clock.advance(0.1)
+        return transport.value()
+
+    def test_shared(self):
+        first = self.transfer(FilesystemReader(self.target))
+        self.assertEqual(first, self.blocks(1, 2, 3, 4, 5, 6))
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 6))
+        second = self.transfer(FilesystemReader(self.target))
+        self.assertEqual(second, first)
+        self.assertEqual(self.cache.stats(), {
+            'hits': 6, 'misses': 6, 'evictions': 0, 'entries': 6,
+            'bytes': len(first)})
+
+    def test_interleaved(self):
+        first, first_transport = self.session(FilesystemReader(self.target))
+        second, second_transport = self.session(FilesystemReader(self.target))
+        first.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        second.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        second.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0.1)
+        first.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0.1)
+        self.assertEqual(second_transport.value(), self.blocks(*range(1, 7)))
+        self.assertEqual(first_transport.value(), self.blocks(*range(1, 7)))
+        self.assertEqual((self.cache.hits, self.cache.misses), (6, 6))
+
+    def test_changed_file(self):
+        self.transfer(FilesystemReader(self.target))
+        self.target.setContent(b'0123456789')
+        os.utime(self.target.path, (0, 0))
+        self.assertEqual(self.transfer(FilesystemReader(self.target)),
+                         DATADatagram(1, b'01234').to_wire() +
+                         DATADatagram(2, b'56789').to_wire() +
+                         DATADatagram(3, b'').to_wire())
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_netascii(self):
+        self.transfer(FilesystemReader(self.target))
+        reader = NetasciiSenderProxy(FilesystemReader(self.target))
+        self.assertIdentical(reader.identity, None)
+        self.transfer(reader)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 6))
+
+    def test_lru_eviction(self):
+        cache = BlockCache(10)
+        cache.put(1, b'abcd')
+        cache.put(2, b'efgh')
+        self.assertEqual(cache.get(1), b'abcd')
+        cache.put(3, b'ijkl')
+        self.assertIdentical(cache.get(2), None)
+        self.assertEqual(list(cache.blocks), [1, 3])
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'misses': 1, 'evictions': 1, 'entries': 2, 'bytes': 8})
+
+    def test_too_large(self):
+        cache = BlockCache(3)
+        cache.put(1, b'abcd')
+        self.assertEqual(cache.used, 0)
+
+    def test_reader_identity(self):
+        reader = FilesystemReader(self.target)
+        other = FilesystemReader(self.target)
+        self.assertEqual(reader.identity, other.identity)
+        reader.seek(20)
+        self.assertEqual(reader.read(10), b'uvwxyz')
+        reader.finish()
+        other.finish()
+
+    def tearDown(self):
+        self.temp_dir.remove()
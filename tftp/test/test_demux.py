@@ -0,0 +1,191 @@
+'''
+@author: shylent
+'''
+from tftp.backend import FilesystemReader, FilesystemSynchronousBackend
+from tftp.bootstrap import RemoteOriginReadSession
+from tftp.datagram import (ACKDatagram, DATADatagram, ERR_TID_UNKNOWN,
+    RRQDatagram, TFTPDatagramFactory, split_opcode)
+from tftp.demux import SessionDemultiplexer
+from tftp.protocol import TFTP
+from twisted.internet import reactor
+from twisted.internet.address import IPv4Address
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+import tempfile
+
+
+class FakePort(object):
+
+    def __init__(self, port, protocol):
+        self.port = port
+        self.protocol = protocol
+        self.written = []
+        self.listening = True
+        protocol.makeConnection(self)
+
+    def write(self, datagram, addr):
+        self.written.append((datagram, addr))
+
+    def getHost(self):
+        return IPv4Address('UDP', '127.0.0.1', self.port)
+
+    def stopListening(self):
+        self.listening = False
+        self.protocol.doStop()
+        return succeed(None)
+
+
+class FakeReactor(object):
+
+    def __init__(self):
+        self.ports = []
+
+    def listenUDP(self, port, protocol, interface='', maxPacketSize=8192):
+        port = FakePort(40000 + len(self.ports), protocol)
+        self.ports.append(port)
+        return port
+
+
+class Demultiplexing(unittest.TestCase):
+    test_data = b'line1\nline2\nanotherline'
+    remote = ('127.0.0.1', 65465)
+
+    def setUp(self):
+        self.clock = Clock()
+        self.reactor = FakeReactor()
+        self.demux = SessionDemultiplexer(2, _reactor=self.reactor)
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.target = self.temp_dir.child(b'foo')
+        with self.target.open('wb') as temp_fd:
+            temp_fd.write(self.test_data)
+
+    def session(self, remote=None):
+        rs = RemoteOriginReadSession(remote or self.remote,
+                                     FilesystemReader(self.target), _clock=self.clock)
+        rs.session.block_size = 5
+        return rs
+
+    def test_sockets_bound_lazily(self):
+        self.assertEqual(self.reactor.ports, [])
+        self.demux.attach(self.remote, self.session())
+        self.assertEqual(len(self.reactor.ports), 2)
+        self.demux.attach(('127.0.0.1', 65464), self.session(('127.0.0.1', 65464)))
+        self.assertEqual(len(self.reactor.ports), 2)
+
+    def test_transfer(self):
+        rs = self.session()
+        transport = self.demux.attach(self.remote, rs)
+        self.assertTrue(rs.transport is transport)
+        self.clock.advance(0)
+        shared = transport.shared
+        self.assertEqual(shared.transport.written,
+                         [(DATADatagram(1, b'line1').to_wire(), self.remote)])
+        del shared.transport.written[:]
+        shared.datagramReceived(ACKDatagram(1).to_wire(), self.remote)
+        self.clock.advance(0)
+        self.assertEqual(shared.transport.written,
+                         [(DATADatagram(2, b'\nline').to_wire(), self.remote)])
+        rs.cancel()
+        self.assertTrue(transport.disconnecting)
+        self.assertEqual(shared.sessions, {})
+        self.assertTrue(self.reactor.ports[0].listening)
+
+    def test_write_buffers(self):
+        transport = self.demux.attach(self.remote, self.session())
+        self.clock.advance(0)
+        shared = transport.shared
+        del shared.transport.written[:]
+        transport.writeBuffers([b'\x00\x03\x00\x02', memoryview(b'data')])
+        self.assertEqual(shared.transport.written,
+                         [(DATADatagram(2, b'data').to_wire(), self.remote)])
+
+    def test_write_batch(self):
+        transport = self.demux.attach(self.remote, self.session())
+        self.clock.advance(0)
+        shared = transport.shared
+        del shared.transport.written[:]
+        transport.writeBatch([b'one', (b'tw', memoryview(b'o'))])
+        self.assertEqual(shared.transport.written,
+                         [(b'one', self.remote), (b'two', self.remote)])
+
+    def test_unknown_tid(self):
+        self.demux.attach(self.remote, self.session())
+        shared = self.reactor.ports[0].protocol
+        self.clock.advance(0)
+        del shared.transport.written[:]
+        shared.datagramReceived(ACKDatagram(1).to_wire(), ('127.0.0.1', 1111))
+        [(datagram, addr)] = shared.transport.written
+        self.assertEqual(addr, ('127.0.0.1', 1111))
+        self.assertEqual(TFTPDatagramFactory(*split_opcode(datagram)).errorcode,
+                         ERR_TID_UNKNOWN)
+        self.assertEqual(list(shared.sessions), [self.remote])
+
+    def test_same_peer_gets_distinct_tids(self):
+        first = self.demux.attach(self.remote, self.session())
+        second = self.demux.attach(self.remote, self.session())
+        self.assertNotEqual(first.getHost().port, second.getHost().port)
+        self.assertEqual(self.demux.attach(self.remote, self.session()), None)
+
+    def test_sessions_spread_across_sockets(self):
+        for port in range(1000, 1004):
+            self.demux.attach(('127.0.0.1', port), self.session(('127.0.0.1', port)))
+        self.assertEqual([len(p.protocol.sessions) for p in self.reactor.ports],
+                         [2, 2])
+
+    def test_stop(self):
+        rs = self.session()
+        transport = self.demux.attach(self.remote, rs)
+        self.demux.stop()
+        self.assertEqual(self.demux.ports, [])
+        self.assertFalse(self.reactor.ports[0].listening)
+        self.assertTrue(transport.disconnecting)
+
+    def tearDown(self):
+        self.temp_dir.remove()
+
+
+class Client(DatagramProtocol):
+
+    def __init__(self):
+        self.received = Deferred()
+
+    def datagramReceived(self, datagram, addr):
+        received, self.received = self.received, Deferred()
+        received.callback((TFTPDatagramFactory(*split_opcode(datagram)), addr))
+
+
+class SharedSocketsDispatch(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        with self.temp_dir.child(b'nonempty').open('w') as fd:
+            fd.write(b'Something uninteresting')
+        self.tftp = TFTP(FilesystemSynchronousBackend(self.temp_dir),
+                         shared_sockets=1)
+        self.server = reactor.listenUDP(0, self.tftp, interface='127.0.0.1')
+        self.client = Client()
+        self.client_port = reactor.listenUDP(0, self.client, interface='127.0.0.1')
+
+    @inlineCallbacks
+    def test_RRQ(self):
+        server = ('127.0.0.1', self.server.getHost().port)
+        self.client.transport.write(
+            RRQDatagram(b'nonempty', b'octet', {}).to_wire(), server)
+        datagram, addr = yield self.client.received
+        self.assertEqual(datagram.data, b'Something uninteresting')
+        self.assertEqual(addr[1], self.tftp.demux.ports[0].getHost().port)
+        self.client.transport.write(ACKDatagram(1).to_wire(), addr)
+        shared = self.tftp.demux.ports[0].protocol
+        while shared.sessions:
+            d = Deferred()
+            reactor.callLater(0.01, d.callback, None)
+            yield d
+        self.assertEqual(len(self.tftp.demux.ports), 1)
+
+    def tearDown(self):
+        self.temp_dir.remove()
+        self.client_port.stopListening()
+        return self.server.stopListening()
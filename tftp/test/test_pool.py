@@ -0,0 +1,126 @@
+'''
+@author: shylent
+'''
+from tftp.backend import FilesystemReader
+from tftp.bootstrap import RemoteOriginReadSession
+from tftp.datagram import ACKDatagram, DATADatagram
+from tftp.pool import PortPool
+from tftp.protocol import TFTP
+from tftp.test.test_demux import FakeReactor
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+import tempfile
+
+
+class FakeClockReactor(FakeReactor, Clock):
+
+    def __init__(self):
+        FakeReactor.__init__(self)
+        Clock.__init__(self)
+
+
+class Pool(unittest.TestCase):
+    test_data = b'line1\nline2\nanotherline'
+    remote = ('127.0.0.1', 65465)
+
+    def setUp(self):
+        self.clock = Clock()
+        self.reactor = FakeClockReactor()
+        self.pool = PortPool(2, _reactor=self.reactor)
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.target = self.temp_dir.child(b'foo')
+        with self.target.open('wb') as temp_fd:
+            temp_fd.write(self.test_data)
+
+    def session(self):
+        rs = RemoteOriginReadSession(self.remote, FilesystemReader(self.target),
+                                     _clock=self.clock)
+        rs.session.block_size = 5
+        return rs
+
+    def test_start(self):
+        self.pool.start()
+        self.assertEqual(len(self.pool.idle), 2)
+        self.assertEqual(len(self.reactor.ports), 2)
+
+    def test_hit(self):
+        self.pool.start()
+        rs = self.session()
+        transport = self.pool.attach(self.remote, rs)
+        self.assertEqual((self.pool.hits, self.pool.misses), (1, 0))
+        self.assertEqual(len(self.pool.idle), 1)
+        self.reactor.advance(0)
+        # Refilled in the background
+        self.assertEqual(len(self.pool.idle), 2)
+        self.assertEqual(len(self.reactor.ports), 3)
+        self.clock.advance(0)
+        self.assertEqual(transport.shared.transport.written,
+                         [(DATADatagram(1, b'line1').to_wire(), self.remote)])
+
+    def test_miss(self):
+        rs = self.session()
+        self.pool.attach(self.remote, rs)
+        self.assertEqual((self.pool.hits, self.pool.misses), (0, 1))
+        self.assertEqual(len(self.reactor.ports), 1)
+        self.reactor.advance(0)
+        self.assertEqual(len(self.pool.idle), 2)
+
+    def test_returned_to_pool(self):
+        self.pool.start()
+        rs = self.session()
+        shared = self.pool.attach(self.remote, rs).shared
+        for blocknum in range(1, 6):
+            self.clock.advance(0)
+            shared.datagramReceived(ACKDatagram(blocknum).to_wire(), self.remote)
+        self.assertEqual(shared.sessions, {})
+        self.assertEqual(len(self.pool.idle), 2)
+        self.assertTrue(self.pool.idle[-1] is shared)
+        self.assertTrue(shared.transport.listening)
+
+    def test_closed_when_full(self):
+        self.pool.start()
+        rs = self.session()
+        port = self.pool.attach(self.remote, rs).shared.transport
+        self.reactor.advance(0)
+        self.clock.advance(0)
+        rs.cancel()
+        self.assertEqual(len(self.pool.idle), 2)
+        self.assertFalse(port in [p.transport for p in self.pool.idle])
+        self.assertFalse(port.listening)
+
+    def test_reuse(self):
+        self.pool.start()
+        rs = self.session()
+        transport = self.pool.attach(self.remote, rs)
+        self.pool.idle.pop()
+        rs.cancel()
+        self.assertTrue(self.pool.idle[-1] is transport.shared)
+        second = self.session()
+        self.assertTrue(self.pool.attach(self.remote, second).shared is
+                        transport.shared)
+        self.assertEqual((self.pool.hits, self.pool.misses), (2, 0))
+        self.addCleanup(second.cancel)
+
+    def test_stop(self):
+        self.pool.start()
+        rs = self.session()
+        transport = self.pool.attach(self.remote, rs)
+        self.pool.stop()
+        self.assertEqual(self.pool.idle, [])
+        self.assertFalse(self.reactor.ports[0].listening)
+        # Not refilled after stopping
+        self.reactor.advance(0)
+        self.assertEqual(len(self.reactor.ports), 2)
+        rs.cancel()
+        self.assertFalse(self.reactor.ports[1].listening)
+        self.assertTrue(transport.disconnecting)
+
+    def test_protocol(self):
+        self.assertEqual(TFTP(None).pool, None)
+        pool = TFTP(None, port_pool=8).pool
+        self.assertIsInstance(pool, PortPool)
+        self.assertEqual(pool.size, 8)
+
+    def tearDown(self):
+        self.temp_dir.remove()
@@ -3,6 +3,7 @@
 '''
 from tftp.backend import FilesystemSynchronousBackend, IReader, IWriter
 from tftp.bootstrap import RemoteOriginWriteSession, RemoteOriginReadSession
+from tftp.buffering import BufferedWriterProxy
 from tftp.datagram import (WRQDatagram, TFTPDatagramFactory, split_opcode,
     ERR_ILLEGAL_OP, RRQDatagram, ERR_ACCESS_VIOLATION, ERR_FILE_EXISTS,
     ERR_FILE_NOT_FOUND, ERR_NOT_DEFINED, ACKDatagram)
@@ -259,6 +260,18 @@ class SuccessfulAsyncDispatch(unittest.TestCase):
         self.assertTrue(d.called)
         self.assertTrue(IWriter.providedBy(d.result.backend))
 
+    def test_write_buffer(self):
+        self.tftp.write_buffer = 4096
+        wrq_datagram = WRQDatagram(b'foobar', b'netascii', {})
+        d = self.tftp._startSession(wrq_datagram, ('127.0.0.1', 1069),
+                                    b'netascii')
+        self.clock.advance(1)
+        session = self.successResultOf(d)
+        self.addCleanup(session.cancel)
+        self.assertIsInstance(session.backend, NetasciiReceiverProxy)
+        self.assertIsInstance(session.backend.writer, BufferedWriterProxy)
+        self.assertEqual(session.backend.writer.size, 4096)
+
 
 class CapturedContext(Exception):
     """A donkey, to carry the call context back up the stack."""
@@ -0,0 +1,55 @@
+'''
+@author: shylent
+'''
+from tftp.rtt import RTTEstimator
+from twisted.trial import unittest
+
+
+class Estimator(unittest.TestCase):
+
+    def setUp(self):
+        self.rtt = RTTEstimator(jitter=0)
+
+    def test_initial_rto(self):
+        self.assertEqual(self.rtt.rto, 1.0)
+        self.assertTrue(self.rtt.srtt is None)
+
+    def test_first_sample(self):
+        self.rtt.sample(0.1)
+        self.assertEqual(self.rtt.srtt, 0.1)
+        self.assertEqual(self.rtt.rttvar, 0.05)
+        self.assertAlmostEqual(self.rtt.rto, 0.3)
+
+    def test_subsequent_samples(self):
+        self.rtt.sample(0.1)
+        self.rtt.sample(0.3)
+        self.assertAlmostEqual(self.rtt.srtt, 0.125)
+        self.assertAlmostEqual(self.rtt.rttvar, 0.0875)
+        self.assertAlmostEqual(self.rtt.rto, 0.475)
+
+    def test_min_rto(self):
+        self.rtt.sample(0.001)
+        self.assertEqual(self.rtt.rto, self.rtt.min_rto)
+
+    def test_backoff(self):
+        self.rtt.sample(0.1)
+        self.rtt.backoff()
+        self.assertAlmostEqual(self.rtt.rto, 0.6)
+        # A new sample undoes the backoff
+        self.rtt.sample(0.1)
+        self.assertTrue(self.rtt.rto < 0.6)
+
+    def test_backoff_is_capped(self):
+        for i in range(20):
+            self.rtt.backoff()
+        self.assertEqual(self.rtt.rto, self.rtt.max_rto)
+
+    def test_timings(self):
+        self.rtt.max_retries = 3
+        self.assertEqual(list(self.rtt.timings(5)), [1, 2, 4, 5])
+
+    def test_timings_jitter(self):
+        rtt = RTTEstimator(jitter=0.5, _random=lambda: 1.0)
+        self.assertEqual(list(rtt.timings(100))[:2], [1.5, 3.0])
+        rtt = RTTEstimator(jitter=0.5, _random=lambda: 0.0)
+        self.assertEqual(list(rtt.timings(100))[:2], [0.5, 1.0])
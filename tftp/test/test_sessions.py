@@ -2,12 +2,15 @@
 @author: shylent
 '''
 from tftp.backend import FilesystemWriter, FilesystemReader, IReader, IWriter
+from tftp.cache import CachedReader
 from tftp.datagram import (ACKDatagram, ERRORDatagram,
     ERR_NOT_DEFINED, DATADatagram, TFTPDatagramFactory, split_opcode)
-from tftp.session import WriteSession, ReadSession
+from tftp.netascii import NetasciiSenderProxy
+from tftp.session import WriteSession, ReadSession, ReadAhead
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred, inlineCallbacks
 from twisted.internet.task import Clock
+from twisted.python import log
 from twisted.python.filepath import FilePath
 from twisted.test.proto_helpers import StringTransport
 from twisted.trial import unittest
@@ -79,10 +82,39 @@ class FailingWriter(object):
 class FakeTransport(StringTransport):
     stopListening = StringTransport.loseConnection
 
+    def write(self, data):
+        # Like the UDP ports, take any bytes-like object
+        StringTransport.write(self, bytes(data))
+
     def connect(self, host, port):
         self._connectedAddr = (host, port)
 
 
+class ScatterTransport(FakeTransport):
+
+    def __init__(self, *args, **kwargs):
+        FakeTransport.__init__(self, *args, **kwargs)
+        self.gathered = []
+
+    def writeBuffers(self, buffers):
+        self.gathered.append(buffers)
+        self.write(b''.join(buffers))
+
+
+class BatchTransport(FakeTransport):
+
+    def __init__(self, *args, **kwargs):
+        FakeTransport.__init__(self, *args, **kwargs)
+        self.batches = []
+
+    def writeBatch(self, datagrams):
+        self.batches.append(len(datagrams))
+        for datagram in datagrams:
+            if type(datagram) is tuple:
+                datagram = b''.join(datagram)
+            self.write(datagram)
+
+
 class WriteSessions(unittest.TestCase):
 
     port = 65466
@@ -233,6 +265,51 @@ class WriteSessions(unittest.TestCase):
         self.assertTrue(isinstance(err_datagram, ERRORDatagram))
         self.assertTrue(self.transport.disconnecting)
 
+    def test_synchronous_writer(self):
+        self.writer.cancel()
+        self.ws.writer = FilesystemWriter(self.temp_dir.child(b'bar'))
+        self.ws.block_size = 6
+        self.assertIdentical(
+            self.ws.datagramReceived(DATADatagram(1, b'foobar')), None)
+        self.assertEqual(self.ws.blocknum, 1)
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), ACKDatagram(1).to_wire())
+        self.ws.cancel()
+
+    def test_writer_gets_bytes(self):
+        self.writer.cancel()
+        written = []
+        self.ws.writer = FilesystemWriter(self.temp_dir.child(b'bar'))
+        self.ws.writer.write = written.append
+        self.ws.datagramReceived(
+            DATADatagram.from_wire(b'\x00\x01foobar'))
+        self.assertEqual(written, [b'foobar'])
+        self.assertIsInstance(written[0], bytes)
+        self.ws.cancel()
+
+    def test_adaptive_timeout(self):
+        self.ws.writer = FilesystemWriter(self.temp_dir.child(b'bar'))
+        self.writer.cancel()
+        self.ws.adaptive_timeout = True
+        self.ws.rtt.jitter = 0
+        self.ws.block_size = 6
+        self.ws.datagramReceived(DATADatagram(1, b'foobar'))
+        self.clock.advance(0)
+        self.clock.advance(0.1)
+        self.ws.datagramReceived(DATADatagram(2, b'foobar'))
+        self.assertAlmostEqual(self.ws.rtt.srtt, 0.1)
+        self.assertAlmostEqual(self.ws.rtt.rto, 0.3)
+        self.transport.clear()
+        self.clock.advance(0)
+        self.clock.advance(0.3)
+        # Retransmitted after the adaptive timeout instead of 4 seconds
+        self.assertEqual(self.transport.value(), ACKDatagram(2).to_wire() * 2)
+        # Karn's rule: the next DATA follows a retransmitted ACK, no sample
+        self.ws.datagramReceived(DATADatagram(3, b'foobar'))
+        self.assertAlmostEqual(self.ws.rtt.srtt, 0.1)
+        self.assertAlmostEqual(self.ws.rtt.rto, 0.6)
+        self.addCleanup(self.ws.cancel)
+
     def test_time_out(self):
         data_datagram = DATADatagram(1, b'foobar')
         d = self.ws.datagramReceived(data_datagram)
@@ -247,6 +324,98 @@ class WriteSessions(unittest.TestCase):
         self.temp_dir.remove()
 
 
+class WindowedWriteSessions(unittest.TestCase):
+
+    port = 65466
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.target = self.temp_dir.child(b'foo')
+        self.writer = FilesystemWriter(self.target)
+        self.transport = FakeTransport(hostAddress=('127.0.0.1', self.port))
+        self.ws = WriteSession(self.writer, _clock=self.clock)
+        self.ws.block_size = 3
+        self.ws.window_size = 2
+        self.ws.timeout = (4, 4, 4)
+        self.ws.transport = self.transport
+        self.ws.startProtocol()
+        self.addCleanup(self.ws.cancel)
+
+    def test_ACK_after_full_window(self):
+        self.ws.datagramReceived(DATADatagram(1, b'foo'))
+        self.clock.advance(0.1)
+        self.assertFalse(self.transport.value(),
+                         "The window is not complete yet, no ACK expected")
+        self.ws.datagramReceived(DATADatagram(2, b'bar'))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), ACKDatagram(2).to_wire())
+
+    def test_ACK_last_block_in_partial_window(self):
+        self.ws.datagramReceived(DATADatagram(1, b'foo'))
+        self.ws.datagramReceived(DATADatagram(2, b'bar'))
+        self.clock.advance(0.1)
+        self.transport.clear()
+        self.ws.datagramReceived(DATADatagram(3, b'b'))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), ACKDatagram(3).to_wire())
+        self.assertTrue(self.ws.completed)
+        self.assertEqual(self.target.getContent(), b'foobarb')
+
+    def test_ACK_on_window_timeout(self):
+        self.ws.datagramReceived(DATADatagram(1, b'foo'))
+        self.clock.advance(3.9)
+        self.assertFalse(self.transport.value())
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), ACKDatagram(1).to_wire())
+
+    def test_gap_in_window(self):
+        self.ws.datagramReceived(DATADatagram(1, b'foo'))
+        self.ws.datagramReceived(DATADatagram(3, b'baz'))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), ACKDatagram(1).to_wire())
+        self.transport.clear()
+        # The gap has been reported already
+        self.ws.datagramReceived(DATADatagram(3, b'baz'))
+        self.clock.advance(0.1)
+        self.assertFalse(self.transport.value())
+        self.assertEqual(self.ws.blocknum, 1)
+        self.ws.datagramReceived(DATADatagram(2, b'bar'))
+        self.ws.datagramReceived(DATADatagram(3, b'baz'))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), ACKDatagram(3).to_wire())
+
+    def test_retransmitted_window(self):
+        self.ws.datagramReceived(DATADatagram(1, b'foo'))
+        self.ws.datagramReceived(DATADatagram(2, b'bar'))
+        self.clock.advance(0.1)
+        self.transport.clear()
+        self.ws.datagramReceived(DATADatagram(1, b'foo'))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), ACKDatagram(2).to_wire())
+        self.transport.clear()
+        # The rest of the copies of the window are not acknowledged again
+        self.ws.datagramReceived(DATADatagram(2, b'bar'))
+        self.clock.advance(0.1)
+        self.assertFalse(self.transport.value())
+
+    def test_block_beyond_window(self):
+        self.ws.datagramReceived(DATADatagram(4, b'foo'))
+        err_dgram = TFTPDatagramFactory(*split_opcode(self.transport.value()))
+        self.assertTrue(isinstance(err_dgram, ERRORDatagram))
+
+    def test_rollover(self):
+        self.ws.blocknum = 65535
+        self.ws.datagramReceived(DATADatagram(0, b'foo'))
+        self.ws.datagramReceived(DATADatagram(1, b'bar'))
+        self.clock.advance(0.1)
+        self.assertEqual(self.ws.blocknum, 1)
+        self.assertEqual(self.transport.value(), ACKDatagram(1).to_wire())
+
+    def tearDown(self):
+        self.temp_dir.remove()
+
+
 class ReadSessions(unittest.TestCase):
     test_data = b"""line1
 line2
@@ -377,5 +546,427 @@ anotherline"""
         self.assertEqual(self.rs.blocknum, 0)
         self.addCleanup(self.rs.cancel)
 
+    def test_adaptive_timeout(self):
+        self.reader.finish()
+        self.rs.reader = FilesystemReader(self.target)
+        self.rs.adaptive_timeout = True
+        self.rs.rtt.jitter = 0
+        self.rs.rtt.max_retries = 4
+        self.rs.block_size = 5
+        self.rs.blocknum = 1
+        self.rs.datagramReceived(ACKDatagram(1))
+        self.clock.advance(0)
+        self.clock.advance(0.05)
+        self.rs.datagramReceived(ACKDatagram(2))
+        self.assertAlmostEqual(self.rs.rtt.srtt, 0.05)
+        self.assertAlmostEqual(self.rs.rtt.rto, 0.2)
+        self.transport.clear()
+        self.clock.advance(0)
+        self.clock.pump((0.2, 0.4))
+        self.assertEqual(self.transport.value(),
+                         DATADatagram(3, self.test_data[5:10]).to_wire() * 3)
+        self.clock.pump((0.8, 1.6))
+        self.assertEqual(self.transport.value(),
+                         DATADatagram(3, self.test_data[5:10]).to_wire() * 5)
+        # The timeout (2 seconds here) is the upper bound of the last wait
+        self.clock.advance(1.9)
+        self.assertFalse(self.transport.disconnecting)
+        self.clock.advance(0.2)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_adaptive_timeout_logged(self):
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+        self.rs.adaptive_timeout = True
+        self.rs.rtt.rto = 0.4
+        self.rs.timedOut()
+        self.assertIn("Session timed out, retransmission timeout was 0.4 seconds",
+                      [' '.join(m['message']) for m in messages])
+
+    def test_read_ahead(self):
+        self.rs.block_size = 5
+        self.rs.read_ahead = 2
+        self.rs.blocknum = 1
+        self.rs.datagramReceived(ACKDatagram(1))
+        self.clock.advance(2)
+        self.assertEqual(self.transport.value(),
+                         DATADatagram(2, self.test_data[:5]).to_wire())
+        # The next block is being read while we wait for the ACK
+        self.assertTrue(self.rs.blocks.reading)
+        self.clock.advance(1)
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(2))
+        self.clock.advance(1)
+        self.assertEqual(self.transport.value(),
+                         DATADatagram(3, self.test_data[5:10]).to_wire())
+        self.addCleanup(self.rs.cancel)
+
     def tearDown(self):
         self.temp_dir.remove()
+
+
+class WindowedReadSessions(unittest.TestCase):
+    test_data = b"abcdefghijklmnopqrstuvwxyz"
+    port = 65466
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.target = self.temp_dir.child(b'foo')
+        self.target.setContent(self.test_data)
+        self.reader = FilesystemReader(self.target)
+        self.transport = FakeTransport(hostAddress=('127.0.0.1', self.port))
+        self.rs = ReadSession(self.reader, _clock=self.clock)
+        self.rs.block_size = 5
+        self.rs.window_size = 3
+        self.rs.transport = self.transport
+        self.rs.startProtocol()
+        self.addCleanup(self.rs.cancel)
+
+    def blocks(self, *blocknums):
+        return b''.join(
+            DATADatagram(n, self.test_data[(n - 1) * 5:n * 5]).to_wire()
+            for n in blocknums)
+
+    def test_window_sent(self):
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), self.blocks(1, 2, 3))
+
+    def test_window_retransmitted(self):
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.pump((1,)*3)
+        self.assertEqual(self.transport.value(), self.blocks(1, 2, 3) * 2)
+
+    def test_next_window(self):
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), self.blocks(4, 5, 6))
+
+    def test_partial_ACK(self):
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(1))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), self.blocks(2, 3, 4))
+
+    def test_gap_ACK(self):
+        # The first block of the window was lost, the remote end acknowledges
+        # the block before it
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0.1)
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(3))
+        # Sent right away, not after the timeout
+        self.clock.advance(0)
+        self.assertEqual(self.transport.value(), self.blocks(4, 5, 6))
+        self.assertEqual(len(self.rs.window), 3)
+
+    def test_gap_ACK_after_retransmission(self):
+        # The copies of the previous window may have been acknowledged again
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.pump((1,)*3)
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0.1)
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0)
+        self.assertFalse(self.transport.value())
+        self.clock.advance(2)
+        self.assertEqual(self.transport.value(), self.blocks(4, 5, 6))
+
+    def test_gap_ACK_not_sampled(self):
+        # The ACKs of a window, that was resent after a gap ACK, don't update
+        # the round trip time estimate
+        self.rs.adaptive_timeout = True
+        self.rs.rtt.jitter = 0
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0)
+        self.clock.advance(0.1)
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.assertAlmostEqual(self.rs.rtt.srtt, 0.1)
+        self.clock.advance(0)
+        self.clock.advance(0.1)
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0)
+        self.clock.advance(0.01)
+        self.rs.datagramReceived(ACKDatagram(6))
+        self.assertAlmostEqual(self.rs.rtt.srtt, 0.1)
+
+    def test_lost_first_block(self):
+        # The gap ACK, that a WriteSession sends, gets the window resent
+        # without waiting for the timeout
+        target = self.temp_dir.child(b'bar')
+        transport = FakeTransport(hostAddress=('127.0.0.1', self.port))
+        ws = WriteSession(FilesystemWriter(target), _clock=self.clock)
+        ws.block_size = 5
+        ws.window_size = 3
+        ws.transport = transport
+        ws.startProtocol()
+        self.addCleanup(ws.cancel)
+        def deliver(wire, drop=()):
+            for n in range(0, len(wire), 9):
+                datagram = DATADatagram.from_wire(bytes(wire[n + 2:n + 9]))
+                if datagram.blocknum not in drop:
+                    ws.datagramReceived(datagram)
+            self.clock.advance(0)
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        deliver(self.transport.value())
+        self.clock.advance(0.1)
+        self.assertEqual(transport.value(), ACKDatagram(3).to_wire())
+        self.transport.clear()
+        transport.clear()
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0.1)
+        deliver(self.transport.value(), drop=(4,))
+        self.assertEqual(transport.value(), ACKDatagram(3).to_wire())
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(3))
+        self.clock.advance(0)
+        self.assertEqual(self.transport.value(), self.blocks(4, 5, 6))
+
+    def test_duplicate_ACK(self):
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0)
+        self.transport.clear()
+        # The window is only resent once in response to a gap ACK
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.assertFalse(self.transport.value())
+        self.assertEqual(len(self.rs.window), 3)
+
+    def test_final_ACK(self):
+        self.rs.window_size = 10
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.assertTrue(self.rs.completed)
+        self.assertEqual(len(self.rs.window), 6)
+        self.rs.datagramReceived(ACKDatagram(4))
+        self.clock.advance(0.1)
+        self.assertFalse(self.transport.disconnecting)
+        self.rs.datagramReceived(ACKDatagram(6))
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_rollover_across_window(self):
+        self.rs.blocknum = 65534
+        self.rs.datagramReceived(ACKDatagram(65534))
+        self.clock.advance(0.1)
+        sent = self.transport.value()
+        self.assertEqual(sent, b''.join((
+            DATADatagram(65535, self.test_data[:5]).to_wire(),
+            DATADatagram(0, self.test_data[5:10]).to_wire(),
+            DATADatagram(1, self.test_data[10:15]).to_wire())))
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), b''.join((
+            DATADatagram(1, self.test_data[10:15]).to_wire(),
+            DATADatagram(2, self.test_data[15:20]).to_wire(),
+            DATADatagram(3, self.test_data[20:25]).to_wire())))
+
+    def test_synchronous_reader(self):
+        # Blocks, that the reader returns right away, are added without
+        # waiting for a Deferred
+        self.assertIdentical(self.rs.datagramReceived(ACKDatagram(0)), None)
+        self.assertEqual(len(self.rs.window), 3)
+        self.assertFalse(self.rs.filling)
+
+    def test_send_buffers_reused(self):
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.assertIsInstance(self.rs.window[0], memoryview)
+        first = self.rs.window[0].obj
+        self.transport.clear()
+        self.rs.datagramReceived(ACKDatagram(1))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), self.blocks(2, 3, 4))
+        self.assertIdentical(self.rs.window[-1].obj, first)
+        self.assertEqual(self.rs.buffers, [])
+
+    def test_netascii_reader(self):
+        self.rs.reader = NetasciiSenderProxy(self.reader)
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.assertEqual(self.transport.value(), self.blocks(1, 2, 3))
+        self.assertIsInstance(self.rs.window[0], bytes)
+
+    def test_scatter_gather(self):
+        # Zero-copy blocks are handed to the transport along with their
+        # headers, they are not joined
+        self.reader.finish()
+        self.rs.reader = CachedReader(self.test_data)
+        self.rs.transport = transport = ScatterTransport(
+            hostAddress=('127.0.0.1', self.port))
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.advance(0.1)
+        self.assertEqual(transport.value(), self.blocks(1, 2, 3))
+        self.assertEqual(len(transport.gathered), 3)
+        header, payload = transport.gathered[0]
+        self.assertEqual(header, b'\x00\x03\x00\x01')
+        self.assertIdentical(payload.obj, self.test_data)
+
+    def test_scatter_gather_fallback(self):
+        self.reader.finish()
+        self.rs.reader = CachedReader(self.test_data)
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.pump((1,)*3)
+        self.assertIsInstance(self.rs.window[0], tuple)
+        self.assertEqual(self.transport.value(), self.blocks(1, 2, 3) * 2)
+
+    def test_batched_window(self):
+        self.rs.transport = transport = BatchTransport(
+            hostAddress=('127.0.0.1', self.port))
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.clock.pump((1,)*3)
+        self.assertEqual(transport.value(), self.blocks(1, 2, 3) * 2)
+        self.assertEqual(transport.batches, [3, 3])
+
+    def test_large_window(self):
+        self.reader.finish()
+        self.target.setContent(b'x' * 5 * 5000)
+        self.rs.reader = FilesystemReader(self.target)
+        self.rs.window_size = 5000
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.assertEqual(len(self.rs.window), 5000)
+
+    def test_synchronous_failure(self):
+        self.reader.finish()
+        self.rs.reader = FailingReader()
+        self.rs.datagramReceived(ACKDatagram(0))
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.assertTrue(self.transport.disconnecting)
+
+    def tearDown(self):
+        self.temp_dir.remove()
+
+
+class ReadAheadBuffer(unittest.TestCase):
+    test_data = b"abcdefghijklm"
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.target = self.temp_dir.child(b'foo')
+        self.target.setContent(self.test_data)
+
+    def test_depth_is_bounded(self):
+        reader = FilesystemReader(self.target)
+        blocks = ReadAhead(reader, 3, 2)
+        self.assertEqual(list(blocks.blocks), [b'abc', b'def'])
+        self.assertEqual(self.successResultOf(blocks.next()), b'abc')
+        self.assertEqual(list(blocks.blocks), [b'def', b'ghi'])
+        reader.finish()
+
+    def test_reads_are_sequential(self):
+        reader = DelayedReader(self.target, _clock=self.clock, delay=1)
+        blocks = ReadAhead(reader, 5, 3)
+        self.assertTrue(blocks.reading)
+        d1, d2 = blocks.next(), blocks.next()
+        self.clock.advance(1)
+        self.assertEqual(self.successResultOf(d1), b'abcde')
+        self.assertNoResult(d2)
+        self.clock.advance(1)
+        self.assertEqual(self.successResultOf(d2), b'fghij')
+        self.clock.advance(1)
+        self.assertTrue(blocks.exhausted)
+        self.assertEqual(list(blocks.blocks), [b'klm'])
+        reader.finish()
+
+    def test_failure_is_delivered_in_order(self):
+        blocks = ReadAhead(FailingReader(), 5, 2)
+        self.assertTrue(blocks.exhausted)
+        self.failureResultOf(blocks.next(), IOError)
+
+    def tearDown(self):
+        self.temp_dir.remove()
+
+
+class Link(FakeTransport):
+    """Delivers the datagrams to C{peer} one every C{interval} seconds and
+    C{delay} seconds after they were sent, unless C{drop} says otherwise, and
+    counts them
+
+    """
+
+    def __init__(self, clock, delay=0.01, interval=0.001,
+                 drop=lambda wire, count: False):
+        FakeTransport.__init__(self)
+        self.clock = clock
+        self.delay = delay
+        self.interval = interval
+        self.drop = drop
+        self.peer = None
+        self.sent = 0
+        self.free_at = 0
+
+    def write(self, data):
+        wire = bytes(data)
+        self.sent += 1
+        self.free_at = max(self.clock.seconds(), self.free_at) + self.interval
+        if not self.drop(wire, self.sent):
+            self.clock.callLater(self.free_at - self.clock.seconds() +
+                                 self.delay, self.deliver, wire)
+
+    def deliver(self, wire):
+        if not self.peer.transport.disconnecting:
+            self.peer.datagramReceived(
+                TFTPDatagramFactory(*split_opcode(wire)))
+
+
+class LossyTransfers(unittest.TestCase):
+    blocks = 201
+    window_size = 4
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.source = self.temp_dir.child(b'source')
+        self.source.setContent(b''.join(
+            b'%07d\n' % n for n in range(self.blocks)) + b'end')
+        self.target = self.temp_dir.child(b'target')
+
+    def transfer(self, drop_data=lambda wire, count: False,
+                 drop_acks=lambda wire, count: False):
+        rs = ReadSession(FilesystemReader(self.source), _clock=self.clock)
+        ws = WriteSession(FilesystemWriter(self.target), _clock=self.clock)
+        for session, drop in ((rs, drop_data), (ws, drop_acks)):
+            session.block_size = 8
+            session.window_size = self.window_size
+            session.timeout = (1, 1, 1)
+            session.transport = Link(self.clock, drop=drop)
+            session.startProtocol()
+        rs.transport.peer, ws.transport.peer = ws, rs
+        rs.datagramReceived(ACKDatagram(0))
+        while self.clock.getDelayedCalls():
+            self.clock.advance(0.001)
+        self.assertEqual(self.target.getContent(), self.source.getContent())
+        return rs.transport.sent, ws.transport.sent
+
+    def test_no_loss(self):
+        # 202 blocks, the last one is short. An ACK per window, the last one
+        # is repeated twice, while the WriteSession waits for duplicates.
+        self.assertEqual(self.transfer(), (202, 53))
+
+    def test_lost_ACK(self):
+        # The window is sent again after the timeout and acknowledged once
+        # more, without the copies of that ACK resending the next windows
+        def drop(wire, count):
+            return count == 10
+        self.assertEqual(self.transfer(drop_acks=drop), (206, 54))
+
+    def test_lost_first_block(self):
+        # The gap ACK gets the window resent right away
+        def drop(wire, count):
+            return count == 41
+        self.assertEqual(self.transfer(drop_data=drop), (206, 54))
@@ -0,0 +1,146 @@
+'''
+@author: shylent
+'''
+from tftp.backend import FilesystemReader, FilesystemSynchronousBackend
+from tftp.session import ReadSession
+from tftp.shm import SharedMemory, SharedMemoryCacheBackend, SharedMemoryReader
+from tftp.test.test_sessions import FakeTransport
+from twisted.internet.defer import gatherResults, inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+import os
+import tempfile
+
+
+class SharedMemoryCache(unittest.TestCase):
+
+    if SharedMemory is None:
+        skip = "Shared memory is not available"
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        for name, size in ((b'small', 10), (b'medium', 40), (b'large', 60)):
+            with self.temp_dir.child(name).open('w') as fd:
+                fd.write(os.urandom(size))
+        self.prefix = 'tftptest%x%x' % (os.getpid(), id(self) & 0xffffff)
+        self.backend = self.makeBackend()
+
+    def makeBackend(self):
+        backend = SharedMemoryCacheBackend(
+            FilesystemSynchronousBackend(self.temp_dir), 100,
+            prefix=self.prefix, entries=4)
+        self.addCleanup(backend.index.close)
+        return backend
+
+    def getReader(self, file_name, backend=None):
+        reader = self.successResultOf(
+            (backend or self.backend).get_reader(file_name))
+        self.addCleanup(reader.finish)
+        return reader
+
+    def filled(self, backend=None):
+        return gatherResults(list((backend or self.backend).fills.values()))
+
+    @inlineCallbacks
+    def getCached(self, file_name, backend=None):
+        """Get a reader, once the file has been cached"""
+        reader = self.getReader(file_name, backend)
+        yield self.filled(backend)
+        if not isinstance(reader, SharedMemoryReader):
+            reader = self.getReader(file_name, backend)
+        return reader
+
+    @inlineCallbacks
+    def test_cached(self):
+        first = self.getReader(b'medium')
+        # Read from the file, while the segment is filled
+        self.assertIsInstance(first, FilesystemReader)
+        self.assertEqual(len(self.backend.fills), 1)
+        yield self.filled()
+        self.assertEqual(self.backend.fills, {})
+        reader = self.getReader(b'medium')
+        self.assertIsInstance(reader, SharedMemoryReader)
+        self.assertEqual(reader.size, 40)
+        data = reader.read(30)
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(bytes(data) + bytes(reader.read(30)),
+                         self.temp_dir.child(b'medium').getContent())
+        self.assertEqual(reader.read(30), b'')
+        self.assertEqual((self.backend.hits, self.backend.misses), (1, 1))
+        self.getReader(b'medium')
+        self.assertEqual((self.backend.hits, self.backend.misses), (2, 1))
+
+    @inlineCallbacks
+    def test_fill_failed(self):
+        reader = self.getReader(b'medium')
+        self.temp_dir.child(b'medium').setContent(b'changed')
+        yield self.filled()
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        with self.backend.index:
+            self.assertEqual(list(self.backend.index), [])
+        self.assertIsInstance(reader, FilesystemReader)
+
+    @inlineCallbacks
+    def test_shared_between_backends(self):
+        yield self.getCached(b'medium')
+        other = self.makeBackend()
+        reader = self.getReader(b'medium', other)
+        self.assertIsInstance(reader, SharedMemoryReader)
+        self.assertEqual((other.hits, other.misses), (1, 0))
+        self.assertEqual(bytes(reader.read(40)),
+                         self.temp_dir.child(b'medium').getContent())
+
+    def test_too_large(self):
+        with self.temp_dir.child(b'huge').open('w') as fd:
+            fd.write(b'x' * 101)
+        self.assertIsInstance(self.getReader(b'huge'), FilesystemReader)
+
+    @inlineCallbacks
+    def test_eviction(self):
+        yield self.getCached(b'medium')
+        yield self.getCached(b'small')
+        self.getReader(b'medium')
+        yield self.getCached(b'large')
+        with self.backend.index:
+            self.assertEqual(sorted(size for slot, name, size, used, filler
+                                    in self.backend.index), [40, 60])
+        self.assertEqual((self.backend.hits, self.backend.misses), (4, 3))
+
+    @inlineCallbacks
+    def test_changed_file(self):
+        yield self.getCached(b'small')
+        with self.temp_dir.child(b'small').open('w') as fd:
+            fd.write(b'changed')
+        reader = yield self.getCached(b'small')
+        self.assertEqual(bytes(reader.read(10)), b'changed')
+        self.assertEqual((self.backend.hits, self.backend.misses), (2, 2))
+
+    @inlineCallbacks
+    def test_being_filled(self):
+        reader = yield self.getCached(b'small')
+        name = reader.name
+        with self.backend.index:
+            for slot, entry, size, used, filler in self.backend.index:
+                self.backend.index.set(slot, entry, size, os.getppid())
+        self.assertIsInstance(self.getReader(b'small'), FilesystemReader)
+        self.assertEqual(reader.name, name)
+
+    @inlineCallbacks
+    def test_read_session(self):
+        clock = Clock()
+        transport = FakeTransport(hostAddress=('127.0.0.1', 65466))
+        reader = yield self.getCached(b'medium')
+        session = ReadSession(reader, _clock=clock)
+        session.block_size = 16
+        session.transport = transport
+        session.startProtocol()
+        session.nextBlock()
+        clock.advance(0)
+        self.assertEqual(transport.value()[4:],
+                         self.temp_dir.child(b'medium').getContent()[:16])
+        session.cancel()
+
+    def tearDown(self):
+        self.backend.purge()
+        self.temp_dir.remove()
@@ -0,0 +1,433 @@
+'''
+@author: shylent
+'''
+from tftp.backend import (FilesystemAsynchronousBackend,
+    FilesystemSynchronousBackend)
+from tftp.datagram import (ACKDatagram, DATADatagram, OP_ACK, OP_DATA,
+    OP_OACK, RRQDatagram, TFTPDatagramFactory, WRQDatagram, split_opcode)
+from tftp.protocol import TFTP
+from tftp.test.test_demux import FakeReactor
+from tftp.test.test_protocol import TFTPWrapper
+from tftp.udp import (BatchPort, ScatterPort, SOL_UDP, UDP_SEGMENT,
+    _MTU_OPTIONS, _enableOffload, _recvmmsg, listenUDP, maxPayload)
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.protocol import DatagramProtocol
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+import os
+import socket
+import struct
+import tempfile
+
+
+class Refused(DatagramProtocol):
+
+    refused = 0
+
+    def connectionRefused(self):
+        self.refused += 1
+
+
+class ScatterGather(unittest.TestCase):
+
+    if not hasattr(socket.socket, 'sendmsg'):
+        skip = "sendmsg is not available"
+
+    def setUp(self):
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.receiver.settimeout(5)
+        self.addCleanup(self.receiver.close)
+        self.protocol = Refused()
+        self.port = listenUDP(0, self.protocol, '127.0.0.1')
+        self.addCleanup(self.port.stopListening)
+
+    def test_listen(self):
+        self.assertIsInstance(self.port, ScatterPort)
+
+    def test_fallback(self):
+        fake = FakeReactor()
+        port = listenUDP(0, DatagramProtocol(), '127.0.0.1', fake)
+        self.assertEqual(fake.ports, [port])
+
+    def test_write_buffers(self):
+        self.port.writeBuffers([b'\x00\x03\x00\x01', memoryview(b'data')],
+                               self.receiver.getsockname())
+        self.assertEqual(self.receiver.recv(100),
+                         DATADatagram(1, b'data').to_wire())
+
+    def test_write_buffers_connected(self):
+        self.port.connect(*self.receiver.getsockname())
+        self.port.writeBuffers([b'\x00\x03\x00\x01', bytearray(b'da'), b'ta'])
+        self.assertEqual(self.receiver.recv(100),
+                         DATADatagram(1, b'data').to_wire())
+
+    def test_connection_refused(self):
+        addr = self.receiver.getsockname()
+        self.receiver.close()
+        self.port.connect(*addr)
+        # The first datagram provokes an ICMP error, that the next one reports
+        self.port.writeBuffers([b'\x00\x03', b'\x00\x01'])
+        self.port.writeBuffers([b'\x00\x03', b'\x00\x02'])
+        self.assertEqual(self.protocol.refused, 1)
+
+
+class Collector(Refused):
+
+    def __init__(self):
+        self.received = []
+
+    def datagramReceived(self, datagram, addr):
+        self.received.append((datagram, addr))
+
+
+class Batching(unittest.TestCase):
+
+    if _recvmmsg is None:
+        skip = "recvmmsg is not available"
+
+    def setUp(self):
+        self.peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.peer.bind(('127.0.0.1', 0))
+        self.peer.settimeout(5)
+        self.addCleanup(self.peer.close)
+        self.protocol = Collector()
+        self.port = listenUDP(0, self.protocol, '127.0.0.1', batch_size=4)
+        self.addCleanup(self.port.stopListening)
+        self.addr = ('127.0.0.1', self.port.getHost().port)
+
+    def test_listen(self):
+        self.assertIsInstance(self.port, BatchPort)
+        self.assertEqual(self.port.batch_size, 4)
+
+    def test_receive(self):
+        datagrams = [DATADatagram(n, b'x' * n).to_wire() for n in range(1, 11)]
+        for datagram in datagrams:
+            self.peer.sendto(datagram, self.addr)
+        self.port.doRead()
+        self.assertEqual(self.protocol.received,
+                         [(datagram, self.peer.getsockname())
+                          for datagram in datagrams])
+
+    def test_receive_errors_logged(self):
+        self.protocol.datagramReceived = lambda datagram, addr: 1 / 0
+        self.peer.sendto(b'one', self.addr)
+        self.peer.sendto(b'two', self.addr)
+        self.port.doRead()
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 2)
+
+    def test_send_batches_off(self):
+        self.assertFalse(self.port.send_batches)
+        self.port._sendBatch = lambda base, count: self.fail("sendmmsg used")
+        self.assertEqual(
+            self.port.writeBatch([b'one', (b'tw', b'o')],
+                                 self.peer.getsockname()), 2)
+        self.assertEqual([self.peer.recv(100) for i in range(2)],
+                         [b'one', b'two'])
+
+    def test_write_batch(self):
+        self.port.send_batches = True
+        content = b'0123456789'
+        sent = self.port.writeBatch(
+            [b'\x00\x03\x00\x01', (b'\x00\x03\x00\x02', memoryview(content)[2:5]),
+             bytearray(b'\x00\x03\x00\x03')], self.peer.getsockname())
+        self.assertEqual(sent, 3)
+        self.assertEqual([self.peer.recv(100) for i in range(3)],
+                         [DATADatagram(1, b'').to_wire(),
+                          DATADatagram(2, b'234').to_wire(),
+                          DATADatagram(3, b'').to_wire()])
+
+    def test_write_batch_connected(self):
+        self.port.send_batches = True
+        self.port.connect(*self.peer.getsockname())
+        self.assertEqual(self.port.writeBatch([b'one', b'two']), 2)
+        self.assertEqual([self.peer.recv(100) for i in range(2)],
+                         [b'one', b'two'])
+
+    def test_connection_refused(self):
+        self.port.send_batches = True
+        addr = self.peer.getsockname()
+        self.peer.close()
+        self.port.connect(*addr)
+        self.port.writeBatch([b'one'])
+        self.assertEqual(self.port.writeBatch([b'two']), 0)
+        self.assertEqual(self.protocol.refused, 1)
+
+
+class WindowedClient(DatagramProtocol):
+    """Reads a file with windows of 4 blocks of 512 bytes"""
+
+    def __init__(self):
+        self.blocks = []
+        self.done = Deferred()
+
+    def datagramReceived(self, datagram, addr):
+        datagram = TFTPDatagramFactory(*split_opcode(datagram))
+        if datagram.opcode == OP_OACK:
+            self.transport.write(ACKDatagram(0).to_wire(), addr)
+        elif datagram.opcode == OP_DATA:
+            if datagram.blocknum != len(self.blocks) + 1:
+                return
+            self.blocks.append(datagram.data)
+            if len(datagram.data) < 512:
+                self.transport.write(ACKDatagram(datagram.blocknum).to_wire(), addr)
+                self.done.callback(b''.join(self.blocks))
+            elif datagram.blocknum % 4 == 0:
+                self.transport.write(ACKDatagram(datagram.blocknum).to_wire(), addr)
+
+
+class BatchedTransfer(unittest.TestCase):
+
+    if _recvmmsg is None:
+        skip = "recvmmsg is not available"
+
+    options = {'batch_size': 8}
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.content = os.urandom(512 * 10 + 100)
+        self.temp_dir.child(b'file').setContent(self.content)
+        self.tftp = TFTP(FilesystemSynchronousBackend(self.temp_dir),
+                         **self.options)
+        self.server = listenUDP(0, self.tftp, '127.0.0.1', **self.options)
+        self.addCleanup(self.server.stopListening)
+        self.client = WindowedClient()
+        self.client_port = reactor.listenUDP(0, self.client, '127.0.0.1')
+        self.addCleanup(self.client_port.stopListening)
+
+    @inlineCallbacks
+    def test_RRQ(self):
+        self.client.transport.write(
+            RRQDatagram(b'file', b'octet', {b'windowsize': b'4'}).to_wire(),
+            ('127.0.0.1', self.server.getHost().port))
+        content = yield self.client.done
+        self.assertEqual(content, self.content)
+
+
+class ThreadedTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.content = os.urandom(512 * 10 + 100)
+        self.temp_dir.child(b'file').setContent(self.content)
+        backend = FilesystemAsynchronousBackend(self.temp_dir, threads=2)
+        self.addCleanup(backend.stop)
+        self.tftp = TFTP(backend)
+        self.server = reactor.listenUDP(0, self.tftp, '127.0.0.1')
+        self.addCleanup(self.server.stopListening)
+        self.client = WindowedClient()
+        self.client_port = reactor.listenUDP(0, self.client, '127.0.0.1')
+        self.addCleanup(self.client_port.stopListening)
+
+    @inlineCallbacks
+    def test_RRQ(self):
+        self.client.transport.write(
+            RRQDatagram(b'file', b'octet', {b'windowsize': b'4'}).to_wire(),
+            ('127.0.0.1', self.server.getHost().port))
+        content = yield self.client.done
+        self.assertEqual(content, self.content)
+
+
+def _offloadSupported():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        return _enableOffload(sock)
+    finally:
+        sock.close()
+
+
+class Offload(unittest.TestCase):
+
+    if not _offloadSupported():
+        skip = "UDP segmentation offload is not supported"
+
+    def setUp(self):
+        self.peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.peer.bind(('127.0.0.1', 0))
+        self.peer.settimeout(5)
+        self.addCleanup(self.peer.close)
+        self.port = self.listen()
+        self.protocol = self.port.protocol
+        self.addr = ('127.0.0.1', self.port.getHost().port)
+
+    def listen(self, **kwargs):
+        port = listenUDP(0, Collector(), '127.0.0.1', offload=True, **kwargs)
+        self.addCleanup(port.stopListening)
+        segments = []
+        write = port._writeSegments
+        def _writeSegments(datagrams, size, addr):
+            segments.append((len(datagrams), size))
+            return write(datagrams, size, addr)
+        port._writeSegments = _writeSegments
+        port.segments = segments
+        return port
+
+    def test_enabled(self):
+        self.assertTrue(self.port.offload)
+        port = listenUDP(0, Collector(), '127.0.0.1')
+        self.addCleanup(port.stopListening)
+        self.assertFalse(port.offload)
+
+    def test_segmented(self):
+        datagrams = [DATADatagram(1, b'a' * 512).to_wire(),
+                     (b'\x00\x03\x00\x02', memoryview(b'b' * 512)),
+                     DATADatagram(3, b'c' * 512).to_wire(),
+                     DATADatagram(4, b'd' * 100).to_wire(),
+                     DATADatagram(5, b'e' * 512).to_wire()]
+        self.assertEqual(
+            self.port.writeBatch(datagrams, self.peer.getsockname()), 5)
+        self.assertEqual(self.port.segments, [(4, 516)])
+        self.assertEqual([self.peer.recv(1000) for i in range(5)],
+                         [b''.join(d) if type(d) is tuple else d
+                          for d in datagrams])
+
+    def test_segmented_connected(self):
+        self.port.connect(*self.peer.getsockname())
+        self.port.writeBatch([b'one', b'two', b'six'])
+        self.assertEqual(self.port.segments, [(3, 3)])
+        self.assertEqual([self.peer.recv(100) for i in range(3)],
+                         [b'one', b'two', b'six'])
+
+    def test_segments_limited(self):
+        datagrams = [b'x' * 8196] * 10
+        self.port.writeBatch(datagrams, self.peer.getsockname())
+        self.assertEqual(self.port.segments, [(7, 8196), (3, 8196)])
+        self.assertEqual([len(self.peer.recv(10000)) for i in range(10)],
+                         [8196] * 10)
+
+    def test_coalesced(self):
+        # A burst from the same peer is received in one piece and split
+        self.peer.sendmsg([b'a' * 10, b'b' * 10, b'c' * 4],
+                          [(SOL_UDP, UDP_SEGMENT, struct.pack('=H', 10))],
+                          0, self.addr)
+        self.peer.sendto(b'single', self.addr)
+        self.port.doRead()
+        peer = self.peer.getsockname()
+        self.assertEqual(self.protocol.received,
+                         [(b'a' * 10, peer), (b'b' * 10, peer), (b'c' * 4, peer),
+                          (b'single', peer)])
+
+    def test_batch_port(self):
+        if _recvmmsg is None:
+            raise unittest.SkipTest("recvmmsg is not available")
+        port = self.listen(batch_size=4)
+        self.assertIsInstance(port, BatchPort)
+        port.writeBatch([b'one', b'two'], self.peer.getsockname())
+        self.assertEqual(port.segments, [(2, 3)])
+        self.peer.sendmsg([b'one', b'two'],
+                          [(SOL_UDP, UDP_SEGMENT, struct.pack('=H', 3))],
+                          0, ('127.0.0.1', port.getHost().port))
+        port.doRead()
+        self.assertEqual([datagram for datagram, addr in port.protocol.received],
+                         [b'one', b'two'])
+
+
+class OffloadedTransfer(BatchedTransfer):
+
+    if not _offloadSupported():
+        skip = "UDP segmentation offload is not supported"
+
+    options = {'offload': True}
+
+
+class MTUSocket(object):
+    """A connected socket, that reports the given path MTU"""
+
+    def __init__(self, mtu, family=socket.AF_INET):
+        self.mtu = mtu
+        self.family = family
+
+    def getsockopt(self, level, option):
+        if self.mtu is None:
+            raise socket.error(107, "Transport endpoint is not connected")
+        return self.mtu
+
+
+class MTUTransport(object):
+
+    def __init__(self, sock):
+        self.socket = sock
+
+
+class PathMTU(unittest.TestCase):
+
+    if not _MTU_OPTIONS:
+        skip = "The path MTU is not available on this platform"
+
+    def test_connected(self):
+        transport = MTUTransport(MTUSocket(1500))
+        self.assertEqual(maxPayload(('10.0.0.1', 69), transport), 1472)
+
+    def test_ipv6(self):
+        transport = MTUTransport(MTUSocket(1500, socket.AF_INET6))
+        self.assertEqual(maxPayload(('fe80::1', 69), transport), 1452)
+
+    def test_probe(self):
+        # Neither an unconnected socket nor a transport without one can tell,
+        # a socket is connected just to ask
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(probe.close)
+        probe.connect(('127.0.0.1', 69))
+        expected = probe.getsockopt(*_MTU_OPTIONS[socket.AF_INET]) - 28
+        self.assertEqual(
+            maxPayload(('127.0.0.1', 69), MTUTransport(MTUSocket(None))),
+            expected)
+        self.assertEqual(maxPayload(('127.0.0.1', 69)), expected)
+
+
+class WritingClient(DatagramProtocol):
+    """Writes a file in blocks of 16384 bytes, one at a time"""
+
+    block_size = 16384
+
+    def __init__(self, content):
+        self.content = content
+        self.last = len(content) // self.block_size + 1
+        self.done = Deferred()
+
+    def datagramReceived(self, datagram, addr):
+        datagram = TFTPDatagramFactory(*split_opcode(datagram))
+        if datagram.opcode == OP_OACK:
+            blocknum = 0
+        elif datagram.opcode == OP_ACK:
+            blocknum = datagram.blocknum
+        else:
+            return
+        if blocknum == self.last:
+            self.done.callback(None)
+            return
+        offset = blocknum * self.block_size
+        self.transport.write(DATADatagram(
+            blocknum + 1, self.content[offset:offset + self.block_size]).to_wire(),
+            addr)
+
+
+class LargeBlocks(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.addCleanup(self.temp_dir.remove)
+        self.content = os.urandom(16384 * 3 + 100)
+        self.tftp = TFTPWrapper(FilesystemSynchronousBackend(self.temp_dir,
+                                                             can_write=True),
+                                max_block_size=16384)
+        self.server = reactor.listenUDP(0, self.tftp, '127.0.0.1')
+        self.addCleanup(self.server.stopListening)
+        self.client = WritingClient(self.content)
+        self.client_port = reactor.listenUDP(0, self.client, '127.0.0.1',
+                                             20000)
+        self.addCleanup(self.client_port.stopListening)
+
+    @inlineCallbacks
+    def test_WRQ(self):
+        self.client.transport.write(
+            WRQDatagram(b'file', b'octet', {b'blksize': b'16384'}).to_wire(),
+            ('127.0.0.1', self.server.getHost().port))
+        yield self.client.done
+        self.assertEqual(self.temp_dir.child(b'file').getContent(),
+                         self.content)
+        # Don't wait for the duplicates of the last block
+        self.tftp.session.cancel()
@@ -3,7 +3,7 @@
 '''
 from itertools import count, islice
 from random import randint
-from tftp.util import CANCELLED, iterlast, timedCaller
+from tftp.util import CANCELLED, SessionTimer, iterlast, timedCaller
 from twisted.internet.defer import inlineCallbacks
 from twisted.internet.task import Clock
 from twisted.trial import unittest
@@ -65,6 +65,71 @@ class TimedCaller(unittest.TestCase):
         self.assertEqual(["call", "call"], record)
 
 
+class SessionTimerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.record = []
+        self.timer = SessionTimer(
+            lambda: self.record.append("call"),
+            lambda: self.record.append("last"), self.clock)
+
+    def test_raises_ValueError_with_no_timings(self):
+        error = self.assertRaises(ValueError, self.timer.start, [])
+        self.assertEqual("No timings specified.", str(error))
+
+    def test_pauses_between_calls(self):
+        self.timer.start([1, 2, 3])
+        self.assertEqual([], self.record)
+        self.clock.advance(1)
+        self.assertEqual(["call"], self.record)
+        self.clock.advance(2)
+        self.assertEqual(["call", "call"], self.record)
+        self.clock.advance(3)
+        self.assertEqual(["call", "call", "last"], self.record)
+        self.assertFalse(self.timer.running)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_first_delay(self):
+        self.timer.start([1], 0)
+        self.clock.advance(0)
+        self.assertEqual(["call"], self.record)
+        self.clock.advance(1)
+        self.assertEqual(["call", "last"], self.record)
+
+    def test_restart_reuses_delayed_call(self):
+        self.timer.start([1, 2, 3])
+        delayed_call = self.clock.getDelayedCalls()[0]
+        self.clock.advance(0.5)
+        self.timer.stop()
+        self.timer.start([2, 2])
+        self.assertEqual([delayed_call], self.clock.getDelayedCalls())
+        self.clock.advance(1.5)
+        self.assertEqual([], self.record)
+        self.clock.advance(0.5)
+        self.assertEqual(["call"], self.record)
+        self.clock.advance(2)
+        self.assertEqual(["call", "last"], self.record)
+
+    def test_stopped_timer_does_not_call(self):
+        self.timer.start([1, 2, 3])
+        self.timer.stop()
+        self.clock.advance(10)
+        self.assertEqual([], self.record)
+
+    def test_can_be_cancelled(self):
+        self.timer.start([1, 2, 3])
+        self.clock.advance(1)
+        self.timer.cancel()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.clock.advance(10)
+        self.assertEqual(["call"], self.record)
+        # ...and started again
+        self.timer.start([1])
+        self.clock.advance(1)
+        self.assertEqual(["call", "last"], self.record)
+
+
 class IterLast(unittest.TestCase):
 
     def test_yields_nothing_when_no_input(self):
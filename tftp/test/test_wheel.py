@@ -0,0 +1,190 @@
+'''
+@author: shylent
+'''
+from tftp.backend import FilesystemReader
+from tftp.bootstrap import RemoteOriginReadSession
+from tftp.datagram import ACKDatagram, DATADatagram
+from tftp.protocol import TFTP
+from tftp.test.test_sessions import FakeTransport
+from tftp.wheel import TimingWheel
+from twisted.internet.interfaces import IReactorTime
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial import unittest
+import tempfile
+
+
+class Wheel(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimingWheel(self.clock, granularity=0.1, slots=4, levels=2)
+        self.fired = []
+
+    def record(self, name):
+        self.fired.append((name, round(self.clock.seconds(), 6)))
+
+    def advance(self, seconds, step=0.05):
+        for i in range(int(round(seconds / step))):
+            self.clock.advance(step)
+
+    def test_provides_reactor_time(self):
+        self.assertTrue(IReactorTime.providedBy(self.wheel))
+        self.assertEqual(self.wheel.seconds(), self.clock.seconds())
+
+    def test_fires_at_the_end_of_tick(self):
+        self.wheel.callLater(0.25, self.record, 'a')
+        self.wheel.callLater(0.3, self.record, 'b')
+        self.advance(0.25)
+        self.assertEqual(self.fired, [])
+        self.advance(0.05)
+        self.assertEqual(self.fired, [('a', 0.3), ('b', 0.3)])
+
+    def test_same_tick_runs_in_order(self):
+        self.wheel.callLater(0.3, self.record, 'late')
+        self.wheel.callLater(0.21, self.record, 'early')
+        self.advance(0.3)
+        self.assertEqual([name for name, t in self.fired], ['early', 'late'])
+
+    def test_single_underlying_call(self):
+        for i in range(100):
+            self.wheel.callLater(0.1 * (i % 10 + 1), self.record, i)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.assertEqual(len(self.wheel.getDelayedCalls()), 100)
+        self.advance(1)
+        self.assertEqual(len(self.fired), 100)
+        self.assertEqual(self.wheel.getDelayedCalls(), [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_zero_delay(self):
+        self.wheel.callLater(0, self.record, 'a')
+        self.wheel.callLater(0, self.record, 'b')
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(0)
+        self.assertEqual(self.fired, [('a', 0), ('b', 0)])
+
+    def test_cascade(self):
+        # 4 slots of 0.1s on the first level, so this starts on the second one
+        self.wheel.callLater(1.05, self.record, 'a')
+        self.advance(1.05)
+        self.assertEqual(self.fired, [])
+        self.advance(0.05)
+        self.assertEqual(self.fired, [('a', 1.1)])
+
+    def test_beyond_top_level(self):
+        # 2 levels of 4 slots cover 1.6s
+        self.wheel.callLater(5, self.record, 'a')
+        self.advance(4.95)
+        self.assertEqual(self.fired, [])
+        self.advance(0.05)
+        self.assertEqual(self.fired, [('a', 5)])
+
+    def test_cancel(self):
+        call = self.wheel.callLater(0.5, self.record, 'a')
+        self.assertTrue(call.active())
+        call.cancel()
+        self.assertFalse(call.active())
+        self.assertEqual(self.wheel.getDelayedCalls(), [])
+        self.advance(1)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cancel_from_another_call(self):
+        call = self.wheel.callLater(0.2, self.record, 'b')
+        self.wheel.callLater(0.15, call.cancel)
+        self.advance(1)
+        self.assertEqual(self.fired, [])
+
+    def test_reset_sooner(self):
+        call = self.wheel.callLater(1, self.record, 'a')
+        call.reset(0.2)
+        self.advance(0.2)
+        self.assertEqual(self.fired, [('a', 0.2)])
+
+    def test_reset_later(self):
+        call = self.wheel.callLater(0.2, self.record, 'a')
+        self.advance(0.1)
+        call.reset(0.5)
+        self.advance(0.45)
+        self.assertEqual(self.fired, [])
+        self.advance(0.05)
+        self.assertEqual(self.fired, [('a', 0.6)])
+
+    def test_delay(self):
+        call = self.wheel.callLater(0.2, self.record, 'a')
+        call.delay(0.3)
+        self.advance(0.4)
+        self.assertEqual(self.fired, [])
+        self.advance(0.1)
+        self.assertEqual(self.fired, [('a', 0.5)])
+
+    def test_idle_ticks_skipped(self):
+        self.wheel.callLater(0.1, self.record, 'a')
+        self.advance(0.1)
+        self.clock.advance(100)
+        self.wheel.callLater(0.15, self.record, 'b')
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.assertAlmostEqual(self.clock.getDelayedCalls()[0].getTime(), 100.2)
+        self.advance(0.2)
+        self.assertEqual(self.fired, [('a', 0.1), ('b', 100.3)])
+
+    def test_late_underlying_clock(self):
+        self.wheel.callLater(0.2, self.record, 'a')
+        self.wheel.callLater(0.3, self.record, 'b')
+        self.wheel.callLater(1.5, self.record, 'c')
+        self.clock.advance(0.65)
+        self.assertEqual(self.fired, [('a', 0.65), ('b', 0.65)])
+        self.advance(0.85)
+        self.assertEqual(self.fired[2:], [('c', 1.5)])
+
+    def test_error_in_call(self):
+        self.wheel.callLater(0.1, lambda: 1 // 0)
+        self.wheel.callLater(0.1, self.record, 'a')
+        self.advance(0.1)
+        self.assertEqual(self.fired, [('a', 0.1)])
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+
+
+class WheelSessions(unittest.TestCase):
+    test_data = b'line1\nline2\nanotherline'
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = FilePath(tempfile.mkdtemp()).asBytesMode()
+        self.target = self.temp_dir.child(b'foo')
+        with self.target.open('wb') as temp_fd:
+            temp_fd.write(self.test_data)
+
+    def test_protocol(self):
+        self.assertTrue(TFTP(None, _clock=self.clock).timers is self.clock)
+        wheel = TFTP(None, _clock=self.clock, timer_granularity=0.5).timers
+        self.assertIsInstance(wheel, TimingWheel)
+        self.assertEqual(wheel.granularity, 0.5)
+        self.assertTrue(wheel.clock is self.clock)
+
+    def test_read_session(self):
+        wheel = TimingWheel(self.clock, granularity=0.5)
+        transport = FakeTransport(hostAddress=('127.0.0.1', 65466))
+        rs = RemoteOriginReadSession(('127.0.0.1', 65465),
+                                     FilesystemReader(self.target), _clock=wheel)
+        rs.session.block_size = 5
+        rs.session.timeout = (2, 2, 2)
+        rs.transport = transport
+        rs.startProtocol()
+        self.clock.advance(0)
+        self.assertEqual(transport.value(), DATADatagram(1, b'line1').to_wire())
+        transport.clear()
+        rs.datagramReceived(ACKDatagram(1).to_wire(), ('127.0.0.1', 65465))
+        self.clock.advance(0)
+        self.assertEqual(transport.value(), DATADatagram(2, b'\nline').to_wire())
+        # Retransmission timers of all the sessions share a single call
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        transport.clear()
+        self.clock.pump((0.5,) * 4)
+        self.assertEqual(transport.value(), DATADatagram(2, b'\nline').to_wire())
+        self.clock.pump((0.5,) * 8)
+        self.assertTrue(transport.disconnecting)
+        self.assertEqual(wheel.getDelayedCalls(), [])
+
+    def tearDown(self):
+        self.temp_dir.remove()
@@ -4,7 +4,7 @@
 import struct
 from tftp.datagram import (split_opcode, WireProtocolError, TFTPDatagramFactory,
     RQDatagram, DATADatagram, ACKDatagram, ERRORDatagram, errors, OP_RRQ, OP_WRQ,
-    OACKDatagram)
+    OACKDatagram, ACK_WIRE, ERROR_WIRE, OP_OACK, OP_DATA, OP_ACK, OP_ERROR)
 from tftp.errors import OptionsDecodeError
 from twisted.trial import unittest
 
@@ -23,6 +23,16 @@ class OpcodeProcessing(unittest.TestCase):
     def test_non_empty_payload(self):
         self.assertEqual(split_opcode(b'\x00\x01foo'), (1, b'foo'))
 
+    def test_payload_not_copied(self):
+        datagram = b'\x00\x03\x00\x01foo'
+        opcode, payload = split_opcode(datagram)
+        self.assertIsInstance(payload, memoryview)
+        self.assertIdentical(payload.obj, datagram)
+        data = TFTPDatagramFactory(opcode, payload).data
+        self.assertIsInstance(data, memoryview)
+        self.assertIdentical(data.obj, datagram)
+        self.assertEqual(data, b'foo')
+
     def test_unknown_opcode(self):
         opcode = 17
         self.assertRaises(WireProtocolError, TFTPDatagramFactory, opcode, b'foobar')
@@ -100,6 +110,38 @@ class ConcreteDatagrams(unittest.TestCase):
         self.assertEqual(DATADatagram.from_wire(b'\x00\x01foobar').to_wire(),
                          b'\x00\x03\x00\x01foobar')
 
+    def test_data_pack_into(self):
+        buffer = bytearray(16)
+        self.assertEqual(DATADatagram(2, b'foobar').pack_into(buffer), 10)
+        self.assertEqual(buffer[:10], b'\x00\x03\x00\x02foobar')
+        self.assertEqual(DATADatagram(3, memoryview(b'baz')).pack_into(buffer, 1), 7)
+        self.assertEqual(buffer[:10], b'\x00\x00\x03\x00\x03bazar')
+
+    def test_pack_into(self):
+        buffer = bytearray(8)
+        self.assertEqual(ACKDatagram(10).pack_into(buffer, 2), 4)
+        self.assertEqual(buffer, b'\x00\x00\x00\x04\x00\x0a\x00\x00')
+
+    def test_slots(self):
+        for dgram in (ACKDatagram(1), ERRORDatagram.from_code(1),
+                      OACKDatagram({}), DATADatagram(1, b'foo')):
+            self.assertFalse(hasattr(dgram, '__dict__'))
+
+    def test_opcode_is_class_constant(self):
+        self.assertEqual(OACKDatagram.opcode, OP_OACK)
+        self.assertEqual(DATADatagram.opcode, OP_DATA)
+        self.assertEqual(ACKDatagram.opcode, OP_ACK)
+        self.assertEqual(ERRORDatagram.opcode, OP_ERROR)
+
+    def test_tables(self):
+        self.assertEqual(len(ACK_WIRE), 65536)
+        self.assertEqual(ACK_WIRE[65535], b'\x00\x04\xff\xff')
+        self.assertIdentical(ACKDatagram(7).to_wire(), ACK_WIRE[7])
+        self.assertEqual(ERROR_WIRE[1], b'\x00\x05\x00\x01File not found\x00')
+        self.assertIdentical(ERRORDatagram.from_code(1).to_wire(), ERROR_WIRE[1])
+        self.assertEqual(ERRORDatagram.from_code(1, b'nope').to_wire(),
+                         b'\x00\x05\x00\x01nope\x00')
+
     def test_ack(self):
         # Zero-length payload
         self.assertRaises(WireProtocolError, ACKDatagram.from_wire, b'')
@@ -0,0 +1,116 @@
+'''
+@author: shylent
+'''
+from tftp.workers import ReusePortUDPServer, WorkerSupervisor
+from twisted.internet.error import ProcessDone, ProcessExitedAlready
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+import socket
+
+
+class FakeProcess(object):
+
+    def __init__(self, protocol, args):
+        self.protocol = protocol
+        self.args = args
+        self.signals = []
+        self.ended = False
+
+    def signalProcess(self, signal):
+        if self.ended:
+            raise ProcessExitedAlready()
+        self.signals.append(signal)
+
+    def end(self):
+        self.ended = True
+        self.protocol.processEnded(Failure(ProcessDone(0)))
+
+
+class FakeProcessReactor(Clock):
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.processes = []
+
+    def spawnProcess(self, protocol, executable, args, env=None, childFDs=None):
+        process = FakeProcess(protocol, args)
+        self.processes.append(process)
+        return process
+
+
+class Supervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.supervisor = WorkerSupervisor(
+            2, ['-m', 'twisted', 'tftp'], executable='python',
+            _reactor=self.reactor)
+
+    def test_start(self):
+        self.supervisor.startService()
+        self.assertEqual(len(self.reactor.processes), 2)
+        self.assertEqual(self.reactor.processes[0].args,
+                         ['python', '-m', 'twisted', 'tftp'])
+        self.assertEqual(sorted(self.supervisor.workers), [0, 1])
+
+    def test_restart(self):
+        self.supervisor.startService()
+        self.reactor.processes[1].end()
+        self.assertEqual(list(self.supervisor.workers), [0])
+        self.reactor.advance(self.supervisor.restart_delay)
+        self.assertEqual(len(self.reactor.processes), 3)
+        self.assertTrue(self.supervisor.workers[1] is self.reactor.processes[2])
+        self.assertEqual(self.supervisor.restarts, 1)
+
+    def test_stop(self):
+        self.supervisor.startService()
+        d = self.supervisor.stopService()
+        self.assertEqual([p.signals for p in self.reactor.processes],
+                         [['TERM'], ['TERM']])
+        self.assertNoResult(d)
+        for process in self.reactor.processes:
+            process.end()
+        self.successResultOf(d)
+        self.reactor.advance(self.supervisor.restart_delay)
+        self.assertEqual(len(self.reactor.processes), 2)
+
+    def test_stop_while_restarting(self):
+        self.supervisor.startService()
+        self.reactor.processes[0].end()
+        d = self.supervisor.stopService()
+        self.reactor.processes[1].end()
+        self.successResultOf(d)
+        self.reactor.advance(self.supervisor.restart_delay)
+        self.assertEqual(len(self.reactor.processes), 2)
+
+
+class Listener(DatagramProtocol):
+    pass
+
+
+class ReusePort(unittest.TestCase):
+
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        skip = "SO_REUSEPORT is not available"
+
+    def test_shared_port(self):
+        first = ReusePortUDPServer(0, Listener(), interface='127.0.0.1')
+        first.startService()
+        self.addCleanup(first.stopService)
+        port = first._port.getHost().port
+        second = ReusePortUDPServer(port, Listener(), interface='127.0.0.1')
+        second.startService()
+        self.addCleanup(second.stopService)
+        self.assertEqual(second._port.getHost().port, port)
+        self.assertTrue(first.protocol.transport is first._port)
+
+    def test_max_packet_size(self):
+        for batch_size in (0, 4):
+            server = ReusePortUDPServer(0, Listener(), interface='127.0.0.1',
+                                        batch_size=batch_size,
+                                        max_packet_size=65468)
+            server.startService()
+            self.addCleanup(server.stopService)
+            self.assertEqual(server._port.maxPacketSize, 65468)
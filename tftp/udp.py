@@ -0,0 +1,670 @@
+'''
+@author: shylent
+'''
+from errno import (EAGAIN, EINTR, EMSGSIZE, ECONNREFUSED, EWOULDBLOCK)
+from struct import Struct
+from twisted.application import internet
+from twisted.internet import error, reactor, udp
+from twisted.internet.abstract import isIPv6Address
+from twisted.python import log
+import os
+import socket
+import sys
+
+try:
+    from twisted.internet.posixbase import PosixReactorBase
+except ImportError:
+    PosixReactorBase = None
+
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _recvmmsg = _libc.recvmmsg
+    _sendmmsg = _libc.sendmmsg
+except (ImportError, OSError, AttributeError):
+    _recvmmsg = _sendmmsg = None
+
+
+__all__ = ['BatchPort', 'ScatterPort', 'UDPServer', 'adoptDatagramPort',
+           'listenUDP', 'maxPayload']
+
+
+_FAMILY = Struct('=H')
+_PORT = Struct('!H')
+# Room for any socket address (struct sockaddr_storage)
+_NAMELEN = 128
+
+_sockErrReadIgnore = (EAGAIN, EINTR, EWOULDBLOCK)
+
+# UDP segmentation offload (GSO) and receive offload (GRO), Linux 4.18 and 5.0
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)
+# The most segments, that the kernel takes at once (UDP_MAX_SEGMENTS)
+_MAX_SEGMENTS = 64
+# The largest UDP payload over IPv4
+_MAX_PAYLOAD = 65507
+_SEGMENT = Struct('=H')
+_GRO_SIZE = Struct('=i')
+
+# The MTU of the path to the peer of a connected socket, Linux only
+if sys.platform.startswith('linux'):
+    _MTU_OPTIONS = {
+        socket.AF_INET: (socket.IPPROTO_IP, getattr(socket, 'IP_MTU', 14)),
+        socket.AF_INET6: (socket.IPPROTO_IPV6, getattr(socket, 'IPV6_MTU', 24))}
+else:
+    _MTU_OPTIONS = {}
+# IP header (without options) and UDP header
+_HEADERS = {socket.AF_INET: 20 + 8, socket.AF_INET6: 40 + 8}
+
+# Receive buffers of the BatchPorts, keyed by (batch size, packet size)
+_receiveBuffers = {}
+
+
+def _length(datagram):
+    if type(datagram) is tuple:
+        return sum(len(part) for part in datagram)
+    return len(datagram)
+
+
+def _enableOffload(sock):
+    """Enable the receive offload on C{sock}, if the kernel supports both the
+    segmentation and the receive offload.
+
+    @return: whether it does
+    @rtype: C{bool}
+
+    """
+    try:
+        sock.getsockopt(SOL_UDP, UDP_SEGMENT)
+        sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+    except OSError:
+        return False
+    return True
+
+
+class ScatterPort(udp.Port):
+    """A UDP port, that can send a datagram, which is made of several buffers,
+    with a single C{sendmsg} call, so that the buffers are gathered by the
+    kernel instead of being joined first (see L{writeBuffers}).
+
+    If L{offload} is set, the port uses the UDP segmentation and receive
+    offloads of Linux: a run of datagrams of the same size is passed to the
+    kernel in one piece and split into datagrams at the bottom of the network
+    stack (see L{writeBatch}), and the datagrams, that arrive in a burst from
+    the same peer, are received in one piece and split here (see L{doRead}).
+
+    @ivar offload: whether the offloads are used. It's cleared, when the port
+    starts listening, if the kernel doesn't support them.
+    @type offload: C{bool}
+
+    """
+    offload = False
+
+    def startListening(self):
+        udp.Port.startListening(self)
+        if self.offload:
+            self.offload = _enableOffload(self.socket)
+
+    def doRead(self):
+        """Called when my socket is ready for reading. With L{offload}, split
+        the datagrams, that were coalesced by the kernel, and pass them to the
+        protocol one by one.
+
+        """
+        if not self.offload:
+            return udp.Port.doRead(self)
+        space = socket.CMSG_SPACE(_GRO_SIZE.size)
+        read = 0
+        while read < self.maxThroughput:
+            try:
+                data, ancdata, flags, addr = self.socket.recvmsg(65535, space)
+            except OSError as se:
+                no = se.args[0]
+                if no in _sockErrReadIgnore:
+                    return
+                if no == ECONNREFUSED:
+                    if self._connectedAddr:
+                        self.protocol.connectionRefused()
+                    return
+                raise
+            read += len(data)
+            if self.addressFamily == socket.AF_INET6:
+                addr = addr[:2]
+            size = len(data)
+            for level, kind, value in ancdata:
+                if level == SOL_UDP and kind == UDP_GRO:
+                    size, = _GRO_SIZE.unpack_from(value)
+            for offset in range(0, len(data), size) if data else (0,):
+                try:
+                    self.protocol.datagramReceived(data[offset:offset + size],
+                                                   addr)
+                except BaseException:
+                    log.err()
+
+    def writeBatch(self, datagrams, addr=None):
+        """Send C{datagrams} to C{addr} or, if this port is connected, to the
+        connected address.
+
+        With L{offload}, each run of datagrams of the same size (and one
+        shorter datagram, that may end it) is sent with a single C{sendmsg}
+        call, that carries the size of the segments (C{UDP_SEGMENT}). The
+        other datagrams are sent one by one.
+
+        @param datagrams: the datagrams. Each one is a bytes-like object or a
+        C{tuple} of the bytes-like objects, that it consists of (see
+        L{writeBuffers}).
+        @type datagrams: C{list}
+
+        @param addr: the address to send the datagrams to, C{None} in connected
+        mode
+        @type addr: C{(str, int)} or C{NoneType}
+
+        @return: the number of datagrams, that were sent
+        @rtype: C{int}
+
+        """
+        count = len(datagrams)
+        start = 0
+        while start < count:
+            if not self.offload:
+                for datagram in datagrams[start:]:
+                    self._writeDatagram(datagram, addr)
+                break
+            size = _length(datagrams[start])
+            limit = min(count, start + min(_MAX_SEGMENTS,
+                                           _MAX_PAYLOAD // max(size, 1)))
+            end = start + 1
+            while end < limit and _length(datagrams[end]) == size:
+                end += 1
+            if end < limit and _length(datagrams[end]) < size:
+                end += 1
+            if end - start == 1:
+                self._writeDatagram(datagrams[start], addr)
+            else:
+                self._writeSegments(datagrams[start:end], size, addr)
+            start = end
+        return count
+
+    def _writeDatagram(self, datagram, addr):
+        if type(datagram) is tuple:
+            self.writeBuffers(datagram, addr)
+        else:
+            self.write(datagram, addr)
+
+    def _writeSegments(self, datagrams, size, addr):
+        buffers = []
+        for datagram in datagrams:
+            if type(datagram) is tuple:
+                buffers.extend(datagram)
+            else:
+                buffers.append(datagram)
+        ancillary = [(SOL_UDP, UDP_SEGMENT, _SEGMENT.pack(size))]
+        try:
+            if self._connectedAddr:
+                return self.socket.sendmsg(buffers, ancillary)
+            return self.socket.sendmsg(buffers, ancillary, 0, addr)
+        except OSError as se:
+            no = se.args[0]
+            if no == EINTR:
+                return self._writeSegments(datagrams, size, addr)
+            elif no == EMSGSIZE:
+                raise error.MessageLengthError("message too long")
+            elif no == ECONNREFUSED:
+                if self._connectedAddr:
+                    self.protocol.connectionRefused()
+            elif no in (EAGAIN, EWOULDBLOCK):
+                return
+            else:
+                # The route doesn't support the offload after all (EIO, when
+                # the device can't checksum)
+                log.msg("Segmentation offload failed, disabled: %s" % (se,))
+                self.offload = False
+                for datagram in datagrams:
+                    self._writeDatagram(datagram, addr)
+
+    def writeBuffers(self, buffers, addr=None):
+        """Send a datagram, that consists of C{buffers}, to C{addr} or, if this
+        port is connected, to the connected address. Errors are handled as
+        L{write<twisted.internet.udp.Port.write>} handles them.
+
+        @param buffers: the parts of the datagram
+        @type buffers: a sequence of bytes-like objects
+
+        @param addr: the address to send the datagram to, C{None} in connected
+        mode
+        @type addr: C{(str, int)} or C{NoneType}
+
+        """
+        try:
+            if self._connectedAddr:
+                return self.socket.sendmsg(buffers)
+            return self.socket.sendmsg(buffers, (), 0, addr)
+        except OSError as se:
+            no = se.args[0]
+            if no == EINTR:
+                return self.writeBuffers(buffers, addr)
+            elif no == EMSGSIZE:
+                raise error.MessageLengthError("message too long")
+            elif no == ECONNREFUSED:
+                if self._connectedAddr:
+                    self.protocol.connectionRefused()
+            else:
+                raise
+
+
+if _recvmmsg is not None:
+
+    # The layouts of the headers, that recvmmsg and sendmmsg take. Their fields
+    # are read and written with the structs below, at these offsets.
+    class _msghdr(ctypes.Structure):
+        _fields_ = [('msg_name', ctypes.c_void_p),
+                    ('msg_namelen', ctypes.c_uint32),
+                    ('msg_iov', ctypes.c_void_p),
+                    ('msg_iovlen', ctypes.c_size_t),
+                    ('msg_control', ctypes.c_void_p),
+                    ('msg_controllen', ctypes.c_size_t),
+                    ('msg_flags', ctypes.c_int)]
+
+    class _mmsghdr(ctypes.Structure):
+        _fields_ = [('msg_hdr', _msghdr), ('msg_len', ctypes.c_uint)]
+
+    class _Py_buffer(ctypes.Structure):
+        _fields_ = [('buf', ctypes.c_void_p), ('obj', ctypes.c_void_p),
+                    ('len', ctypes.c_ssize_t), ('itemsize', ctypes.c_ssize_t),
+                    ('readonly', ctypes.c_int), ('ndim', ctypes.c_int),
+                    ('format', ctypes.c_char_p), ('shape', ctypes.c_void_p),
+                    ('strides', ctypes.c_void_p),
+                    ('suboffsets', ctypes.c_void_p),
+                    ('internal', ctypes.c_void_p)]
+
+    _MMSGHDR_SIZE = ctypes.sizeof(_mmsghdr)
+    _MSG_NAME = _msghdr.msg_name.offset
+    _MSG_NAMELEN = _msghdr.msg_namelen.offset
+    _MSG_IOV = _msghdr.msg_iov.offset
+    _MSG_IOVLEN = _msghdr.msg_iovlen.offset
+    _MSG_LEN = _mmsghdr.msg_len.offset
+
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint,
+                          ctypes.c_int, ctypes.c_void_p]
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint,
+                          ctypes.c_int]
+    _GetBuffer = ctypes.pythonapi.PyObject_GetBuffer
+    _GetBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(_Py_buffer),
+                           ctypes.c_int]
+    _ReleaseBuffer = ctypes.pythonapi.PyBuffer_Release
+    _ReleaseBuffer.argtypes = [ctypes.POINTER(_Py_buffer)]
+
+_POINTER = Struct('@P')
+_SIZE = Struct('@N')
+_UINT = Struct('@I')
+# A pointer and a length: struct iovec and msg_iov, msg_iovlen of struct msghdr
+_PAIR = Struct('@PN')
+
+
+def _address(data, held):
+    """Get the address and the length of the memory of a bytes-like object.
+    The objects, that keep the memory of the object exported, are appended to
+    C{held}: the C{_Py_buffer}s among them must be released with
+    C{_ReleaseBuffer}.
+
+    """
+    try:
+        exported = ctypes.c_char.from_buffer(data)
+    except ValueError:
+        # Nothing to send
+        return 0, 0
+    except TypeError:
+        # Read-only, like the slices of the files, that were mapped
+        view = _Py_buffer()
+        _GetBuffer(data, ctypes.byref(view), 0)
+        held.append(view)
+        return view.buf, view.len
+    held.append(exported)
+    return ctypes.addressof(exported), len(data)
+
+
+def _sockaddr(family, addr):
+    host, port = addr[:2]
+    if family == socket.AF_INET6:
+        return (_FAMILY.pack(family) + _PORT.pack(port) + bytes(4) +
+                socket.inet_pton(family, host) + bytes(4))
+    return (_FAMILY.pack(family) + _PORT.pack(port) +
+            socket.inet_pton(family, host) + bytes(8))
+
+
+class BatchPort(ScatterPort):
+    """A UDP port, that receives and sends the datagrams in batches, with
+    C{recvmmsg} and C{sendmmsg}, instead of making a system call for each one.
+    These are only available on Linux.
+
+    When the socket is readable, up to L{batch_size} datagrams are received at
+    once, until there are no more or
+    L{maxThroughput<twisted.internet.udp.Port.maxThroughput>} bytes were read.
+    They are passed to the protocol one by one, as usual. If L{send_batches} is
+    set, several datagrams are sent at once with L{writeBatch}. If L{offload}
+    is set and supported, it is used instead.
+
+    @ivar batch_size: the largest number of datagrams to receive with a single
+    system call
+    @type batch_size: C{int}
+
+    @cvar send_batches: whether L{writeBatch} sends the datagrams with a single
+    C{sendmmsg} call. It's off by default: building the headers for it costs
+    more, than the system calls, that it saves (see C{benchmarks/batching.py}),
+    so the datagrams are sent one by one, like L{ScatterPort} sends them.
+    @type send_batches: C{bool}
+
+    """
+    send_batches = False
+
+    def __init__(self, port, proto, interface='', maxPacketSize=8192,
+                 reactor=None, batch_size=32):
+        ScatterPort.__init__(self, port, proto, interface, maxPacketSize,
+                             reactor)
+        self.batch_size = batch_size
+        self._addresses = {}
+
+    def _receiveBuffers(self):
+        """Get the receive buffers and the headers, that point to them.
+
+        The ports with the same batch and packet size share them: the data is
+        copied out of them, before it is passed to the protocol, and the ports
+        are read one at a time.
+
+        @return: views of the data, of the addresses and of the headers, the
+        original headers, that the ones, that were used, are reset from, and the
+        address of the headers
+
+        """
+        batch, size = self.batch_size, self.maxPacketSize
+        buffers = _receiveBuffers.get((batch, size))
+        if buffers is not None:
+            return buffers
+        data = bytearray(batch * size)
+        names = bytearray(batch * _NAMELEN)
+        iovecs = bytearray(batch * _PAIR.size)
+        messages = bytearray(batch * _MMSGHDR_SIZE)
+        exported = [ctypes.c_char.from_buffer(buf)
+                    for buf in (data, names, iovecs, messages)]
+        data_address, names_address, iovecs_address, messages_address = [
+            ctypes.addressof(c) for c in exported]
+        for i in range(batch):
+            _PAIR.pack_into(iovecs, i * _PAIR.size,
+                             data_address + i * size, size)
+            offset = i * _MMSGHDR_SIZE
+            _POINTER.pack_into(messages, offset + _MSG_NAME,
+                               names_address + i * _NAMELEN)
+            _UINT.pack_into(messages, offset + _MSG_NAMELEN, _NAMELEN)
+            _POINTER.pack_into(messages, offset + _MSG_IOV,
+                               iovecs_address + i * _PAIR.size)
+            _SIZE.pack_into(messages, offset + _MSG_IOVLEN, 1)
+        buffers = _receiveBuffers[batch, size] = (
+            memoryview(data), memoryview(names), memoryview(messages),
+            memoryview(bytes(messages)), messages_address, exported)
+        return buffers
+
+    def _parseAddress(self, raw):
+        addr = self._addresses.get(raw)
+        if addr is None:
+            family, = _FAMILY.unpack_from(raw)
+            port, = _PORT.unpack_from(raw, 2)
+            if family == socket.AF_INET6:
+                addr = socket.inet_ntop(family, raw[8:24]), port
+            else:
+                addr = socket.inet_ntop(family, raw[4:8]), port
+            if len(self._addresses) >= 1024:
+                self._addresses.clear()
+            self._addresses[raw] = addr
+        return addr
+
+    def doRead(self):
+        """Called when my socket is ready for reading. Receive the datagrams in
+        batches and pass them to the protocol. With L{offload}, this is left to
+        L{ScatterPort.doRead}, which receives the coalesced datagrams.
+
+        """
+        if self.offload:
+            return ScatterPort.doRead(self)
+        batch, size = self.batch_size, self.maxPacketSize
+        data, names, messages, template, address = self._receiveBuffers()[:5]
+        addresses = self._addresses
+        read = 0
+        while read < self.maxThroughput:
+            count = _recvmmsg(self.fileno(), address, batch, 0, None)
+            if count < 0:
+                no = ctypes.get_errno()
+                if no in _sockErrReadIgnore:
+                    return
+                if no == ECONNREFUSED:
+                    if self._connectedAddr:
+                        self.protocol.connectionRefused()
+                    return
+                raise OSError(no, os.strerror(no))
+            for i in range(count):
+                offset = i * _MMSGHDR_SIZE
+                length, = _UINT.unpack_from(messages, offset + _MSG_LEN)
+                namelen, = _UINT.unpack_from(messages, offset + _MSG_NAMELEN)
+                raw = names[i * _NAMELEN:i * _NAMELEN + namelen].tobytes()
+                addr = addresses.get(raw) or self._parseAddress(raw)
+                read += length
+                try:
+                    self.protocol.datagramReceived(
+                        data[i * size:i * size + length].tobytes(), addr)
+                except BaseException:
+                    log.err()
+            # The lengths of the addresses were overwritten
+            messages[:count * _MMSGHDR_SIZE] = template[:count * _MMSGHDR_SIZE]
+            if count < batch:
+                return
+
+    def writeBatch(self, datagrams, addr=None):
+        """Send C{datagrams} to C{addr} or, if this port is connected, to the
+        connected address. With L{send_batches}, they are sent with as few
+        system calls as possible.
+
+        If the send buffer of the socket fills up, the rest of the datagrams is
+        dropped, as it would be, if the network dropped them.
+
+        @param datagrams: the datagrams. Each one is a bytes-like object or a
+        C{tuple} of the bytes-like objects, that it consists of (see
+        L{writeBuffers}).
+        @type datagrams: C{list}
+
+        @param addr: the address to send the datagrams to, C{None} in connected
+        mode
+        @type addr: C{(str, int)} or C{NoneType}
+
+        @return: the number of datagrams, that were sent
+        @rtype: C{int}
+
+        """
+        if self.offload or not self.send_batches:
+            return ScatterPort.writeBatch(self, datagrams, addr)
+        count = len(datagrams)
+        capacity = 0
+        for datagram in datagrams:
+            capacity += len(datagram) if type(datagram) is tuple else 1
+        iovecs = bytearray(capacity * _PAIR.size)
+        messages = bytearray(count * _MMSGHDR_SIZE)
+        held = [ctypes.c_char.from_buffer(iovecs),
+                ctypes.c_char.from_buffer(messages)]
+        iovecs_address = ctypes.addressof(held[0])
+        pack_into = _PAIR.pack_into
+        try:
+            if self._connectedAddr:
+                name = None
+            else:
+                name = _sockaddr(self.addressFamily, addr)
+                name_address = _address(name, held)[0]
+            vector = 0
+            for i, datagram in enumerate(datagrams):
+                message = i * _MMSGHDR_SIZE
+                parts = datagram if type(datagram) is tuple else (datagram,)
+                for j, part in enumerate(parts):
+                    pack_into(iovecs, (vector + j) * _PAIR.size,
+                              *_address(part, held))
+                if name is not None:
+                    _POINTER.pack_into(messages, message + _MSG_NAME,
+                                       name_address)
+                    _UINT.pack_into(messages, message + _MSG_NAMELEN, len(name))
+                pack_into(messages, message + _MSG_IOV,
+                          iovecs_address + vector * _PAIR.size, len(parts))
+                vector += len(parts)
+            return self._sendBatch(ctypes.addressof(held[1]), count)
+        finally:
+            for view in held:
+                if type(view) is _Py_buffer:
+                    _ReleaseBuffer(ctypes.byref(view))
+
+    def _sendBatch(self, base, count):
+        sent = 0
+        while sent < count:
+            result = _sendmmsg(self.fileno(), base + sent * _MMSGHDR_SIZE,
+                               count - sent, 0)
+            if result >= 0:
+                sent += result
+                continue
+            no = ctypes.get_errno()
+            if no == EINTR:
+                continue
+            elif no == EMSGSIZE:
+                raise error.MessageLengthError("message too long")
+            elif no == ECONNREFUSED:
+                if self._connectedAddr:
+                    self.protocol.connectionRefused()
+                return sent
+            elif no in (EAGAIN, EWOULDBLOCK):
+                return sent
+            raise OSError(no, os.strerror(no))
+        return sent
+
+
+def maxPayload(remote, transport=None):
+    """Find out the largest UDP payload, that can be sent to C{remote} without
+    being fragmented, from the MTU of the path to it, as the kernel knows it.
+
+    The MTU is read from the socket of C{transport}, if it is connected to
+    C{remote}, or from a socket, that is connected to C{remote} only to ask it
+    (nothing is sent), if it's not, like the shared and the pooled sockets.
+
+    @param remote: the address of the remote peer
+    @type remote: C{(str, int)}
+
+    @param transport: the transport, that the datagrams are sent with
+
+    @return: the payload size or C{None}, if the platform can't tell
+    @rtype: C{int} or C{NoneType}
+
+    """
+    family = socket.AF_INET6 if isIPv6Address(remote[0]) else socket.AF_INET
+    if family not in _MTU_OPTIONS:
+        return None
+    level, option = _MTU_OPTIONS[family]
+    sock = getattr(transport, 'socket', None)
+    if sock is not None and sock.family == family:
+        try:
+            return sock.getsockopt(level, option) - _HEADERS[family]
+        except OSError:
+            # Not connected
+            pass
+    probe = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        probe.connect(remote)
+        return probe.getsockopt(level, option) - _HEADERS[family]
+    except OSError:
+        return None
+    finally:
+        probe.close()
+
+
+def _supported(_reactor, batch_size):
+    if PosixReactorBase is None or not isinstance(_reactor, PosixReactorBase):
+        return None
+    if batch_size and _recvmmsg is not None:
+        return BatchPort
+    if hasattr(socket.socket, 'sendmsg'):
+        return ScatterPort
+    return None
+
+
+def listenUDP(port, protocol, interface='', _reactor=reactor, batch_size=0,
+              offload=False, max_packet_size=8192):
+    """Like L{listenUDP<twisted.internet.interfaces.IReactorUDP.listenUDP>},
+    but listen on a L{BatchPort}, if C{batch_size} is given, or on a
+    L{ScatterPort}, if the reactor and the platform support them, or on
+    whatever port the reactor provides otherwise.
+
+    @param batch_size: the number of datagrams to receive at once (0 receives
+    them one by one)
+    @type batch_size: C{int}
+
+    @param offload: whether to use the UDP segmentation and receive offloads,
+    if the kernel supports them (see L{ScatterPort})
+    @type offload: C{bool}
+
+    @param max_packet_size: the largest datagram, that can be received
+    @type max_packet_size: C{int}
+
+    @return: the listening port
+    @rtype: L{BatchPort}, L{ScatterPort} or L{IListeningPort<twisted.internet.interfaces.IListeningPort>}
+
+    """
+    portType = _supported(_reactor, batch_size)
+    if portType is None:
+        return _reactor.listenUDP(port, protocol, interface, max_packet_size)
+    if portType is BatchPort:
+        p = BatchPort(port, protocol, interface, max_packet_size,
+                      reactor=_reactor, batch_size=batch_size)
+    else:
+        p = portType(port, protocol, interface, max_packet_size,
+                     reactor=_reactor)
+    p.offload = offload
+    p.startListening()
+    return p
+
+
+def adoptDatagramPort(fileDescriptor, addressFamily, protocol,
+                      _reactor=reactor, batch_size=0, max_packet_size=8192):
+    """Like L{adoptDatagramPort<twisted.internet.interfaces.IReactorSocket.adoptDatagramPort>},
+    but adopt the socket as a L{BatchPort} or a L{ScatterPort}, like
+    L{listenUDP} does.
+
+    @param max_packet_size: see L{listenUDP}
+    @type max_packet_size: C{int}
+
+    """
+    portType = _supported(_reactor, batch_size)
+    if portType is None:
+        return _reactor.adoptDatagramPort(fileDescriptor, addressFamily,
+                                          protocol, max_packet_size)
+    p = portType._fromListeningDescriptor(
+        _reactor, fileDescriptor, addressFamily, protocol, max_packet_size)
+    if portType is BatchPort:
+        p.batch_size = batch_size
+    p.startListening()
+    return p
+
+
+class UDPServer(internet.UDPServer):
+    """Like L{UDPServer<twisted.application.internet.UDPServer>}, but listens
+    with L{listenUDP} of this module.
+
+    @param batch_size: see L{listenUDP}
+    @type batch_size: C{int}
+
+    @param max_packet_size: see L{listenUDP}
+    @type max_packet_size: C{int}
+
+    """
+
+    def __init__(self, port, protocol, interface='', batch_size=0,
+                 max_packet_size=8192):
+        internet.UDPServer.__init__(self, port, protocol, interface=interface)
+        self.batch_size = batch_size
+        self.max_packet_size = max_packet_size
+
+    def _getPort(self):
+        return listenUDP(self.args[0], self.args[1], self.kwargs['interface'],
+                         batch_size=self.batch_size,
+                         max_packet_size=self.max_packet_size)
@@ -8,7 +8,7 @@ from twisted.internet.defer import CancelledError, maybeDeferred
 from twisted.internet.task import deferLater
 
 
-__all__ = ['CANCELLED', 'deferred', 'timedCaller']
+__all__ = ['CANCELLED', 'SessionTimer', 'deferred', 'timedCaller']
 
 
 # Token used by L{timedCaller} to denote that it was cancelled instead of
@@ -55,6 +55,88 @@ def timedCaller(timings, call, last, clock=reactor):
     return iterate().addErrback(squashCancelled)
 
 
+class SessionTimer(object):
+    """A resettable counterpart of L{timedCaller} for the hot path of a session.
+
+    Every L{start} walks through the given timings like L{timedCaller} does:
+    C{call} is called after every delay but the last one and C{last} is called
+    after the last delay. Instead of a chain of L{Deferred}s per run, a single
+    L{IDelayedCall<twisted.internet.interfaces.IDelayedCall>} is kept and
+    L{reset<twisted.internet.interfaces.IDelayedCall.reset>} whenever possible.
+
+    L{stop} leaves the delayed call scheduled, so that the next L{start} can
+    reuse it; if it fires while the timer is stopped, nothing happens. Use
+    L{cancel} to get rid of it for good.
+
+    @ivar running: whether or not the timer is running
+    @type running: C{bool}
+
+    """
+
+    def __init__(self, call, last, clock=reactor):
+        self.call = call
+        self.last = last
+        self.clock = clock
+        self.running = False
+        self._delayed_call = None
+        self._timings = None
+
+    def start(self, timings, first_delay=None):
+        """(Re)start the timer.
+
+        @param timings: an iterable of delays, as for L{timedCaller}
+        @type timings: any iterable
+
+        @param first_delay: if given, an extra delay, that goes before
+        C{timings}. It saves building a new iterable for the common case of
+        sending something right away and then waiting.
+        @type first_delay: C{int} or C{float}
+
+        @raise ValueError: if no timings are specified
+        """
+        self._timings = iter(timings)
+        if first_delay is None:
+            try:
+                first_delay = next(self._timings)
+            except StopIteration:
+                raise ValueError("No timings specified.")
+        self.running = True
+        self._schedule(first_delay)
+
+    def _schedule(self, delay):
+        delayed_call = self._delayed_call
+        if delayed_call is not None and delayed_call.active():
+            delayed_call.reset(delay)
+        else:
+            self._delayed_call = self.clock.callLater(delay, self._fire)
+
+    def _fire(self):
+        self._delayed_call = None
+        if not self.running:
+            return
+        try:
+            delay = next(self._timings)
+        except StopIteration:
+            self.running = False
+            self._timings = None
+            self.last()
+        else:
+            self._schedule(delay)
+            self.call()
+
+    def stop(self):
+        """Stop the timer. The underlying delayed call is kept for reuse."""
+        self.running = False
+        self._timings = None
+
+    def cancel(self):
+        """Stop the timer and cancel the underlying delayed call"""
+        self.stop()
+        if self._delayed_call is not None and self._delayed_call.active():
+            self._delayed_call.cancel()
+        self._delayed_call = None
+
+
 def iterlast(iterable):
     """Generate C{(is_last, item)} tuples from C{iterable}.
 
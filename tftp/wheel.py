@@ -0,0 +1,211 @@
+'''
+@author: shylent
+'''
+from twisted.internet import reactor
+from twisted.internet.base import DelayedCall
+from twisted.internet.interfaces import IReactorTime
+from twisted.python import log
+from zope import interface
+
+
+__all__ = ['TimingWheel']
+
+
+# Tolerance for the floating point error of converting times into ticks
+_EPSILON = 1e-9
+
+
+@interface.implementer(IReactorTime)
+class TimingWheel(object):
+    """A hierarchical timing wheel, that coalesces delayed calls into ticks.
+
+    Every delayed call of every session would otherwise be a separate entry in
+    the reactor's heap of timed calls. The wheel keeps them in buckets instead
+    and uses a single timed call of the underlying clock to advance one tick
+    at a time, no matter how many calls are pending.
+
+    The wheel provides L{IReactorTime}, so it can be passed as C{_clock} to the
+    sessions and bootstrap protocols. A delayed call fires at the end of the
+    tick, that it falls into, i.e. at most C{granularity} seconds late, but
+    never early. Calls, that are already due (zero delay), are not rounded up
+    to the next tick; they are run together in a single call of the underlying
+    clock.
+
+    Level M{n} of the wheel has C{slots} buckets, each covering
+    C{slots ** n} ticks. Calls, that are further in the future, than the top
+    level covers, are parked in its last bucket and placed again when that
+    bucket is cascaded.
+
+    @param clock: the underlying clock
+    @type clock: L{IReactorTime} provider
+
+    @param granularity: length of a tick, in seconds
+    @type granularity: C{float}
+
+    @param slots: number of buckets per level
+    @type slots: C{int}
+
+    @param levels: number of levels
+    @type levels: C{int}
+
+    """
+
+    def __init__(self, clock=reactor, granularity=0.05, slots=256, levels=3):
+        self.clock = clock
+        self.granularity = granularity
+        self.slots = slots
+        self.wheels = [[set() for i in range(slots)] for level in range(levels)]
+        self.spans = [slots ** level for level in range(levels)]
+        self.origin = clock.seconds()
+        self.tick = 0
+        self.pending = 0
+        self.due = set()
+        self._ticker = None
+        self._runner = None
+        self._advancing = False
+        self._sequence = 0
+
+    def seconds(self):
+        """
+        @see: L{IReactorTime.seconds}
+
+        """
+        return self.clock.seconds()
+
+    def callLater(self, delay, callable, *args, **kw):
+        """
+        @see: L{IReactorTime.callLater}
+
+        """
+        call = DelayedCall(self.seconds() + delay, callable, args, kw,
+                           self._cancel, self._reset, seconds=self.seconds)
+        self._insert(call)
+        return call
+
+    def getDelayedCalls(self):
+        """
+        @see: L{IReactorTime.getDelayedCalls}
+
+        """
+        calls = list(self.due)
+        for wheel in self.wheels:
+            for bucket in wheel:
+                calls.extend(bucket)
+        return calls
+
+    def _tickOf(self, when):
+        """Get the number of the tick, at the end of which C{when} is due"""
+        ticks = (when - self.origin) / self.granularity
+        tick = int(ticks)
+        if ticks - tick > _EPSILON:
+            tick += 1
+        return tick
+
+    def _elapsedTicks(self):
+        """Get the number of ticks, that have fully elapsed by now"""
+        return int((self.seconds() - self.origin) / self.granularity + _EPSILON)
+
+    def _insert(self, call):
+        if not self.pending:
+            # Nothing is scheduled, so there is nothing to cascade. Skip the
+            # idle ticks.
+            self.tick = max(self.tick, self._elapsedTicks())
+        self.pending += 1
+        # Calls, that are due at the same time, are run in the order of
+        # scheduling, like the reactor does
+        self._sequence += 1
+        call._sequence = self._sequence
+        if call.getTime() <= self.seconds():
+            call._bucket = self.due
+            self.due.add(call)
+            if self._runner is None:
+                self._runner = self.clock.callLater(0, self._runDue)
+            return
+        self._place(call)
+        if self._ticker is None and not self._advancing:
+            self._scheduleTick()
+
+    def _scheduleTick(self):
+        # Err on the early side, _elapsedTicks tolerates that
+        self._ticker = self.clock.callLater(
+            self.origin + (self.tick + 1 - _EPSILON) * self.granularity -
+            self.seconds(), self._advance)
+
+    def _place(self, call):
+        expires = max(self._tickOf(call.getTime()), self.tick + 1)
+        distance = expires - self.tick
+        spans = self.spans
+        top = len(spans) - 1
+        for level in range(top + 1):
+            if level == top or distance < spans[level] * self.slots:
+                break
+        if distance >= spans[top] * self.slots:
+            expires = self.tick + spans[top] * self.slots - 1
+        bucket = self.wheels[level][(expires // spans[level]) % self.slots]
+        call._bucket = bucket
+        bucket.add(call)
+
+    def _remove(self, call):
+        call._bucket.discard(call)
+        call._bucket = None
+        self.pending -= 1
+
+    def _cancel(self, call):
+        self._remove(call)
+
+    def _reset(self, call):
+        self._remove(call)
+        self._insert(call)
+
+    def _run(self, calls):
+        for call in sorted(calls,
+                           key=lambda call: (call.getTime(), call._sequence)):
+            if not call.active() or call._bucket is None:
+                continue
+            self._remove(call)
+            if call.delayed_time > 0:
+                # Postponed by reset() or delay(), which are lazy about it
+                call.activate_delay()
+                self._insert(call)
+                continue
+            call.called = 1
+            try:
+                call.func(*call.args, **call.kw)
+            except:
+                log.err(None, "Unhandled error in a delayed call")
+
+    def _runDue(self):
+        self._runner = None
+        due, self.due = self.due, set()
+        self._run(due)
+
+    def _advance(self):
+        self._ticker = None
+        self._advancing = True
+        try:
+            self._catchUp()
+        finally:
+            self._advancing = False
+        if self.pending and self._ticker is None:
+            self._scheduleTick()
+
+    def _catchUp(self):
+        now = self._elapsedTicks()
+        while self.pending and self.tick < now:
+            self.tick += 1
+            for level in range(1, len(self.spans)):
+                if self.tick % self.spans[level]:
+                    break
+                index = (self.tick // self.spans[level]) % self.slots
+                bucket = self.wheels[level][index]
+                self.wheels[level][index] = set()
+                for call in bucket:
+                    call._bucket = None
+                    self.pending -= 1
+                    self._insert(call)
+            index = self.tick % self.slots
+            bucket = self.wheels[0][index]
+            self.wheels[0][index] = set()
+            for call in bucket:
+                call._bucket = bucket
+            self._run(bucket)
@@ -0,0 +1,167 @@
+'''
+@author: shylent
+'''
+from tftp.udp import adoptDatagramPort
+from twisted.application import service
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.error import ProcessExitedAlready
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python import log
+import os
+import socket
+import sys
+
+
+__all__ = ['ReusePortUDPServer', 'WorkerSupervisor']
+
+
+class ReusePortUDPServer(service.Service):
+    """Like L{UDPServer<twisted.application.internet.UDPServer>}, but binds the
+    port with C{SO_REUSEPORT}, so that several processes can listen on it at
+    the same time. The kernel spreads the incoming datagrams between them by
+    the source address, so all of the datagrams of a client go to the same
+    process.
+
+    @param port: port number to listen on
+    @type port: C{int}
+
+    @param protocol: the datagram protocol to run on the port
+    @type protocol: L{DatagramProtocol}
+
+    @param interface: local address to bind to
+    @type interface: C{str}
+
+    @param batch_size: the number of datagrams to receive at once (see
+    L{listenUDP<tftp.udp.listenUDP>})
+    @type batch_size: C{int}
+
+    @param max_packet_size: the largest datagram, that can be received
+    @type max_packet_size: C{int}
+
+    """
+
+    def __init__(self, port, protocol, interface='', _reactor=reactor,
+                 batch_size=0, max_packet_size=8192):
+        self.port = port
+        self.protocol = protocol
+        self.interface = interface
+        self.batch_size = batch_size
+        self.max_packet_size = max_packet_size
+        self._reactor = _reactor
+        self._port = None
+
+    def startService(self):
+        service.Service.startService(self)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.interface, self.port))
+            sock.setblocking(False)
+            # The reactor makes a copy of the file descriptor
+            self._port = adoptDatagramPort(
+                sock.fileno(), socket.AF_INET, self.protocol, self._reactor,
+                self.batch_size, self.max_packet_size)
+        finally:
+            sock.close()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self._port is not None:
+            port, self._port = self._port, None
+            return port.stopListening()
+
+
+class WorkerProtocol(ProcessProtocol):
+    """Tells the L{WorkerSupervisor}, when its worker process ends"""
+
+    def __init__(self, supervisor, number):
+        self.supervisor = supervisor
+        self.number = number
+
+    def processEnded(self, reason):
+        self.supervisor.workerEnded(self.number, reason)
+
+
+class WorkerSupervisor(service.Service):
+    """Runs a number of worker processes and restarts any of them, that end
+    while this service is running.
+
+    @cvar restart_delay: seconds to wait before restarting a worker, so that
+    a worker, that fails right away, doesn't make us spin
+    @type restart_delay: C{float}
+
+    @ivar count: number of workers
+    @type count: C{int}
+
+    @ivar args: command line of a worker, without the executable
+    @type args: C{list} of C{str}
+
+    @ivar workers: the running worker processes, by worker number
+    @type workers: C{dict} of L{IProcessTransport}
+
+    @ivar restarts: how many times the workers were restarted
+    @type restarts: C{int}
+
+    """
+    restart_delay = 1.0
+
+    def __init__(self, count, args, executable=sys.executable, _reactor=reactor):
+        self.count = count
+        self.args = args
+        self.executable = executable
+        self.workers = {}
+        self.restarts = 0
+        self._reactor = _reactor
+        self._pending = {}
+        self._stopped = None
+
+    def startService(self):
+        service.Service.startService(self)
+        for number in range(self.count):
+            self.spawn(number)
+
+    def spawn(self, number):
+        """Start the worker process number C{number}"""
+        self._pending.pop(number, None)
+        self.workers[number] = self._reactor.spawnProcess(
+            WorkerProtocol(self, number), self.executable,
+            [self.executable] + list(self.args), env=os.environ,
+            childFDs={0: 'w', 1: 1, 2: 2})
+
+    def workerEnded(self, number, reason):
+        """The worker process number C{number} has ended. Restart it, unless
+        we are stopping.
+
+        """
+        del self.workers[number]
+        if self.running:
+            log.msg("Worker %s has ended (%s), restarting" %
+                    (number, reason.getErrorMessage()))
+            self.restarts += 1
+            self._pending[number] = self._reactor.callLater(
+                self.restart_delay, self.spawn, number)
+        elif not self.workers and self._stopped is not None:
+            stopped, self._stopped = self._stopped, None
+            stopped.callback(None)
+
+    def stopService(self):
+        """Stop all of the workers.
+
+        @return: a L{Deferred}, that fires when all of the workers have ended
+        @rtype: L{Deferred}
+
+        """
+        service.Service.stopService(self)
+        for call in self._pending.values():
+            call.cancel()
+        self._pending.clear()
+        if not self.workers:
+            return succeed(None)
+        self._stopped = Deferred()
+        for worker in list(self.workers.values()):
+            try:
+                worker.signalProcess('TERM')
+            except ProcessExitedAlready:
+                pass
+        return self._stopped
@@ -1,9 +1,14 @@
 '''
 @author: shylent
 '''
-from tftp.backend import FilesystemSynchronousBackend
+from tftp.backend import (FilesystemAsynchronousBackend,
+    FilesystemSynchronousBackend)
+from tftp.cache import CachingBackend
 from tftp.protocol import TFTP
-from twisted.application import internet
+from tftp.session import MAX_BLOCK_SIZE, MAX_WINDOW_SIZE
+from tftp.shm import SharedMemoryCacheBackend
+from tftp.udp import UDPServer
+from tftp.workers import ReusePortUDPServer, WorkerSupervisor
 from twisted.application.service import IServiceMaker
 from twisted.plugin import IPlugin
 from twisted.python import usage
@@ -18,16 +23,138 @@ class TFTPOptions(usage.Options):
     optFlags = [
         ['enable-reading', 'r', 'Lets the clients read from this server.'],
         ['enable-writing', 'w', 'Lets the clients write to this server.'],
-        ['verbose', 'v', 'Make this server noisy.']
+        ['verbose', 'v', 'Make this server noisy.'],
+        ['adaptive-timeout', None,
+         'Derive retransmission timeouts from the measured round trip time.'],
+        ['reuse-port', None,
+         'Bind the port with SO_REUSEPORT, so that other processes can listen '
+         'on it too.'],
+        ['mmap', None,
+         'Map the files, that are read, into memory instead of reading them. '
+         'The files must not be modified in place while they are served.'],
+        ['share-descriptors', None,
+         'Let the transfers of the same file read it through one shared file '
+         'descriptor, that is closed, once it has been idle for a while.'],
+        ['advise', None,
+         'Tell the kernel, that the files are read sequentially, so that it '
+         'reads ahead more.'],
+        ['atomic-writes', None,
+         'Write the uploads to temporary files next to the target files and '
+         'link them into place, once they are complete.'],
+        ['offload', None,
+         'Let the kernel split the windows into datagrams and coalesce the '
+         'incoming ones (UDP GSO and GRO), where it supports that.'],
+        ['path-mtu', None,
+         'Limit the block size to what fits into the MTU of the path to the '
+         'client, so that the data is not fragmented.']
     ]
     optParameters = [
         ['port', 'p', 1069, 'Port number to listen on.', int],
-        ['root-directory', 'd', None, 'Root directory for this server.', to_path]
+        ['root-directory', 'd', None, 'Root directory for this server.', to_path],
+        ['max-window-size', None, MAX_WINDOW_SIZE,
+         'Largest windowsize (RFC7440), that the clients may negotiate.', int],
+        ['max-block-size', None, MAX_BLOCK_SIZE,
+         'Largest blksize (RFC2348), that the clients may negotiate.', int],
+        ['timer-granularity', None, None,
+         'Schedule session timeouts on a timing wheel with ticks of this many '
+         'seconds.', float],
+        ['shared-sockets', None, 0,
+         'Carry all of the transfers over this many sockets instead of binding '
+         'a socket per transfer (0 disables sharing).', int],
+        ['port-pool', None, 0,
+         'Keep this many sockets bound ahead of time for new transfers '
+         '(0 disables the pool).', int],
+        ['workers', None, 0,
+         'Serve from this many worker processes, that share the port with '
+         'SO_REUSEPORT, and restart them if they die (0 serves from this '
+         'process).', int],
+        ['shared-cache', None, 0,
+         'Cache the files, that are read, in shared memory, that all of the '
+         'server processes on the host use, up to this many bytes (0 disables '
+         'the cache).', int],
+        ['memory-cache', None, 0,
+         'Keep the most recently read files in memory, up to this many bytes '
+         '(0 disables the cache).', int],
+        ['block-cache', None, 0,
+         'Share the encoded data blocks between the transfers of the same '
+         'file, up to this many bytes (0 disables the cache).', int],
+        ['batch-size', None, 0,
+         'Receive up to this many datagrams with a single system call, where '
+         'the platform supports it (0 receives them one by one).', int],
+        ['threads', None, 0,
+         'Open, read and write the files in a pool of up to this many threads, '
+         'so that a slow disk does not hold up the other transfers (0 does '
+         'it in the main thread).', int],
+        ['drop-behind', None, 0,
+         'Drop the files larger than this many bytes from the page cache '
+         'behind the transfers, so that streaming them does not evict the '
+         'other files (0 keeps them).', int],
+        ['write-buffer', None, 0,
+         'Gather the uploaded blocks and write them in pieces of this many '
+         'bytes (0 writes every block as it arrives).', int]
     ]
 
     def postOptions(self):
         if self['root-directory'] is None:
             raise usage.UsageError("You must provide a root directory for the server")
+        if not 1 <= self['max-window-size'] <= 65535:
+            raise usage.UsageError("Window size must be between 1 and 65535")
+        if not 8 <= self['max-block-size'] <= 65464:
+            raise usage.UsageError("Block size must be between 8 and 65464")
+        if self['timer-granularity'] is not None and self['timer-granularity'] <= 0:
+            raise usage.UsageError("Timer granularity must be positive")
+        if self['shared-sockets'] < 0:
+            raise usage.UsageError("Number of shared sockets must not be negative")
+        if self['port-pool'] < 0:
+            raise usage.UsageError("Port pool size must not be negative")
+        if self['workers'] < 0:
+            raise usage.UsageError("Number of workers must not be negative")
+        if self['shared-cache'] < 0:
+            raise usage.UsageError("Shared cache size must not be negative")
+        if self['memory-cache'] < 0:
+            raise usage.UsageError("Memory cache size must not be negative")
+        if self['memory-cache'] and self['shared-cache']:
+            raise usage.UsageError("Use either the shared or the memory cache")
+        if self['block-cache'] < 0:
+            raise usage.UsageError("Block cache size must not be negative")
+        if self['batch-size'] < 0:
+            raise usage.UsageError("Batch size must not be negative")
+        if self['threads'] < 0:
+            raise usage.UsageError("Number of threads must not be negative")
+        if self['threads'] and (self['mmap'] or self['shared-cache'] or
+                                self['memory-cache']):
+            raise usage.UsageError(
+                "Threads can not be combined with mmap or the file caches")
+        if self['share-descriptors'] and (
+                self['mmap'] or self['threads'] or self['shared-cache'] or
+                self['memory-cache']):
+            raise usage.UsageError(
+                "Shared descriptors can not be combined with mmap, threads or "
+                "the file caches")
+        if self['write-buffer'] < 0:
+            raise usage.UsageError("Write buffer size must not be negative")
+        if self['drop-behind'] < 0:
+            raise usage.UsageError("Drop behind size must not be negative")
+        if (self['advise'] or self['drop-behind']) and (
+                self['mmap'] or self['share-descriptors']):
+            raise usage.UsageError(
+                "Access hints can not be combined with mmap or shared "
+                "descriptors")
+
+    def workerArguments(self):
+        """Command line arguments, that run a worker with the same options"""
+        args = ['-m', 'twisted', 'tftp', '--reuse-port']
+        for name, short, doc in self.optFlags:
+            if self[name] and name != 'reuse-port':
+                args.append('--%s' % (name,))
+        for name, short, default, doc, coerce in self.optParameters:
+            value = self[name]
+            if name == 'workers' or value is None:
+                continue
+            if isinstance(value, FilePath):
+                value = value.path
+            args.append('--%s=%s' % (name, value))
+        return args
 
 
 @implementer(IServiceMaker, IPlugin)
@@ -37,9 +164,43 @@ class TFTPServiceCreator(object):
     options = TFTPOptions
 
     def makeService(self, options):
-        backend = FilesystemSynchronousBackend(options["root-directory"],
-                                               can_read=options['enable-reading'],
-                                               can_write=options['enable-writing'])
-        return internet.UDPServer(options['port'], TFTP(backend))
+        if options['workers']:
+            return WorkerSupervisor(options['workers'], options.workerArguments())
+        if options['threads']:
+            backend = FilesystemAsynchronousBackend(
+                options["root-directory"], can_read=options['enable-reading'],
+                can_write=options['enable-writing'], threads=options['threads'],
+                advise=options['advise'], drop_behind=options['drop-behind'],
+                atomic_writes=options['atomic-writes'])
+        else:
+            backend = FilesystemSynchronousBackend(
+                options["root-directory"], can_read=options['enable-reading'],
+                can_write=options['enable-writing'], use_mmap=options['mmap'],
+                share_descriptors=options['share-descriptors'],
+                advise=options['advise'], drop_behind=options['drop-behind'],
+                atomic_writes=options['atomic-writes'])
+        if options['shared-cache']:
+            backend = SharedMemoryCacheBackend(backend, options['shared-cache'])
+        if options['memory-cache']:
+            backend = CachingBackend(backend, options['memory-cache'])
+        protocol = TFTP(
+            backend, max_window_size=options['max-window-size'],
+            adaptive_timeout=options['adaptive-timeout'],
+            timer_granularity=options['timer-granularity'],
+            shared_sockets=options['shared-sockets'],
+            port_pool=options['port-pool'],
+            block_cache=options['block-cache'],
+            batch_size=options['batch-size'],
+            offload=options['offload'],
+            max_block_size=options['max-block-size'],
+            path_mtu=options['path-mtu'],
+            write_buffer=options['write-buffer'])
+        if options['reuse-port']:
+            return ReusePortUDPServer(options['port'], protocol,
+                                      batch_size=options['batch-size'],
+                                      max_packet_size=protocol.max_packet_size)
+        return UDPServer(options['port'], protocol,
+                         batch_size=options['batch-size'],
+                         max_packet_size=protocol.max_packet_size)
 
 serviceMaker = TFTPServiceCreator()